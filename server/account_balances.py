@@ -0,0 +1,78 @@
+"""
+Maintained account balances.
+
+An account's balance is SUM(account_transactions.amount) for its store and
+payment method. account_balances keeps that sum up to date, so GET /accounts
+and /shift-total read a handful of rows instead of the whole ledger. The
+statement triggers on account_transactions (account_balances_after_change)
+add every insert and delete in the writer's transaction, whoever writes the
+ledger: the cash_flow mirror, transfers or cascaded deletes.
+
+Each account is split into slot rows. A writer adds to the first slot no
+other open transaction holds (add_to_account_balance, with one advisory lock
+per slot), so concurrent sales never wait on each other's balance rows and
+there are only as many slots as concurrent writers. A balance is the SUM of
+its slots.
+
+fix_account_balances.py rebuilds or checks the balances of a running system.
+"""
+
+from typing import Any, Dict, List
+
+
+def rebuild_account_balances(cur, store_id: int) -> int:
+    """
+    Recompute a store's balances from account_transactions, one row per
+    account. Runs inside the caller's transaction and holds the store's
+    balance lock until commit, so ledger writers of that store wait for it.
+    Returns the number of accounts.
+    """
+    cur.execute(
+        "SELECT pg_advisory_xact_lock(hashtext('account_balances'), %s::INT)",
+        (store_id,),
+    )
+    cur.execute("DELETE FROM account_balances WHERE store_id = %s", (store_id,))
+    cur.execute(
+        """
+        INSERT INTO account_balances (store_id, payment_method_id, slot, balance)
+        SELECT store_id, payment_method_id, 0, SUM(amount)
+        FROM account_transactions
+        WHERE store_id = %s
+        GROUP BY store_id, payment_method_id
+        """,
+        (store_id,),
+    )
+    return cur.rowcount
+
+
+def verify_account_balances(cur, store_id: int, tolerance: float = 0.005) -> List[Dict[str, Any]]:
+    """Accounts whose maintained balance differs from the ledger sum."""
+    cur.execute(
+        """
+        WITH stored AS (
+            SELECT payment_method_id, SUM(balance) AS balance
+            FROM account_balances
+            WHERE store_id = %s
+            GROUP BY payment_method_id
+        ), expected AS (
+            SELECT payment_method_id, SUM(amount) AS balance
+            FROM account_transactions
+            WHERE store_id = %s
+            GROUP BY payment_method_id
+        )
+        SELECT
+            payment_method_id,
+            pm.name,
+            COALESCE(s.balance, 0) AS stored,
+            COALESCE(e.balance, 0) AS expected
+        FROM stored s
+        FULL JOIN expected e USING (payment_method_id)
+        JOIN payment_methods pm ON pm.id = payment_method_id
+        ORDER BY payment_method_id
+        """,
+        (store_id, store_id),
+    )
+    return [
+        row for row in cur.fetchall()
+        if abs(row["stored"] - row["expected"]) > tolerance
+    ]
@@ -3,7 +3,9 @@ Accounts (per-payment-method wallets).
 
 Each payment method is an account with a balance = SUM(account_transactions.amount)
 for that method. The ledger mirrors cash_flow (maintained by a DB trigger), so the
-sum of all account balances always equals the store's real cash total.
+sum of all account balances always equals the store's real cash total. Balances
+are read from account_balances, kept up to date by triggers on the ledger (see
+account_balances.py).
 
 Operations:
 - deposit  : owner puts money into an account  -> cash_flow 'in'  (owner party)
@@ -18,8 +20,7 @@ from os import getenv
 from typing import Optional
 from datetime import datetime
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from database import Database
 from dotenv import load_dotenv
 from fastapi import APIRouter, Depends, HTTPException
 
@@ -41,35 +42,6 @@ logging.basicConfig(
 )
 
 
-class Database:
-    "Database context manager to handle the connection and cursor"
-
-    def __init__(self, host, database, user, password, real_dict_cursor=True):
-        self.host = host
-        self.database = database
-        self.user = user
-        self.password = password
-        self.real_dict_cursor = real_dict_cursor
-
-    def __enter__(self):
-        self.conn = psycopg2.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password,
-        )
-        return self.conn.cursor(
-            cursor_factory=RealDictCursor if self.real_dict_cursor else None
-        )
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is not None:
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-        self.conn.close()
-
-
 def _get_owner_party_id(cur) -> Optional[int]:
     cur.execute("SELECT id FROM assosiated_parties WHERE type = 'owner' LIMIT 1")
     row = cur.fetchone()
@@ -79,8 +51,8 @@ def _get_owner_party_id(cur) -> Optional[int]:
 def _account_balance(cur, store_id: int, method_id: int) -> float:
     cur.execute(
         """
-        SELECT COALESCE(SUM(amount), 0) AS balance
-        FROM account_transactions
+        SELECT COALESCE(SUM(balance), 0) AS balance
+        FROM account_balances
         WHERE store_id = %s AND payment_method_id = %s
         """,
         (store_id, method_id),
@@ -100,22 +72,19 @@ def get_accounts(store_id: int, current_user: dict = Depends(get_current_user)):
                     pm.name,
                     pm.is_default,
                     pm.is_deleted,
-                    COALESCE((
-                        SELECT SUM(at.amount)
-                        FROM account_transactions at
-                        WHERE at.payment_method_id = pm.id
-                          AND at.store_id = %s
-                    ), 0) AS balance
+                    COALESCE(ab.balance, 0) AS balance
                 FROM payment_methods pm
+                LEFT JOIN (
+                    SELECT payment_method_id, SUM(balance) AS balance
+                    FROM account_balances
+                    WHERE store_id = %s
+                    GROUP BY payment_method_id
+                ) ab ON ab.payment_method_id = pm.id
                 WHERE pm.is_deleted = FALSE
-                   OR EXISTS (
-                        SELECT 1 FROM account_transactions at
-                        WHERE at.payment_method_id = pm.id
-                          AND at.store_id = %s
-                   )
+                   OR ab.payment_method_id IS NOT NULL
                 ORDER BY pm.is_default DESC, pm.id ASC
                 """,
-                (store_id, store_id),
+                (store_id,),
             )
             accounts = [
                 {
@@ -2,19 +2,15 @@ from fastapi import HTTPException, APIRouter, Depends
 from fastapi.responses import JSONResponse
 import psycopg2
 from datetime import datetime
+import importlib
 import logging
+import threading
+import time
 from dotenv import load_dotenv
 from os import getenv
 from typing import Optional, List, Dict
-import pandas as pd
-import numpy as np
-from ml_utils import calculate_days_until_stockout
-from utils import parse_date, to_float
-from analytics_utils import (
-    process_products_data_with_predictions,
-    predict_total_sales,
-    Database,
-)
+from utils import parse_date, to_float, find_fifo_start_time
+from database import Database
 from auth_middleware import get_current_user
 
 load_dotenv()
@@ -26,6 +22,14 @@ PASS = getenv("PASS") or "postgres"
 
 router = APIRouter()
 
+# pandas, numpy and the ML helpers (xgboost) are imported inside the endpoints
+# that need them, so importing this router does not slow down server startup.
+# main.py preloads them in the background once the server is up
+# (warm_analytics_modules).
+ANALYTICS_MODULES = ("pandas", "numpy", "ml_utils", "analytics_utils")
+# Seconds after startup before preloading them; negative disables the preload
+ANALYTICS_WARMUP_DELAY = float(getenv("ANALYTICS_WARMUP_DELAY") or 5)
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] - %(message)s",
@@ -33,6 +37,28 @@ logging.basicConfig(
 )
 
 
+def warm_analytics_modules() -> None:
+    """Import the analytics dependencies so the first analytics request is fast"""
+    started = time.perf_counter()
+    for name in ANALYTICS_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logging.error(f"Could not preload analytics module {name}: {e}")
+            return
+    logging.info(f"Analytics modules loaded in {time.perf_counter() - started:.1f}s")
+
+
+def start_analytics_warmup() -> None:
+    """Preload the analytics modules in the background, after startup settles"""
+    if ANALYTICS_WARMUP_DELAY < 0:
+        return
+    timer = threading.Timer(ANALYTICS_WARMUP_DELAY, warm_analytics_modules)
+    timer.daemon = True
+    timer.name = "analytics-warmup"
+    timer.start()
+
+
 def _get_historical_and_prediction_bounds(start_date: str, end_date: str) -> tuple:
     start_date_obj = parse_date(start_date)
     end_date_obj = parse_date(end_date)
@@ -104,6 +130,10 @@ def alerts(store_id: int, current_user: dict = Depends(get_current_user)):
                 if key in prod:
                     prod[key] = to_float(prod[key])
 
+        import numpy as np
+        import pandas as pd
+        from ml_utils import calculate_days_until_stockout
+
         df = pd.DataFrame(products)
 
         # Calculate daily consumption rate for each product
@@ -227,6 +257,8 @@ def sales(
 
         if is_future_prediction:
             prediction_days = (end_date_obj.date() - today.date()).days
+            from analytics_utils import predict_total_sales
+
             predictions = predict_total_sales(store_id, types, prediction_days)
             result_data.extend(
                 [
@@ -500,6 +532,8 @@ def top_products(
             return {}
 
         if is_future_prediction:
+            from analytics_utils import process_products_data_with_predictions
+
             products_data = process_products_data_with_predictions(
                 products_data, product_ids, store_id, end_date_obj, today
             )
@@ -540,6 +574,8 @@ def products(
         )
 
         if is_future_prediction:
+            from analytics_utils import process_products_data_with_predictions
+
             products_data = process_products_data_with_predictions(
                 products_data, products_ids, store_id, end_date_obj, today
             )
@@ -610,6 +646,8 @@ def shifts_analytics(
             )
             shifts_data = cursor.fetchall()
 
+        import pandas as pd
+
         result = []
         for row in shifts_data:
             start_dt = pd.to_datetime(row["start_date_time"])
@@ -694,39 +732,7 @@ def _calculate_product_profit_fifo(
     """
     Calculate profit for a single product using FIFO method with future borrowing capability.
     """
-    # Find the earliest point where total was <= 0 before our period
-    cursor.execute(
-        """
-        SELECT pf.time, pf.total
-        FROM products_flow pf
-        JOIN bills b ON pf.bill_id = b.id
-        WHERE pf.product_id = %s AND pf.store_id = %s 
-        AND b.time < %s AND b.id > 0
-        AND pf.total = 0
-        ORDER BY pf.time DESC
-        LIMIT 1
-    """,
-        (product_id, store_id, start_date),
-    )
-
-    starting_point = cursor.fetchone()
-    if starting_point:
-        fifo_start_time = starting_point["time"]
-    else:
-        # If no zero point found, start from the very beginning
-        cursor.execute(
-            """
-            SELECT MIN(pf.time) as min_time
-            FROM products_flow pf
-            JOIN bills b ON pf.bill_id = b.id
-            WHERE pf.product_id = %s AND pf.store_id = %s AND b.id > 0
-        """,
-            (product_id, store_id),
-        )
-        result = cursor.fetchone()
-        fifo_start_time = (
-            result["min_time"] if result and result["min_time"] else start_date
-        )
+    fifo_start_time = find_fifo_start_time(cursor, product_id, store_id, start_date)
 
     # Get all transactions from the FIFO start point to the end of our period
     cursor.execute(
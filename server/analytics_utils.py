@@ -4,8 +4,7 @@ from os import getenv
 from typing import Dict, List, Tuple, Optional
 import numpy as np
 import pandas as pd
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from database import Database
 from dotenv import load_dotenv
 from ml_utils import (
     train_sales_prediction_model,
@@ -32,44 +31,6 @@ USER = getenv("USER") or "postgres"
 PASS = getenv("PASS") or "postgres"
 
 
-class Database:
-    """Database context manager to handle the connection and cursor"""
-
-    def __init__(
-        self,
-        host: str,
-        database: str,
-        user: str,
-        password: str,
-        real_dict_cursor: bool = True,
-    ):
-        self.host = host
-        self.database = database
-        self.user = user
-        self.password = password
-        self.real_dict_cursor = real_dict_cursor
-        self.conn = None
-
-    def __enter__(self):
-        self.conn = psycopg2.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password,
-        )
-        return self.conn.cursor(
-            cursor_factory=RealDictCursor if self.real_dict_cursor else None
-        )
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.conn:
-            if exc_type is not None:
-                self.conn.rollback()
-            else:
-                self.conn.commit()
-            self.conn.close()
-
-
 def get_product_info(product_id: int, store_id: int) -> Optional[Dict]:
     """Get product information to avoid repeated queries"""
     try:
@@ -1,8 +1,7 @@
 import bcrypt
 from fastapi import HTTPException
 from fastapi.responses import JSONResponse
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from database import Database
 from fastapi import Cookie, Form, Depends
 from datetime import datetime
 import logging
@@ -10,7 +9,7 @@ from dotenv import load_dotenv
 from os import getenv
 import jwt
 from fastapi import APIRouter
-from auth_middleware import get_current_user, get_store_info
+from auth_middleware import get_current_user, get_store_info, invalidate_user_cache
 from telegram_utils import (
     send_due_installments_notification_background,
     send_shift_closure_notification_background,
@@ -42,35 +41,6 @@ logging.basicConfig(
 )
 
 
-class Database:
-    "Database context manager to handle the connection and cursor"
-
-    def __init__(self, host, database, user, password, real_dict_cursor=True):
-        self.host = host
-        self.database = database
-        self.user = user
-        self.password = password
-        self.real_dict_cursor = real_dict_cursor
-
-    def __enter__(self):
-        self.conn = psycopg2.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password,
-        )
-        return self.conn.cursor(
-            cursor_factory=RealDictCursor if self.real_dict_cursor else None
-        )
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is not None:
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-        self.conn.close()
-
-
 @router.get("/profile")
 def get_user_profile(user: dict = Depends(get_current_user)) -> JSONResponse:
     """
@@ -416,7 +386,8 @@ def add_user(
                 (username, hashed_password, email, phone, scope_id),
             )
             user = cur.fetchone()
-            return JSONResponse(content=user)
+        invalidate_user_cache(username)
+        return JSONResponse(content=user)
     except Exception as e:
         logging.error(f"Error: {e}")
         raise HTTPException(status_code=400, detail=str(e)) from e
@@ -477,7 +448,8 @@ def update_user(
                 (username, user["id"]),
             )
 
-            return JSONResponse(content=user)
+        invalidate_user_cache(username)
+        return JSONResponse(content=user)
     except Exception as e:
         logging.error(f"Error: {e}")
         raise HTTPException(status_code=400, detail=str(e)) from e
@@ -1,11 +1,15 @@
 import jwt
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from database import Database
+from store_cache import add_notify_handler, get_store
 from fastapi import HTTPException, Cookie
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 from os import getenv
 import logging
-from typing import Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
 
 load_dotenv()
 
@@ -17,36 +21,87 @@ PASS = getenv("PASS")
 SECRET = getenv("SECRET") or ""
 ALGORITHM = getenv("ALGORITHM") or ""
 
+# Resolved users are cached per token subject so authenticated requests skip
+# the users lookup. Entries expire after AUTH_USER_CACHE_TTL seconds (0
+# disables the cache) and are dropped when a user is changed: by the writing
+# process directly, and in every worker by the users trigger, which NOTIFYs
+# USERS_NOTIFY_CHANNEL with the username (LISTENed on by the store_cache
+# listener thread).
+AUTH_USER_CACHE_TTL = float(getenv("AUTH_USER_CACHE_TTL") or 60)
+AUTH_USER_CACHE_SIZE = int(getenv("AUTH_USER_CACHE_SIZE") or 1024)
+USERS_NOTIFY_CHANNEL = "users_changed"
+
 logger = logging.getLogger(__name__)
 
+_user_cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+_user_cache_lock = threading.Lock()
+# Bumped by invalidate_user_cache, so a lookup racing an invalidation is not
+# cached
+_user_cache_generation = 0
+
+
+def _cached_user(username: str) -> Optional[dict]:
+    with _user_cache_lock:
+        entry = _user_cache.get(username)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            del _user_cache[username]
+            return None
+        _user_cache.move_to_end(username)
+        return dict(user)
+
+
+def _cache_user(username: str, user: dict, generation: int) -> None:
+    if AUTH_USER_CACHE_TTL <= 0:
+        return
+    with _user_cache_lock:
+        if generation != _user_cache_generation:
+            return
+        _user_cache[username] = (time.monotonic() + AUTH_USER_CACHE_TTL, dict(user))
+        _user_cache.move_to_end(username)
+        while len(_user_cache) > AUTH_USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+
+
+def invalidate_user_cache(username: Optional[str] = None) -> None:
+    """Drop one cached user (or all of them) after the users table changes."""
+    global _user_cache_generation
+
+    with _user_cache_lock:
+        _user_cache_generation += 1
+        if username is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(username, None)
 
-class Database:
-    "Database context manager to handle the connection and cursor"
 
-    def __init__(self, host, database, user, password, real_dict_cursor=True):
-        self.host = host
-        self.database = database
-        self.user = user
-        self.password = password
-        self.real_dict_cursor = real_dict_cursor
+def _handle_user_notification(payload: Optional[str]) -> None:
+    invalidate_user_cache(payload or None)
 
-    def __enter__(self):
-        self.conn = psycopg2.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password,
-        )
-        return self.conn.cursor(
-            cursor_factory=RealDictCursor if self.real_dict_cursor else None
-        )
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is not None:
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-        self.conn.close()
+add_notify_handler(USERS_NOTIFY_CHANNEL, _handle_user_notification)
+
+
+def _load_user(username: str) -> Optional[dict]:
+    """Fetch the user row for `username`, or None if it does not exist."""
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        cur.execute(
+            """
+            SELECT 
+                users.id,
+                users.username,
+                users.email,
+                users.phone,
+                users.scope_id
+            FROM users
+            WHERE username = %s
+            """,
+            (username,),
+        )
+        user = cur.fetchone()
+        return dict(user) if user else None
 
 
 async def get_current_user(access_token: Optional[str] = Cookie(None)):
@@ -73,27 +128,19 @@ async def get_current_user(access_token: Optional[str] = Cookie(None)):
         if not username:
             raise HTTPException(status_code=401, detail="Invalid token")
 
-        # Get user information from database
-        with Database(HOST, DATABASE, USER, PASS) as cur:
-            cur.execute(
-                """
-                SELECT 
-                    users.id,
-                    users.username,
-                    users.email,
-                    users.phone,
-                    users.scope_id
-                FROM users
-                WHERE username = %s
-                """,
-                (username,),
-            )
-            user = cur.fetchone()
-
-            if not user:
-                raise HTTPException(status_code=401, detail="User not found")
-
-            return dict(user)
+        user = _cached_user(username)
+        if user is not None:
+            return user
+        generation = _user_cache_generation
+
+        # The lookup is blocking psycopg2 work; keep it off the event loop
+        user = await run_in_threadpool(_load_user, username)
+
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+
+        _cache_user(username, user, generation)
+        return user
 
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
@@ -135,16 +182,16 @@ def get_store_info(store_id: int):
         HTTPException: If store not found
     """
     try:
-        with Database(HOST, DATABASE, USER, PASS) as cur:
-            cur.execute(
-                "SELECT id, name, extra_info FROM store_data WHERE id = %s", (store_id,)
-            )
-            store = cur.fetchone()
+        store = get_store(store_id)
 
-            if not store:
-                raise HTTPException(status_code=404, detail="Store not found")
+        if not store:
+            raise HTTPException(status_code=404, detail="Store not found")
 
-            return dict(store)
+        return {
+            "id": store["id"],
+            "name": store["name"],
+            "extra_info": store["extra_info"],
+        }
 
     except Exception as e:
         logger.error("Error getting store info: %s", e)
@@ -3,13 +3,13 @@ Product Batches API endpoints for tracking inventory by expiration date.
 Handles batch management including FEFO (First Expired, First Out) logic.
 """
 
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from datetime import datetime, date
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import execute_values
+from database import Database
 from dotenv import load_dotenv
 from os import getenv
 
@@ -39,37 +39,6 @@ class BatchUpdate(BaseModel):
     batches: List[BatchCreate]
 
 
-class Database:
-    """Database context manager to handle the connection and cursor"""
-
-    def __init__(self, host, database, user, password, real_dict_cursor=True):
-        self.host = host
-        self.database = database
-        self.user = user
-        self.password = password
-        self.real_dict_cursor = real_dict_cursor
-        self.conn = psycopg2.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password,
-        )
-        self.cursor = self.conn.cursor(
-            cursor_factory=RealDictCursor if self.real_dict_cursor else None
-        )
-
-    def __enter__(self):
-        return self.cursor
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is not None:
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-        self.cursor.close()
-        self.conn.close()
-
-
 @router.get("/product/{product_id}/batches")
 def get_product_batches(
     product_id: int,
@@ -405,71 +374,157 @@ def consume_batches_fefo(
     Returns:
         List of consumed batch info
     """
-    consumed = []
-    remaining = quantity
+    return consume_batches_bulk(
+        cur, store_id, [(product_id, quantity, specific_batch_id)]
+    )
 
-    if specific_batch_id:
-        # Consume from specific batch
-        cur.execute(
-            """
-            SELECT id, quantity, expiration_date
-            FROM product_batches
-            WHERE id = %s AND store_id = %s AND product_id = %s AND quantity > 0
-            FOR UPDATE
-            """,
-            (specific_batch_id, store_id, product_id),
-        )
-    else:
-        # Get batches in FEFO order
-        cur.execute(
-            """
-            SELECT id, quantity, expiration_date
-            FROM product_batches
-            WHERE store_id = %s AND product_id = %s AND quantity > 0
-            ORDER BY expiration_date ASC NULLS LAST
-            FOR UPDATE
-            """,
-            (store_id, product_id),
-        )
 
-    batches = cur.fetchall()
+def consume_batches_bulk(
+    cur, store_id: int, lines: List[Tuple[int, int, Optional[int]]]
+) -> List[dict]:
+    """
+    Consume batches for a whole bill in two statements.
 
-    for batch in batches:
-        if remaining <= 0:
-            break
+    Each line is (product_id, quantity, batch_id). Lines with a batch_id
+    consume from that batch only and are applied first; the rest of each
+    product's quantity is taken in FEFO order (running sum of the remaining
+    batch quantities). Emptied batches are deleted. Quantity that no batch
+    covers is left untracked, as before.
 
-        batch_id = batch["id"]
-        available = batch["quantity"]
-        exp_date = batch["expiration_date"]
+    Args:
+        cur: Database cursor
+        store_id: The store ID
+        lines: (product_id, quantity, batch_id or None) per consumption
 
-        consume_qty = min(remaining, available)
-        new_qty = available - consume_qty
+    Returns:
+        List of consumed batch info, in FEFO order per product
+    """
+    lines = [line for line in lines if line[1] and line[1] > 0]
+    if not lines:
+        return []
 
-        if new_qty > 0:
-            cur.execute(
-                """
-                UPDATE product_batches SET quantity = %s WHERE id = %s
-                """,
-                (new_qty, batch_id),
-            )
-        else:
-            cur.execute(
-                """
-                DELETE FROM product_batches WHERE id = %s
-                """,
-                (batch_id,),
-            )
+    product_ids = sorted({line[0] for line in lines})
 
-        consumed.append(
-            {
-                "batch_id": batch_id,
-                "quantity": consume_qty,
-                "expiration_date": str(exp_date) if exp_date else None,
-            }
+    # Lock in id order so concurrent bills on the same products queue
+    # instead of deadlocking
+    cur.execute(
+        """
+        SELECT id
+        FROM product_batches
+        WHERE store_id = %s AND product_id = ANY(%s) AND quantity > 0
+        ORDER BY id
+        FOR UPDATE
+        """,
+        (store_id, product_ids),
+    )
+    if not cur.fetchall():
+        return []
+
+    cur.execute(
+        """
+        WITH req AS (
+            SELECT *
+            FROM unnest(%s::BIGINT[], %s::INT[], %s::BIGINT[])
+                AS r(product_id, quantity, batch_id)
+        ),
+        batches AS (
+            SELECT id, product_id, quantity, expiration_date
+            FROM product_batches
+            WHERE store_id = %s AND product_id = ANY(%s) AND quantity > 0
+        ),
+        explicit AS (
+            SELECT
+                b.id,
+                b.product_id,
+                b.expiration_date,
+                LEAST(b.quantity, r.quantity)::INT AS take
+            FROM (
+                SELECT product_id, batch_id, SUM(quantity) AS quantity
+                FROM req
+                WHERE batch_id IS NOT NULL
+                GROUP BY product_id, batch_id
+            ) r
+            JOIN batches b ON b.id = r.batch_id AND b.product_id = r.product_id
+        ),
+        demand AS (
+            SELECT product_id, SUM(quantity) AS quantity
+            FROM req
+            WHERE batch_id IS NULL
+            GROUP BY product_id
+        ),
+        fefo AS (
+            SELECT
+                c.id,
+                c.product_id,
+                c.expiration_date,
+                LEAST(c.available, d.quantity - c.before)::INT AS take
+            FROM (
+                SELECT
+                    a.*,
+                    SUM(a.available) OVER (
+                        PARTITION BY a.product_id
+                        ORDER BY a.expiration_date ASC NULLS LAST, a.id
+                    ) - a.available AS before
+                FROM (
+                    SELECT
+                        b.id,
+                        b.product_id,
+                        b.expiration_date,
+                        b.quantity - COALESCE(e.take, 0) AS available
+                    FROM batches b
+                    LEFT JOIN explicit e ON e.id = b.id
+                    WHERE b.product_id IN (SELECT product_id FROM demand)
+                ) a
+            ) c
+            JOIN demand d ON d.product_id = c.product_id
+            WHERE c.available > 0 AND c.before < d.quantity
+        ),
+        alloc AS (
+            SELECT *, 0 AS pass FROM explicit WHERE take > 0
+            UNION ALL
+            SELECT *, 1 AS pass FROM fefo
+        ),
+        taken AS (
+            SELECT b.id, b.quantity - SUM(a.take) AS left_over
+            FROM alloc a
+            JOIN batches b ON b.id = a.id
+            GROUP BY b.id, b.quantity
+        ),
+        updated AS (
+            UPDATE product_batches pb
+            SET quantity = t.left_over
+            FROM taken t
+            WHERE pb.id = t.id AND t.left_over > 0
+        ),
+        deleted AS (
+            DELETE FROM product_batches pb
+            USING taken t
+            WHERE pb.id = t.id AND t.left_over <= 0
         )
-        remaining -= consume_qty
+        SELECT id AS batch_id, product_id, take AS quantity, expiration_date
+        FROM alloc
+        ORDER BY product_id, pass, expiration_date ASC NULLS LAST, id
+        """,
+        (
+            [line[0] for line in lines],
+            [line[1] for line in lines],
+            [line[2] for line in lines],
+            store_id,
+            product_ids,
+        ),
+    )
 
-    return consumed
+    return [
+        {
+            "batch_id": row["batch_id"],
+            "product_id": row["product_id"],
+            "quantity": row["quantity"],
+            "expiration_date": str(row["expiration_date"])
+            if row["expiration_date"]
+            else None,
+        }
+        for row in cur.fetchall()
+    ]
 
 
 def add_to_batch(
@@ -504,6 +559,46 @@ def add_to_batch(
     )
 
 
+def add_to_batches_bulk(
+    cur, store_id: int, lines: List[Tuple[int, int, Optional[str]]]
+):
+    """
+    Add the batches of a whole bill in one upsert. Lines are
+    (product_id, quantity, expiration_date); lines for the same batch are
+    summed first, since one upsert cannot touch a row twice. They are grouped
+    on the date Postgres parses, so "2026-01-01" and "2026-01-01T00:00:00"
+    are the same batch.
+
+    Args:
+        cur: Database cursor
+        store_id: The store ID
+        lines: (product_id, quantity, expiration_date or None) per batch
+    """
+    rows = [
+        (store_id, product_id, quantity, expiration_date)
+        for product_id, quantity, expiration_date in lines
+        if quantity and quantity > 0
+    ]
+    if not rows:
+        return
+
+    execute_values(
+        cur,
+        """
+        INSERT INTO product_batches (store_id, product_id, quantity, expiration_date)
+        SELECT store_id, product_id, SUM(quantity), expiration_date
+        FROM (VALUES %s) AS lines (store_id, product_id, quantity, expiration_date)
+        GROUP BY store_id, product_id, expiration_date
+        ORDER BY product_id, expiration_date NULLS FIRST
+        ON CONFLICT (store_id, product_id, expiration_date)
+        DO UPDATE SET quantity = product_batches.quantity + EXCLUDED.quantity
+        """,
+        rows,
+        template="(%s::BIGINT, %s::BIGINT, %s::INT, %s::DATE)",
+        page_size=len(rows),
+    )
+
+
 def adjust_batches_for_stock_change(
     cur, store_id: int, product_id: int, old_stock: int, new_stock: int
 ):
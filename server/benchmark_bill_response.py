@@ -0,0 +1,208 @@
+"""
+Benchmark of the POST /bill response: the old re-query of the inserted bill
+(GET /bills style, with installments_flow aggregated for every installment)
+versus the response built from RETURNING rows plus one product lookup
+(main._bill_response).
+
+Runs against the database configured in .env, ideally one filled by
+generate_dataset.py, since the old query grows with installments and
+installments_flow. Every bill is inserted the way the API does (bills row,
+one products_flow insert firing the triggers) and then rolled back, so the
+data is never changed. Variants alternate bill by bill on the same products.
+
+    python benchmark_bill_response.py
+    python benchmark_bill_response.py --sizes 1,10,40 --bills 300
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime
+from os import getenv
+from typing import List
+
+from dotenv import load_dotenv  # type: ignore
+from psycopg2.extras import execute_values
+
+from database import Database
+from main import _bill_products_info, _bill_response
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+# The query _add_bill_internal ran after inserting, before the response was
+# built from RETURNING rows
+LEGACY_RESPONSE_SQL = """
+SELECT
+    bills.id,
+    bills.time,
+    bills.discount,
+    bills.total,
+    bills.type,
+    bills.note,
+    bills.payments,
+    assosiated_parties.name AS party_name,
+    CASE
+        WHEN installments_data.installment_id IS NOT NULL THEN jsonb_build_object(
+            'id', installments_data.installment_id,
+            'paid', installments_data.paid,
+            'installments_count', installments_data.installments_count,
+            'installment_interval', installments_data.installment_interval,
+            'total_paid', installments_data.total_paid,
+            'flow', installments_data.flow
+        )
+        ELSE NULL
+    END AS installment_details,
+    json_agg(
+        json_build_object(
+            'id', products_flow.product_id,
+            'name', products.name,
+            'bar_code', products.bar_code,
+            'amount', products_flow.amount,
+            'wholesale_price', products_flow.wholesale_price,
+            'price', products_flow.price
+        )
+    ) AS products
+FROM bills
+JOIN products_flow ON bills.id = products_flow.bill_id
+JOIN products ON products_flow.product_id = products.id
+LEFT JOIN assosiated_parties ON bills.party_id = assosiated_parties.id
+LEFT JOIN (
+    SELECT
+        i.bill_id,
+        i.store_id,
+        i.id AS installment_id,
+        i.paid::double precision AS paid,
+        i.installments_count,
+        i.installment_interval,
+        COALESCE(flow_data.flow, '[]'::jsonb) AS flow,
+        (i.paid::double precision + COALESCE(flow_data.total_flow_paid, 0)) AS total_paid
+    FROM installments i
+    LEFT JOIN (
+        SELECT
+            installment_id,
+            COALESCE(SUM(amount::double precision), 0) AS total_flow_paid,
+            jsonb_agg(
+                jsonb_build_object(
+                    'id', id,
+                    'amount', amount::double precision,
+                    'time', time::text
+                )
+                ORDER BY time, id
+            ) AS flow
+        FROM installments_flow
+        GROUP BY installment_id
+    ) AS flow_data ON i.id = flow_data.installment_id
+) AS installments_data ON bills.id = installments_data.bill_id
+    AND bills.store_id = installments_data.store_id
+WHERE bills.id = %s
+GROUP BY bills.id, bills.time, bills.discount,
+    bills.total, bills.type, bills.note, bills.payments, bills.party_id, assosiated_parties.name,
+    installments_data.installment_id, installments_data.paid,
+    installments_data.installments_count, installments_data.installment_interval,
+    installments_data.total_paid, installments_data.flow
+"""
+
+
+def insert_bill(cur, store_id: int, product_ids: List[int]):
+    """Insert a sell bill like _add_bill_internal; returns (bill row, lines)"""
+    now = datetime.now().isoformat()
+    cur.execute(
+        """
+        INSERT INTO bills (store_id, time, discount, total, type, note, party_id, payments)
+        VALUES (%s, %s, 0, %s, 'sell', NULL, NULL, NULL)
+        RETURNING
+            id, time, discount, total, type, note, payments,
+            (
+                SELECT name FROM assosiated_parties
+                WHERE assosiated_parties.id = bills.party_id
+            ) AS party_name
+        """,
+        (store_id, now, 10.0 * len(product_ids)),
+    )
+    bill_row = cur.fetchone()
+    lines = execute_values(
+        cur,
+        """
+        INSERT INTO products_flow (
+            store_id, bill_id, product_id,
+            amount, wholesale_price, price, time
+        )
+        VALUES %s
+        RETURNING product_id, amount, wholesale_price, price
+        """,
+        [(store_id, bill_row["id"], pid, -1, 6.0, 10.0, now) for pid in product_ids],
+        page_size=len(product_ids),
+        fetch=True,
+    )
+    return bill_row, lines
+
+
+def run_bill(cur, variant: str, store_id: int, product_ids: List[int]) -> float:
+    start = time.perf_counter()
+    if variant == "re-query":
+        bill_row, _ = insert_bill(cur, store_id, product_ids)
+        cur.execute(LEGACY_RESPONSE_SQL, (bill_row["id"],))
+        cur.fetchone()
+    else:
+        product_info = _bill_products_info(cur, product_ids)
+        bill_row, lines = insert_bill(cur, store_id, product_ids)
+        _bill_response(bill_row, lines, product_info)
+    return (time.perf_counter() - start) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the POST /bill response.")
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[1, 5, 10, 40], help="lines per bill")
+    parser.add_argument("--bills", type=int, default=200, help="bills per size and variant")
+    parser.add_argument("--store", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    variants = ["re-query", "returning"]
+
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        cur.execute("SELECT id FROM products ORDER BY id")
+        all_products = [row["id"] for row in cur.fetchall()]
+        cur.execute("SELECT COUNT(*) AS n FROM installments_flow")
+        flow_rows = cur.fetchone()["n"]
+        cur.connection.rollback()
+
+        if len(all_products) < max(args.sizes):
+            raise SystemExit("Not enough products, run generate_dataset.py first")
+        print(f"{len(all_products)} products, {flow_rows} installments_flow rows")
+
+        results = {}
+        for size in args.sizes:
+            timings = {variant: [] for variant in variants}
+            for _ in range(args.bills):
+                product_ids = rng.sample(all_products, size)
+                for variant in variants:
+                    timings[variant].append(run_bill(cur, variant, args.store, product_ids))
+                    cur.connection.rollback()
+            results[size] = timings
+
+    header = f"{'lines':>6}" + "".join(f"{variant:>24}" for variant in variants) + f"{'speedup':>10}"
+    print()
+    print(header)
+    print("-" * len(header))
+    for size, timings in results.items():
+        row = f"{size:>6}"
+        for variant in variants:
+            values = timings[variant]
+            p95 = statistics.quantiles(values, n=20)[-1]
+            row += f"{statistics.median(values):>12.2f} (p95 {p95:5.1f})"
+        speedup = statistics.median(timings["re-query"]) / statistics.median(timings["returning"])
+        row += f"{speedup:>9.1f}x"
+        print(row)
+    print("\nms per bill, insert + response (median, p95)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Benchmark of an offline terminal flushing its queue: N sequential
+POST /bill calls versus one POST /bills/bulk with the same bills.
+
+Runs against a running API server, and writes real bills, so use a
+throwaway database (for example one filled by generate_dataset.py). The queue
+mixes sell, return, installment and reserve bills like load_test.py. Both
+variants get their own bills built from the same seed, and each run of the
+bulk variant also checks that every bill came back with status 200.
+
+    uvicorn main:app --workers 4 &
+    python benchmark_bulk_bills.py --bills 200
+    python benchmark_bulk_bills.py --bills 500 --chunk-size 250 --runs 5
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+import httpx
+
+MIX = (("sell", 85), ("return", 5), ("installment", 5), ("reserve", 5))
+
+
+def login(args) -> str:
+    response = httpx.post(
+        f"{args.base_url}/login",
+        params={"store_id": args.store},
+        data={"username": args.username, "password": args.password},
+        timeout=args.timeout,
+    )
+    token = response.cookies.get("access_token")
+    if response.status_code != 200 or not token:
+        raise SystemExit(f"Login failed ({response.status_code}): {response.text}")
+    return token
+
+
+def build_queue(rng: random.Random, count: int, products, customers) -> List[Dict[str, Any]]:
+    """Queued bills in the shape of POST /bills/bulk items"""
+    queue = []
+    for _ in range(count):
+        move_type = rng.choices([m for m, _ in MIX], weights=[w for _, w in MIX])[0]
+        lines = [
+            {
+                "id": product["id"],
+                "quantity": rng.choice((1, 1, 1, 2, 3)),
+                "price": float(product["price"] or 0),
+                "wholesale_price": float(product["wholesale_price"] or 0),
+            }
+            for product in rng.sample(products, rng.randint(1, 6))
+        ]
+        total = round(sum(line["price"] * line["quantity"] for line in lines), 2)
+        item: Dict[str, Any] = {
+            "bill": {
+                "time": datetime.now().isoformat(),
+                "discount": 0,
+                "total": total,
+                "note": "bulk benchmark",
+                "products_flow": lines,
+            },
+            "move_type": move_type,
+        }
+        if move_type in ("installment", "reserve"):
+            item["party_id"] = rng.choice(customers)
+        if move_type == "installment":
+            item.update(paid=round(total * 0.2, 2), installments=6, installment_interval=30)
+        queue.append(item)
+    return queue
+
+
+def run_sequential(client: httpx.Client, store_id: int, queue) -> float:
+    start = time.perf_counter()
+    for item in queue:
+        params = {k: v for k, v in item.items() if k != "bill"}
+        response = client.post("/bill", params={**params, "store_id": store_id}, json=item["bill"])
+        response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def run_bulk(client: httpx.Client, store_id: int, queue, chunk_size: int) -> float:
+    start = time.perf_counter()
+    response = client.post(
+        "/bills/bulk", params={"store_id": store_id, "chunk_size": chunk_size}, json=queue
+    )
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    failed = [r for r in response.json()["results"] if r["status"] != 200]
+    if failed:
+        raise SystemExit(f"{len(failed)} bulk bills failed, first: {failed[0]}")
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark POST /bills/bulk against sequential POST /bill.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--store", type=int, default=1)
+    parser.add_argument("--bills", type=int, default=200, help="bills in the queue")
+    parser.add_argument("--chunk-size", type=int, default=100, help="bills per transaction in the bulk call")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    with httpx.Client(
+        base_url=args.base_url,
+        cookies={"access_token": login(args)},
+        timeout=args.timeout,
+    ) as client:
+        response = client.get("/products", params={"store_id": args.store})
+        response.raise_for_status()
+        products = [p for p in response.json()["products"] if (p["stock"] or 0) > 0]
+        response = client.get("/parties")
+        response.raise_for_status()
+        customers = [p["id"] for p in response.json() if p["type"] not in ("store", "owner")]
+        if len(products) < 6 or not customers:
+            raise SystemExit("Need products in stock and a customer party, run generate_dataset.py first")
+
+        timings: Dict[str, List[float]] = {"sequential": [], "bulk": []}
+        for run in range(args.runs):
+            timings["sequential"].append(
+                run_sequential(client, args.store, build_queue(rng, args.bills, products, customers))
+            )
+            timings["bulk"].append(
+                run_bulk(client, args.store, build_queue(rng, args.bills, products, customers), args.chunk_size)
+            )
+            print(
+                f"run {run + 1}: sequential {timings['sequential'][-1]:.2f}s, "
+                f"bulk {timings['bulk'][-1]:.2f}s"
+            )
+
+    sequential = statistics.median(timings["sequential"])
+    bulk = statistics.median(timings["bulk"])
+    print()
+    print(f"{args.bills} bills, median of {args.runs} runs")
+    print(f"  sequential POST /bill  {sequential:7.2f}s  {1000 * sequential / args.bills:6.2f} ms/bill")
+    print(f"  POST /bills/bulk       {bulk:7.2f}s  {1000 * bulk / args.bills:6.2f} ms/bill")
+    print(f"  speedup                {sequential / bulk:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
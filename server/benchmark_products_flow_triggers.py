@@ -0,0 +1,352 @@
+"""
+Benchmark of the products_flow insert triggers: the old row-level triggers
+versus the current ones (products_flow_before_insert sets each row's total,
+the statement-level products_flow_after_insert does the rest).
+
+Everything runs in a scratch schema (bench_products_flow) inside the database
+configured in .env, so the real tables are never touched. The schema is
+dropped again at the end unless --keep is given. Each variant gets the same
+seeded history: products with past products_flow rows, so the running total
+lookups have realistic depth. Then the same sequence of bills of each size is
+inserted, one transaction per bill, as the API does.
+
+Variants:
+
+- row / per line: the old triggers, one INSERT per line (old executemany)
+- row / one insert: the old triggers, all lines in one INSERT
+- statement: the current triggers, all lines in one INSERT (current API)
+
+After each variant, stock and running totals are checked against the rows
+themselves, so the trigger variants are also checked for equivalence.
+
+    python benchmark_products_flow_triggers.py
+    python benchmark_products_flow_triggers.py --sizes 1,10,40,200 --bills 300
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from os import getenv
+from typing import Dict, List
+
+import psycopg2
+from dotenv import load_dotenv  # type: ignore
+from psycopg2.extras import execute_values
+
+from init import create_products_flow_triggers
+
+load_dotenv()
+
+SCHEMA = "bench_products_flow"
+
+# The row-level triggers as they were before update_db_26
+LEGACY_TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION update_stock_after_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO product_inventory (store_id, product_id, stock)
+    VALUES (NEW.store_id, NEW.product_id, NEW.amount)
+    ON CONFLICT (store_id, product_id)
+    DO UPDATE SET stock = product_inventory.stock + NEW.amount;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_update_stock_insert
+AFTER INSERT ON products_flow
+FOR EACH ROW
+EXECUTE FUNCTION update_stock_after_insert();
+
+CREATE OR REPLACE FUNCTION update_product_price_after_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF (SELECT type FROM bills WHERE id = NEW.bill_id AND store_id = new.store_id LIMIT 1) = 'buy' THEN
+    UPDATE products
+    SET
+      wholesale_price = NEW.wholesale_price,
+      price = NEW.price
+    WHERE id = NEW.product_id;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_update_product_price_after_insert
+AFTER INSERT ON products_flow
+FOR EACH ROW
+EXECUTE FUNCTION update_product_price_after_insert();
+
+CREATE OR REPLACE FUNCTION update_products_flow_total_after_insert()
+RETURNS TRIGGER AS $$
+DECLARE
+    latest_total INTEGER;
+    latest_record RECORD;
+BEGIN
+    SELECT id, total INTO latest_record
+    FROM products_flow
+    WHERE store_id = NEW.store_id
+    AND product_id = NEW.product_id
+    AND (time < NEW.time OR (time = NEW.time AND id < NEW.id))
+    ORDER BY time DESC, id DESC
+    LIMIT 1
+    FOR UPDATE;
+
+    IF latest_record.total IS NULL THEN
+        latest_total := 0;
+    ELSE
+        latest_total := latest_record.total;
+    END IF;
+
+    UPDATE products_flow
+    SET total = COALESCE(NEW.amount, 0) + latest_total
+    WHERE id = NEW.id
+    AND store_id = NEW.store_id;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_update_products_flow_total_after_insert
+AFTER INSERT ON products_flow
+FOR EACH ROW
+EXECUTE FUNCTION update_products_flow_total_after_insert();
+"""
+
+VARIANTS = ("row / per line", "row / one insert", "statement")
+
+INSERT_SQL = """
+INSERT INTO products_flow (
+    store_id, bill_id, product_id, amount, wholesale_price, price, time
+)
+"""
+
+
+def create_schema(cur, args) -> None:
+    """Scratch copies of the tables the triggers touch, seeded with history."""
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"SET search_path TO {SCHEMA}")
+    cur.execute("""
+    CREATE TABLE products (
+      id BIGSERIAL PRIMARY KEY,
+      wholesale_price FLOAT,
+      price FLOAT
+    );
+    CREATE TABLE product_inventory (
+      id BIGSERIAL PRIMARY KEY,
+      store_id BIGINT,
+      product_id BIGINT REFERENCES products(id),
+      stock INT DEFAULT 0,
+      UNIQUE(store_id, product_id)
+    );
+    CREATE TABLE bills (
+      id BIGSERIAL,
+      store_id BIGINT,
+      type VARCHAR,
+      PRIMARY KEY (id, store_id)
+    );
+    CREATE TABLE products_flow (
+      id BIGSERIAL,
+      store_id BIGINT,
+      bill_id BIGINT,
+      product_id BIGINT REFERENCES products(id),
+      wholesale_price FLOAT,
+      price FLOAT,
+      amount INT,
+      time TIMESTAMP NOT NULL,
+      total INT,
+      PRIMARY KEY (id, store_id),
+      FOREIGN KEY (store_id, bill_id) REFERENCES bills(store_id, id)
+    );
+    CREATE INDEX idx_products_flow_store_product_time
+    ON products_flow (store_id, product_id, time, id);
+    """)
+
+
+def seed(cur, args) -> None:
+    drop_triggers(cur)
+    cur.execute("TRUNCATE products, product_inventory, bills, products_flow RESTART IDENTITY")
+    cur.execute(
+        "INSERT INTO products (wholesale_price, price) "
+        "SELECT 10, 12 FROM generate_series(1, %s)",
+        (args.products,),
+    )
+    cur.execute("INSERT INTO bills (id, store_id, type) VALUES (-1, 1, NULL)")
+    # History: opening stock then sales, one row per product per step
+    cur.execute(
+        """
+        INSERT INTO products_flow (store_id, bill_id, product_id, amount, wholesale_price, price, time)
+        SELECT 1, -1, p, CASE WHEN s = 1 THEN 100000 ELSE -1 END, 10, 12,
+               NOW() - INTERVAL '1 day' * (%s - s + 1)
+        FROM generate_series(1, %s) p, generate_series(1, %s) s
+        """,
+        (args.history, args.products, args.history),
+    )
+    cur.execute(
+        """
+        UPDATE products_flow pf SET total = t.total
+        FROM (
+            SELECT id, SUM(amount) OVER (PARTITION BY store_id, product_id ORDER BY time, id) AS total
+            FROM products_flow
+        ) t
+        WHERE pf.id = t.id
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO product_inventory (store_id, product_id, stock)
+        SELECT 1, product_id, SUM(amount) FROM products_flow GROUP BY product_id
+        """
+    )
+    cur.execute("SELECT setval(pg_get_serial_sequence('bills', 'id'), 1)")
+    cur.execute("ANALYZE")
+
+
+def drop_triggers(cur) -> None:
+    cur.execute("DROP TRIGGER IF EXISTS trigger_update_stock_insert ON products_flow")
+    cur.execute("DROP TRIGGER IF EXISTS trigger_update_product_price_after_insert ON products_flow")
+    cur.execute("DROP TRIGGER IF EXISTS trigger_update_products_flow_total_after_insert ON products_flow")
+    cur.execute("DROP TRIGGER IF EXISTS trigger_products_flow_after_insert ON products_flow")
+    cur.execute("DROP TRIGGER IF EXISTS trigger_products_flow_before_insert ON products_flow")
+
+
+def install_triggers(cur, variant: str) -> None:
+    if variant == "statement":
+        create_products_flow_triggers(cur)
+    else:
+        cur.execute(LEGACY_TRIGGERS_SQL)
+
+
+def run_bills(conn, args, variant: str, size: int) -> List[float]:
+    rng = random.Random(f"{args.seed}-{size}")
+    timings = []
+    with conn.cursor() as cur:
+        for n in range(args.bills):
+            bill_type = "buy" if rng.random() < args.buy_ratio else "sell"
+            sign = 1 if bill_type == "buy" else -1
+            now = datetime.now()
+            lines = [
+                (1, None, product_id, sign * rng.randint(1, 3), 10, 12 + n % 5, (now + timedelta(microseconds=i)).isoformat())
+                for i, product_id in enumerate(rng.sample(range(1, args.products + 1), size))
+            ]
+
+            started = time.perf_counter()
+            cur.execute(
+                "INSERT INTO bills (store_id, type) VALUES (1, %s) RETURNING id",
+                (bill_type,),
+            )
+            bill_id = cur.fetchone()[0]
+            lines = [(s, bill_id, *rest) for s, _, *rest in lines]
+            if variant == "row / per line":
+                cur.executemany(INSERT_SQL + "VALUES (%s, %s, %s, %s, %s, %s, %s)", lines)
+            else:
+                execute_values(cur, INSERT_SQL + "VALUES %s", lines, page_size=len(lines))
+            conn.commit()
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+def check_consistency(cur) -> Dict[str, int]:
+    cur.execute(
+        """
+        SELECT COUNT(*) FROM product_inventory pi
+        JOIN (SELECT store_id, product_id, SUM(amount) AS stock
+              FROM products_flow GROUP BY store_id, product_id) s
+          ON s.store_id = pi.store_id AND s.product_id = pi.product_id
+        WHERE pi.stock <> s.stock
+        """
+    )
+    bad_stock = cur.fetchone()[0]
+    cur.execute(
+        """
+        SELECT COUNT(*) FROM (
+            SELECT total, SUM(amount) OVER (
+                PARTITION BY store_id, product_id ORDER BY time, id
+            ) AS expected
+            FROM products_flow
+        ) t
+        WHERE total IS DISTINCT FROM expected
+        """
+    )
+    bad_totals = cur.fetchone()[0]
+    cur.execute(
+        """
+        SELECT COUNT(*) FROM products p
+        JOIN LATERAL (
+            SELECT pf.price FROM products_flow pf
+            JOIN bills b ON b.id = pf.bill_id AND b.store_id = pf.store_id
+            WHERE pf.product_id = p.id AND b.type = 'buy'
+            ORDER BY pf.id DESC LIMIT 1
+        ) last_buy ON TRUE
+        WHERE p.price <> last_buy.price
+        """
+    )
+    bad_prices = cur.fetchone()[0]
+    return {"stock": bad_stock, "totals": bad_totals, "prices": bad_prices}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark products_flow insert triggers.")
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[1, 5, 10, 40, 100], help="lines per bill")
+    parser.add_argument("--bills", type=int, default=200, help="bills per size and variant")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--history", type=int, default=50, help="past products_flow rows per product")
+    parser.add_argument("--buy-ratio", type=float, default=0.2, help="share of buy bills (exercises the price update)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help=f"keep the {SCHEMA} schema afterwards")
+    args = parser.parse_args(argv)
+    if max(args.sizes) > args.products:
+        parser.error("--products must be at least the largest bill size")
+
+    conn = psycopg2.connect(
+        host=getenv("HOST"),
+        database=getenv("DATABASE"),
+        user=getenv("USER"),
+        password=getenv("PASS"),
+    )
+    results = {}
+    try:
+        with conn.cursor() as cur:
+            create_schema(cur, args)
+        conn.commit()
+
+        for variant in VARIANTS:
+            with conn.cursor() as cur:
+                seed(cur, args)
+                install_triggers(cur, variant)
+            conn.commit()
+            print(f"- {variant}", flush=True)
+            for size in args.sizes:
+                timings = sorted(run_bills(conn, args, variant, size))
+                results[(variant, size)] = timings
+                print(
+                    f"  {size:>4} lines: median {statistics.median(timings) * 1000:7.2f} ms/bill",
+                    flush=True,
+                )
+            with conn.cursor() as cur:
+                errors = check_consistency(cur)
+            conn.rollback()
+            print(f"  inconsistent rows: {errors}", flush=True)
+    finally:
+        conn.rollback()
+        if not args.keep:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            conn.commit()
+        conn.close()
+
+    print()
+    header = f"{'lines':>6}" + "".join(f"{v:>24}" for v in VARIANTS) + f"{'speedup':>10}"
+    print(header + "\n" + "-" * len(header))
+    for size in args.sizes:
+        medians = [statistics.median(results[(v, size)]) * 1000 for v in VARIANTS]
+        p95s = [results[(v, size)][int(0.95 * (len(results[(v, size)]) - 1))] * 1000 for v in VARIANTS]
+        cells = "".join(f"{m:>12.2f} (p95 {p:>5.1f})" for m, p in zip(medians, p95s))
+        print(f"{size:>6}{cells}{medians[0] / medians[-1]:>9.1f}x")
+    print("\nms per bill (median, p95); speedup = row / per line vs statement")
+
+
+if __name__ == "__main__":
+    main()
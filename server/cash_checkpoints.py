@@ -0,0 +1,125 @@
+"""
+Daily cash_flow checkpoints.
+
+cash_flow running totals are not stored per row. cash_flow_checkpoints keeps
+the store's closing cash total for each day with movement, and readers add
+the rows after the latest checkpoint (cash_flow_total_before in the database).
+Days are sealed once they are two days old, so inserts dated today or
+yesterday never touch a checkpoint. A backdated insert, edit or delete moves
+the checkpoints after it by the difference (trigger
+cash_flow_checkpoints_after_change), which costs O(checkpoints), not
+O(rows).
+
+The leader worker seals new days every CASH_CHECKPOINT_INTERVAL seconds
+(default 3600). fix_cash_flow.py rebuilds or checks the checkpoints of a
+running system.
+"""
+
+import asyncio
+import logging
+from os import getenv
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from database import Database
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+CASH_CHECKPOINT_INTERVAL = float(getenv("CASH_CHECKPOINT_INTERVAL") or 3600)
+
+logger = logging.getLogger(__name__)
+
+
+def list_store_ids(cur, store_id: Optional[int] = None) -> List[int]:
+    if store_id is not None:
+        return [store_id]
+    cur.execute("SELECT id FROM store_data ORDER BY id")
+    return [row["id"] for row in cur.fetchall()]
+
+
+def seal_checkpoints(store_id: Optional[int] = None) -> Dict[int, int]:
+    """Seal the days that became old enough. Returns days sealed per store."""
+    sealed = {}
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        store_ids = list_store_ids(cur, store_id)
+    # One short transaction per store: the sealer blocks that store's
+    # backdated writers while it runs
+    for sid in store_ids:
+        with Database(HOST, DATABASE, USER, PASS) as cur:
+            cur.execute("SELECT seal_cash_flow_checkpoints(%s) AS sealed", (sid,))
+            sealed[sid] = cur.fetchone()["sealed"]
+    return sealed
+
+
+def rebuild_checkpoints(cur, store_id: int) -> int:
+    """
+    Recompute every checkpoint of a store from cash_flow. Runs inside the
+    caller's transaction and holds the store's checkpoint lock until commit;
+    sales dated today do not wait for it.
+    """
+    cur.execute(
+        "SELECT pg_advisory_xact_lock(hashtext('cash_flow_checkpoints'), %s::INT)",
+        (store_id,),
+    )
+    cur.execute("DELETE FROM cash_flow_checkpoints WHERE store_id = %s", (store_id,))
+    cur.execute("SELECT seal_cash_flow_checkpoints(%s) AS sealed", (store_id,))
+    return cur.fetchone()["sealed"]
+
+
+def verify_checkpoints(cur, store_id: int, tolerance: float = 0.005) -> List[Dict[str, Any]]:
+    """Checkpoints whose total differs from a full recomputation."""
+    cur.execute(
+        """
+        WITH running AS (
+            SELECT
+                time::DATE AS day,
+                SUM(SUM(COALESCE(amount, 0))) OVER (ORDER BY time::DATE) AS total
+            FROM cash_flow
+            WHERE store_id = %s
+            AND time IS NOT NULL
+            GROUP BY 1
+        )
+        SELECT
+            cp.day,
+            cp.total AS stored,
+            COALESCE((
+                SELECT r.total FROM running r
+                WHERE r.day <= cp.day
+                ORDER BY r.day DESC
+                LIMIT 1
+            ), 0) AS expected
+        FROM cash_flow_checkpoints cp
+        WHERE cp.store_id = %s
+        ORDER BY cp.day
+        """,
+        (store_id, store_id),
+    )
+    return [
+        row for row in cur.fetchall()
+        if abs(row["stored"] - row["expected"]) > tolerance
+    ]
+
+
+async def cash_checkpoint_loop() -> None:
+    logger.info("Starting cash_flow checkpoint job...")
+    while True:
+        try:
+            sealed = await asyncio.to_thread(seal_checkpoints)
+            if any(sealed.values()):
+                logger.info(f"Sealed cash_flow checkpoints: {sealed}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sealing cash_flow checkpoints: {e}")
+        await asyncio.sleep(CASH_CHECKPOINT_INTERVAL)
+
+
+def start_cash_checkpoint_job() -> asyncio.Task:
+    """Must be called from the running event loop (see leader_election)."""
+    return asyncio.create_task(cash_checkpoint_loop())
@@ -0,0 +1,452 @@
+"""
+Shared PostgreSQL connection pool.
+
+Every router, background task and helper checks connections out of one
+process-wide pool instead of opening a fresh psycopg2 connection (TCP + auth
+handshake) per request. Connections are health-checked on checkout and rolled
+back / reset on return, so a request always starts on a clean, warm session.
+
+Configuration (all optional, via .env):
+
+- DB_POOL_MIN_SIZE: connections opened on first use and kept warm (default 1)
+- DB_POOL_MAX_SIZE: hard cap of open connections per process (default 20)
+- DB_POOL_TIMEOUT: seconds to wait for a free connection before failing (default 10)
+- DB_POOL_HEALTH_CHECK_AFTER: idle seconds after which a connection is pinged
+  with SELECT 1 before being handed out (default 30, 0 pings every checkout)
+
+Every pooled connection hands out instrumented cursors: each execute /
+executemany is timed and passed to the observers registered with
+add_query_observer (request metrics, slow-query log).
+
+Two entry points cover the two styles used across the codebase:
+
+- `Database(HOST, DATABASE, USER, PASS)` context manager yielding a cursor,
+  committing on success and rolling back on error (drop-in for the old
+  per-module Database classes).
+- `connect(host=..., database=..., user=..., password=...)` returning a
+  connection whose `close()` hands it back to the pool (drop-in for
+  `psycopg2.connect` in the background helpers).
+"""
+
+import logging
+import threading
+import time
+from os import getenv
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+POOL_MIN_SIZE = int(getenv("DB_POOL_MIN_SIZE") or 1)
+POOL_MAX_SIZE = int(getenv("DB_POOL_MAX_SIZE") or 20)
+POOL_TIMEOUT = float(getenv("DB_POOL_TIMEOUT") or 10)
+POOL_HEALTH_CHECK_AFTER = float(getenv("DB_POOL_HEALTH_CHECK_AFTER") or 30)
+
+
+class PoolTimeout(PoolError):
+    "Raised when no connection becomes available within the checkout timeout"
+
+
+# Called as observer(cursor, query, params, duration_seconds, many) after every
+# statement run through a pooled connection. Observers must not raise.
+QueryObserver = Callable[[Any, Any, Any, float, bool], None]
+_query_observers: List[QueryObserver] = []
+
+
+def add_query_observer(observer: QueryObserver) -> None:
+    """Register a callback that sees every statement and its duration."""
+    if observer not in _query_observers:
+        _query_observers.append(observer)
+
+
+def _notify_observers(cursor, query, params, duration: float, many: bool) -> None:
+    for observer in _query_observers:
+        try:
+            observer(cursor, query, params, duration, many)
+        except Exception as e:
+            logger.error(f"Query observer {observer!r} failed: {e}")
+
+
+class _InstrumentedCursorMixin:
+    """Times execute / executemany and reports them to the query observers."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            if _query_observers:
+                _notify_observers(
+                    self, query, vars, time.perf_counter() - started, False
+                )
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            if _query_observers:
+                _notify_observers(
+                    self, query, vars_list, time.perf_counter() - started, True
+                )
+
+
+_instrumented_cursor_classes: Dict[type, type] = {}
+
+
+def _instrumented_cursor_class(base: type) -> type:
+    cls = _instrumented_cursor_classes.get(base)
+    if cls is None:
+        if issubclass(base, _InstrumentedCursorMixin):
+            cls = base
+        else:
+            cls = type(f"Instrumented{base.__name__}", (_InstrumentedCursorMixin, base), {})
+        _instrumented_cursor_classes[base] = cls
+    return cls
+
+
+class InstrumentedConnection(extensions.connection):
+    """psycopg2 connection whose cursors (any cursor_factory) are instrumented."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory or extensions.cursor
+        kwargs["cursor_factory"] = _instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+
+class ConnectionPool:
+    """
+    Thread-safe, bounded pool of psycopg2 connections.
+
+    Unlike psycopg2's ThreadedConnectionPool (which raises as soon as it is
+    exhausted), callers block up to `timeout` seconds for a connection, so a
+    burst of requests queues instead of failing.
+    """
+
+    def __init__(
+        self,
+        connect_kwargs: Dict[str, Any],
+        min_size: int = POOL_MIN_SIZE,
+        max_size: int = POOL_MAX_SIZE,
+        timeout: float = POOL_TIMEOUT,
+        health_check_after: float = POOL_HEALTH_CHECK_AFTER,
+    ):
+        self.connect_kwargs = connect_kwargs
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+
+        self._lock = threading.Condition()
+        # Idle connections as (connection, returned_at); used LIFO so the
+        # warmest connections are reused first.
+        self._idle: List[Tuple[Any, float]] = []
+        self._size = 0
+        self._waiting = 0
+        self._filled = False
+        self._closed = False
+
+        self._stats = {
+            "checkouts": 0,
+            "connects": 0,
+            "discarded": 0,
+            "health_check_failures": 0,
+            "timeouts": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            connection_factory=InstrumentedConnection, **self.connect_kwargs
+        )
+        with self._lock:
+            self._stats["connects"] += 1
+        return conn
+
+    def _fill(self) -> None:
+        """Open `min_size` connections the first time the pool is used."""
+        with self._lock:
+            if self._filled:
+                return
+            self._filled = True
+            missing = self.min_size - self._size
+            self._size += max(0, missing)
+
+        for _ in range(max(0, missing)):
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                    self._lock.notify()
+                raise
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+                self._lock.notify()
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn) -> None:
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._size -= 1
+            self._stats["discarded"] += 1
+            self._lock.notify()
+
+    def getconn(self, timeout: Optional[float] = None):
+        """Check out a healthy connection, waiting up to `timeout` seconds."""
+        if not self._filled:
+            self._fill()
+
+        wait_limit = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+
+        while True:
+            conn = None
+            idle_since = 0.0
+            with self._lock:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+
+                while not self._idle and self._size >= self.max_size:
+                    remaining = wait_limit - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"no database connection available after {wait_limit:.1f}s "
+                            f"(pool size {self.max_size})"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._lock.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    # Reserve a slot, connect outside the lock.
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+            elif not self._is_healthy(conn, idle_since):
+                with self._lock:
+                    self._stats["health_check_failures"] += 1
+                self._discard(conn)
+                continue
+
+            waited = time.monotonic() - started
+            with self._lock:
+                self._stats["checkouts"] += 1
+                self._stats["wait_time_total"] += waited
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+            return conn
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        """Return a connection, resetting it to a clean idle session."""
+        if not discard and not conn.closed:
+            try:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if not discard and conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                discard = True
+
+        if discard or conn.closed:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            if self._closed or len(self._idle) >= self.max_size:
+                keep = False
+            else:
+                self._idle.append((conn, time.monotonic()))
+                keep = True
+            self._lock.notify()
+
+        if not keep:
+            self._discard(conn)
+
+    def closeall(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            checkouts = self._stats["checkouts"]
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "timeout": self.timeout,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting,
+                **self._stats,
+                "wait_time_avg": (
+                    self._stats["wait_time_total"] / checkouts if checkouts else 0.0
+                ),
+            }
+
+
+_pools: Dict[Tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host, database, user, password) -> ConnectionPool:
+    """Return the process-wide pool for these connection details."""
+    key = (host, database, user, password)
+    pool = _pools.get(key)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                {"host": host, "database": database, "user": user, "password": password}
+            )
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats() -> List[Dict[str, Any]]:
+    """Stats for every pool in this process (normally exactly one)."""
+    with _pools_lock:
+        pools = list(_pools.items())
+    return [
+        {"host": key[0], "database": key[1], "user": key[2], **pool.stats()}
+        for key, pool in pools
+    ]
+
+
+def close_all_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.closeall()
+
+
+class PooledConnection:
+    """
+    psycopg2 connection borrowed from the pool.
+
+    Behaves like the underlying connection, except that `close()` returns it to
+    the pool (rolling back anything uncommitted) instead of closing the socket.
+    """
+
+    def __init__(self, pool: ConnectionPool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get("_conn")
+        if conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Same semantics as psycopg2: end the transaction, keep the connection.
+        if exc_type is not None:
+            self._conn.rollback()
+        else:
+            self._conn.commit()
+
+    def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.putconn(conn)
+
+    def __del__(self):
+        # Safety net for helpers that leak a connection on an error path.
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def connect(host=None, database=None, user=None, password=None) -> PooledConnection:
+    """Pooled replacement for psycopg2.connect(host=..., database=..., ...)."""
+    pool = get_pool(host, database, user, password)
+    return PooledConnection(pool, pool.getconn())
+
+
+class Database:
+    "Database context manager to handle the connection and cursor"
+
+    def __init__(self, host, database, user, password, real_dict_cursor=True):
+        self.host = host
+        self.database = database
+        self.user = user
+        self.password = password
+        self.real_dict_cursor = real_dict_cursor
+        self.pool = get_pool(host, database, user, password)
+        self.conn = None
+        self.cursor = None
+
+    def __enter__(self):
+        self.conn = self.pool.getconn()
+        self.cursor = self.conn.cursor(
+            cursor_factory=RealDictCursor if self.real_dict_cursor else None
+        )
+        return self.cursor
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        discard = False
+        try:
+            if exc_type is not None:
+                self.conn.rollback()
+            else:
+                self.conn.commit()
+        except psycopg2.Error:
+            discard = True
+            if exc_type is None:
+                raise
+        finally:
+            try:
+                self.cursor.close()
+            except psycopg2.Error:
+                pass
+            self.pool.putconn(self.conn, discard=discard)
+            self.conn = None
+            self.cursor = None
@@ -338,8 +338,8 @@ def insert_new_data(old_data):
                         bill_id = abs(int(cf[5].split("_")[1]))
 
                     cur.execute(
-                        "INSERT INTO cash_flow (id, store_id, time, amount, type, bill_id, description, total, party_id) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
-                        (cf[0], 1, cf[2], cf[3], cf[4], bill_id, cf[6], cf[7], cf[9]),
+                        "INSERT INTO cash_flow (id, store_id, time, amount, type, bill_id, description, party_id) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                        (cf[0], 1, cf[2], cf[3], cf[4], bill_id, cf[6], cf[9]),
                     )
 
                 # Insert products_flow (convert string bill_id to bigint)
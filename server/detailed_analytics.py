@@ -4,9 +4,8 @@ from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from os import getenv
 from typing import Optional, List, Dict
-import pandas as pd
-from utils import parse_date
-from analytics_utils import Database
+from utils import parse_date, find_fifo_start_time
+from database import Database
 from auth_middleware import get_current_user
 
 load_dotenv()
@@ -20,7 +19,7 @@ router = APIRouter()
 
 
 @router.get("/detailed-analytics")
-async def get_detailed_analytics(
+def get_detailed_analytics(
     store_id: int,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
@@ -28,6 +27,9 @@ async def get_detailed_analytics(
     party_id: Optional[int] = None,
     current_user: Dict = Depends(get_current_user),
 ):
+    # Imported here rather than at module level to keep server startup light
+    import pandas as pd
+
     # Normalize input dates
     if start_date is None:
         start_date = "2021-01-01"
@@ -219,34 +221,7 @@ async def get_detailed_analytics(
     # FIFO per product
     def compute_fifo_profit_for_product(product_id: int):
         with Database(HOST, DATABASE, USER, PASS) as cur:
-            cur.execute(
-                """
-                SELECT pf.time
-                FROM products_flow pf
-                JOIN bills b ON pf.bill_id = b.id
-                WHERE pf.product_id = %s AND pf.store_id = %s AND b.id > 0
-                  AND b.time < %s AND pf.total = 0
-                ORDER BY pf.time DESC LIMIT 1
-                """,
-                (product_id, store_id, start_dt),
-            )
-            sp = cur.fetchone()
-            if sp:
-                fifo_start_time = sp["time"]
-            else:
-                cur.execute(
-                    """
-                    SELECT MIN(pf.time) AS min_time
-                    FROM products_flow pf
-                    JOIN bills b ON pf.bill_id = b.id
-                    WHERE pf.product_id = %s AND pf.store_id = %s AND b.id > 0
-                    """,
-                    (product_id, store_id),
-                )
-                res = cur.fetchone()
-                fifo_start_time = (
-                    res["min_time"] if res and res["min_time"] else start_dt
-                )
+            fifo_start_time = find_fifo_start_time(cur, product_id, store_id, start_dt)
 
             # Transactions in window
             cur.execute(
@@ -0,0 +1,112 @@
+"""
+Conditional GET (ETag / If-None-Match) for reads that rarely change.
+
+Small tables (parties, payment methods, scopes, store data) have a change
+counter in table_versions, bumped by a statement trigger in the writer's
+transaction. Their ETag is built from the counters, one primary key lookup.
+
+The product catalog changes with every sale, so a counter row would be a
+hot spot. Its ETag is the catalog version of GET /products/changes instead.
+A request is answered 304 when no product or inventory row of the store was
+stamped at or after that version.
+
+Responses carry Cache-Control: no-cache, so browsers keep the body and
+revalidate it with If-None-Match on every fetch. A 304 runs neither the
+read queries nor the serialization.
+"""
+
+import re
+from typing import Any, Optional
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+CATALOG_ETAG = re.compile(r'^(?:W/)?"catalog-(\d+)(?:-([\d.]+))?"$')
+
+
+def _requested_etags(if_none_match: Optional[str]) -> list:
+    if not if_none_match:
+        return []
+    return [tag.strip() for tag in if_none_match.split(",") if tag.strip()]
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires"""
+    weak = etag[2:] if etag.startswith("W/") else etag
+    for tag in _requested_etags(if_none_match):
+        if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == weak:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    return Response(
+        status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"}
+    )
+
+
+def with_etag(content: Any, etag: str) -> JSONResponse:
+    return JSONResponse(
+        content=content,
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"},
+    )
+
+
+def table_versions(cur, *tables: str) -> str:
+    """Change counters of the tables, in order, joined with dots"""
+    cur.execute(
+        """
+        SELECT t.name, COALESCE(v.version, 0) AS version
+        FROM unnest(%s::VARCHAR[]) AS t(name)
+        LEFT JOIN table_versions v ON v.table_name = t.name
+        """,
+        (list(tables),),
+    )
+    versions = {row["name"]: row["version"] for row in cur.fetchall()}
+    return ".".join(str(versions[table]) for table in tables)
+
+
+def tables_etag(cur, *tables: str) -> str:
+    return f'W/"{"-".join(tables)}-{table_versions(cur, *tables)}"'
+
+
+def catalog_etag(version: int, suffix: str = "") -> str:
+    return f'W/"catalog-{version}{"-" + suffix if suffix else ""}"'
+
+
+def requested_catalog_version(if_none_match: Optional[str], suffix: str = "") -> Optional[int]:
+    """Catalog version of the client's ETag, if it has one with this suffix"""
+    for tag in _requested_etags(if_none_match):
+        match = CATALOG_ETAG.match(tag)
+        if match and (match.group(2) or "") == suffix:
+            return int(match.group(1))
+    return None
+
+
+def catalog_changed_since(cur, version: int, store_id: Optional[int] = None) -> bool:
+    """
+    Whether a product, or the inventory of the store (of any store when
+    store_id is None), changed at or after the catalog version.
+
+    Reservations have no version of their own: stamp_reserved_product_version
+    stamps the product_inventory row a reservation is made or released on.
+    That row always exists, because reserved_products references it by
+    foreign key, so the inventory check covers reservations too.
+    """
+    cur.execute(
+        """
+        SELECT
+            EXISTS (SELECT 1 FROM products WHERE version >= %(version)s)
+            OR EXISTS (
+                SELECT 1
+                FROM store_data s
+                WHERE (%(store_id)s::BIGINT IS NULL OR s.id = %(store_id)s)
+                AND EXISTS (
+                    SELECT 1 FROM product_inventory pi
+                    WHERE pi.store_id = s.id AND pi.version >= %(version)s
+                )
+            ) AS changed
+        """,
+        {"version": version, "store_id": store_id},
+    )
+    return cur.fetchone()["changed"]
@@ -6,11 +6,13 @@ Runs daily to create/update notifications for products nearing expiration.
 import asyncio
 import logging
 from datetime import datetime, timedelta
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 from os import getenv
+from typing import List
 
+from database import connect
+from store_cache import get_store_extra_info
 from notifications import upsert_expiration_notification, remove_expiration_notification
 
 load_dotenv()
@@ -39,18 +41,10 @@ def get_global_scheduler_settings() -> dict:
     Returns dict with 'check_hour' and 'check_minute'.
     """
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-
         # Get settings from primary store (id=1) - scheduler settings are global
-        cur.execute("SELECT extra_info FROM store_data WHERE id = 1")
-        result = cur.fetchone()
-
-        cur.close()
-        conn.close()
+        extra_info = get_store_extra_info(1)
 
-        if result and result.get("extra_info"):
-            extra_info = result["extra_info"]
+        if extra_info:
             check_time = extra_info.get(
                 "expiration_check_time",
                 f"{DEFAULT_CHECK_HOUR:02d}:{DEFAULT_CHECK_MINUTE:02d}",
@@ -76,21 +70,13 @@ def get_store_scheduler_settings(store_id: int) -> dict:
     Returns dict with 'check_hour', 'check_minute', and 'alert_days'.
     """
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-
-        cur.execute("SELECT extra_info FROM store_data WHERE id = %s", (store_id,))
-        result = cur.fetchone()
-
-        cur.close()
-        conn.close()
+        extra_info = get_store_extra_info(store_id)
 
         check_hour = DEFAULT_CHECK_HOUR
         check_minute = DEFAULT_CHECK_MINUTE
         alert_days = DEFAULT_EXPIRATION_ALERT_DAYS
 
-        if result and result.get("extra_info"):
-            extra_info = result["extra_info"]
+        if extra_info:
             alert_days = extra_info.get(
                 "expiration_alert_days", DEFAULT_EXPIRATION_ALERT_DAYS
             )
@@ -129,22 +115,9 @@ def get_store_expiration_threshold(store_id: int) -> int:
         Number of days for expiration alert threshold
     """
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        extra_info = get_store_extra_info(store_id)
 
-        cur.execute(
-            """
-            SELECT extra_info FROM store_data WHERE id = %s
-            """,
-            (store_id,),
-        )
-        result = cur.fetchone()
-
-        cur.close()
-        conn.close()
-
-        if result and result.get("extra_info"):
-            extra_info = result["extra_info"]
+        if extra_info:
             return extra_info.get(
                 "expiration_alert_days", DEFAULT_EXPIRATION_ALERT_DAYS
             )
@@ -165,7 +138,7 @@ def check_expiring_products_for_store(store_id: int, threshold_days: int):
     )
 
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+        conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         threshold_date = datetime.now().date() + timedelta(days=threshold_days)
@@ -272,7 +245,7 @@ def check_expiring_products():
     logging.info("Starting expiration check for all stores...")
 
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+        conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         # Get all stores
@@ -409,13 +382,15 @@ async def expiration_scheduler_loop():
             await asyncio.sleep(3600)
 
 
-def start_expiration_scheduler():
+def start_expiration_scheduler() -> List[asyncio.Task]:
     """
     Start the expiration scheduler as background tasks - one per store.
-    Should be called from FastAPI startup event.
+    Should be called from the running event loop; returns the created tasks
+    so the caller can stop them (see leader_election).
     """
+    tasks: List[asyncio.Task] = []
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+        conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         # Get all stores
@@ -428,7 +403,7 @@ def start_expiration_scheduler():
         # Create a separate scheduler task for each store
         for store in stores:
             store_id = store["id"]
-            asyncio.create_task(store_expiration_scheduler_loop(store_id))
+            tasks.append(asyncio.create_task(store_expiration_scheduler_loop(store_id)))
             logging.info(
                 f"Expiration scheduler background task created for store {store_id}"
             )
@@ -436,5 +411,7 @@ def start_expiration_scheduler():
     except Exception as e:
         logging.error(f"Error starting expiration schedulers: {e}")
         # Fallback to single global scheduler
-        asyncio.create_task(expiration_scheduler_loop())
+        tasks.append(asyncio.create_task(expiration_scheduler_loop()))
         logging.info("Fallback: Single expiration scheduler background task created")
+
+    return tasks
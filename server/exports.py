@@ -0,0 +1,319 @@
+"""
+Streaming exports of bills, cash flow and products_flow for accountants.
+
+Each export reads a server-side (named) cursor ITERSIZE rows at a time and
+writes them into a StreamingResponse in CHUNK_SIZE pieces, so a year of
+history costs the server as much memory as one chunk. Rows come oldest first,
+in the order of the (store_id, time) indexes, so Postgres streams them too
+instead of sorting the range.
+
+format=ndjson gives one JSON object per line, with the bill's products or
+the cash movement's account splits nested. format=csv gives one flat row per
+bill line or account split, with a UTF-8 BOM so spreadsheet programs read the
+Arabic names.
+
+The query is declared before the response starts, so bad parameters still
+get a 400. The export holds one pooled connection until the last row is sent
+or the client goes away.
+"""
+
+import csv
+import io
+import json
+import logging
+from datetime import datetime
+from os import getenv
+from typing import Literal, Optional
+from uuid import uuid4
+
+from dotenv import load_dotenv
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from psycopg2.extras import RealDictCursor
+
+from auth_middleware import get_current_user
+from database import connect
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+ITERSIZE = 2000
+CHUNK_SIZE = 64 * 1024
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+router = APIRouter(tags=["Exports"])
+
+
+def _date_range(start_date: Optional[str], end_date: Optional[str]) -> tuple:
+    return (
+        start_date if start_date else "1970-01-01",
+        end_date if end_date else datetime.now().isoformat(),
+    )
+
+
+def _csv_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _release(conn, cur) -> None:
+    """Close the export's cursor and return its connection, once"""
+    if cur.closed:
+        return
+    try:
+        cur.close()
+    except Exception:
+        pass
+    conn.close()
+
+
+def _rows_as_text(conn, cur, format: str):
+    """Serialize the cursor's rows, then hand the connection back"""
+    try:
+        buffer = io.StringIO()
+        writer = None
+        if format == "csv":
+            buffer.write("\ufeff")
+        for row in cur:
+            if format == "csv":
+                if writer is None:
+                    writer = csv.writer(buffer)
+                    writer.writerow(row.keys())
+                writer.writerow([_csv_value(value) for value in row.values()])
+            else:
+                buffer.write(json.dumps(row, default=str, ensure_ascii=False))
+                buffer.write("\n")
+            if buffer.tell() >= CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        _release(conn, cur)
+
+
+def _stream_export(name: str, format: str, query: str, params: tuple) -> StreamingResponse:
+    conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+    try:
+        cur = conn.cursor(name=f"export_{uuid4().hex}", cursor_factory=RealDictCursor)
+        cur.itersize = ITERSIZE
+        cur.execute(query, params)
+    except Exception as e:
+        conn.close()
+        logging.error(f"Error exporting {name}: {e}")
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    # Background tasks also run when the client disconnects mid-export,
+    # which never finishes the generator
+    release = BackgroundTasks()
+    release.add_task(_release, conn, cur)
+    return StreamingResponse(
+        _rows_as_text(conn, cur, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment;filename={name}.{format}"},
+        background=release,
+    )
+
+
+@router.get("/export/bills")
+def export_bills(
+    store_id: int,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Export the store's bills of a date range, oldest first
+
+    Returns:
+        StreamingResponse: NDJSON, one bill per line with its products, or
+        CSV, one row per bill line
+    """
+    if format == "csv":
+        query = """
+            SELECT
+                bills.id AS bill_id,
+                bills.time,
+                bills.type,
+                assosiated_parties.name AS party_name,
+                bills.discount,
+                bills.total,
+                bills.note,
+                products_flow.product_id,
+                products.name AS product_name,
+                products.bar_code,
+                products_flow.amount,
+                products_flow.wholesale_price,
+                products_flow.price
+            FROM bills
+            LEFT JOIN assosiated_parties ON assosiated_parties.id = bills.party_id
+            LEFT JOIN products_flow
+                ON products_flow.bill_id = bills.id
+                AND products_flow.store_id = bills.store_id
+            LEFT JOIN products ON products.id = products_flow.product_id
+            WHERE bills.store_id = %s
+            AND bills.time >= %s
+            AND bills.time <= %s
+            ORDER BY bills.time, bills.id, products_flow.id
+        """
+    else:
+        query = """
+            SELECT
+                bills.id,
+                bills.time,
+                bills.type,
+                bills.party_id,
+                assosiated_parties.name AS party_name,
+                bills.discount,
+                bills.total,
+                bills.note,
+                bills.payments,
+                COALESCE(lines.products, '[]'::json) AS products
+            FROM bills
+            LEFT JOIN assosiated_parties ON assosiated_parties.id = bills.party_id
+            LEFT JOIN LATERAL (
+                SELECT json_agg(
+                    json_build_object(
+                        'id', products_flow.product_id,
+                        'name', products.name,
+                        'bar_code', products.bar_code,
+                        'amount', products_flow.amount,
+                        'wholesale_price', products_flow.wholesale_price,
+                        'price', products_flow.price
+                    ) ORDER BY products_flow.id
+                ) AS products
+                FROM products_flow
+                JOIN products ON products.id = products_flow.product_id
+                WHERE products_flow.bill_id = bills.id
+                AND products_flow.store_id = bills.store_id
+            ) AS lines ON TRUE
+            WHERE bills.store_id = %s
+            AND bills.time >= %s
+            AND bills.time <= %s
+            ORDER BY bills.time, bills.id
+        """
+    return _stream_export(
+        "bills", format, query, (store_id, *_date_range(start_date, end_date))
+    )
+
+
+@router.get("/export/cash-flow")
+def export_cash_flow(
+    store_id: int,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Export the store's cash movements of a date range, oldest first, with
+    the running total as in GET /cash-flow
+
+    Returns:
+        StreamingResponse: NDJSON, one movement per line with its account
+        splits, or CSV, one row per account split
+    """
+    start, end = _date_range(start_date, end_date)
+    flow = """
+        SELECT
+            cash_flow.id,
+            cash_flow.store_id,
+            cash_flow.time,
+            cash_flow.type,
+            cash_flow.amount,
+            (SELECT cash_flow_total_before(%s, %s::TIMESTAMP))
+                + SUM(COALESCE(cash_flow.amount, 0)) OVER (ORDER BY cash_flow.time, cash_flow.id) AS total,
+            cash_flow.description,
+            cash_flow.bill_id,
+            assosiated_parties.name AS party_name
+        FROM cash_flow
+        LEFT JOIN assosiated_parties ON assosiated_parties.id = cash_flow.party_id
+        WHERE cash_flow.store_id = %s
+        AND cash_flow.time >= %s
+        AND cash_flow.time <= %s
+    """
+    if format == "csv":
+        query = f"""
+            SELECT
+                flow.id, flow.time, flow.type, flow.amount, flow.total,
+                flow.description, flow.bill_id, flow.party_name,
+                payment_methods.name AS account,
+                account_transactions.amount AS account_amount
+            FROM ({flow}) AS flow
+            LEFT JOIN account_transactions
+                ON account_transactions.cash_flow_id = flow.id
+                AND account_transactions.store_id = flow.store_id
+            LEFT JOIN payment_methods ON payment_methods.id = account_transactions.payment_method_id
+            ORDER BY flow.time, flow.id, account_transactions.id
+        """
+    else:
+        query = f"""
+            SELECT
+                flow.id, flow.time, flow.type, flow.amount, flow.total,
+                flow.description, flow.bill_id, flow.party_name,
+                COALESCE((
+                    SELECT json_agg(
+                        json_build_object('name', pm.name, 'amount', at.amount)
+                        ORDER BY at.id
+                    )
+                    FROM account_transactions at
+                    JOIN payment_methods pm ON pm.id = at.payment_method_id
+                    WHERE at.cash_flow_id = flow.id
+                    AND at.store_id = flow.store_id
+                ), '[]'::json) AS accounts
+            FROM ({flow}) AS flow
+            ORDER BY flow.time, flow.id
+        """
+    return _stream_export(
+        "cash-flow", format, query, (store_id, start, store_id, start, end)
+    )
+
+
+@router.get("/export/products-flow")
+def export_products_flow(
+    store_id: int,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Export the store's stock movements of a date range, oldest first
+
+    Returns:
+        StreamingResponse: One movement per line (NDJSON) or row (CSV)
+    """
+    query = """
+        SELECT
+            products_flow.id,
+            products_flow.time,
+            products_flow.bill_id,
+            bills.type AS bill_type,
+            products_flow.product_id,
+            products.name AS product_name,
+            products.bar_code,
+            products_flow.amount,
+            products_flow.wholesale_price,
+            products_flow.price,
+            products_flow.total AS stock_after
+        FROM products_flow
+        JOIN products ON products.id = products_flow.product_id
+        LEFT JOIN bills
+            ON bills.id = products_flow.bill_id
+            AND bills.store_id = products_flow.store_id
+        WHERE products_flow.store_id = %s
+        AND products_flow.time >= %s
+        AND products_flow.time <= %s
+        ORDER BY products_flow.time, products_flow.id
+    """
+    return _stream_export(
+        "products-flow", format, query, (store_id, *_date_range(start_date, end_date))
+    )
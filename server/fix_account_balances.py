@@ -0,0 +1,56 @@
+"""
+Rebuild or check the maintained account balances (see account_balances.py).
+
+Safe while the API is running. Each store is rebuilt in its own short
+transaction; cash movements of that store wait until its rebuild commits.
+
+    python fix_account_balances.py                 # rebuild every store
+    python fix_account_balances.py --store 1
+    python fix_account_balances.py --check         # report drift, change nothing
+"""
+
+import argparse
+from os import getenv
+
+from dotenv import load_dotenv
+
+from account_balances import rebuild_account_balances, verify_account_balances
+from cash_checkpoints import list_store_ids
+from database import Database
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild or check the maintained account balances.")
+    parser.add_argument("--store", type=int, help="only this store (default: all)")
+    parser.add_argument("--check", action="store_true", help="only report balances that differ")
+    args = parser.parse_args(argv)
+
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        store_ids = list_store_ids(cur, args.store)
+
+    drift = 0
+    for store_id in store_ids:
+        with Database(HOST, DATABASE, USER, PASS) as cur:
+            if args.check:
+                mismatches = verify_account_balances(cur, store_id)
+                drift += len(mismatches)
+                print(f"store {store_id}: {len(mismatches)} account(s) differ")
+                for row in mismatches:
+                    print(f"  {row['name']}: stored {row['stored']:.2f}, expected {row['expected']:.2f}")
+            else:
+                accounts = rebuild_account_balances(cur, store_id)
+                print(f"store {store_id}: {accounts} account balance(s) rebuilt")
+
+    if args.check and drift:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,56 @@
-import psycopg2
-from dotenv import load_dotenv
+"""
+Rebuild or check the cash_flow checkpoints (see cash_checkpoints.py).
+
+Safe while the API is running. Each store is rebuilt in its own short
+transaction. Sales dated today carry on meanwhile; backdated cash edits of
+that store wait until its rebuild commits.
+
+    python fix_cash_flow.py                 # rebuild every store
+    python fix_cash_flow.py --store 1
+    python fix_cash_flow.py --check         # report drift, change nothing
+"""
+
+import argparse
 from os import getenv
 
+from dotenv import load_dotenv
+
+from cash_checkpoints import list_store_ids, rebuild_checkpoints, verify_checkpoints
+from database import Database
+
 load_dotenv()
 
-# PostgreSQL connection details
 HOST = getenv("HOST")
 DATABASE = getenv("DATABASE")
 USER = getenv("USER")
 PASS = getenv("PASS")
 
-# Create the connection
-conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
-
-# Get a cursor
-cur = conn.cursor()
-
-cur.execute("""
-    UPDATE cash_flow
-    SET total = s.cumulative_sum
-    FROM (
-    SELECT 
-        id, 
-        store_id, 
-        SUM(amount) OVER (PARTITION BY store_id ORDER BY time, id) AS cumulative_sum
-    FROM cash_flow
-    ) s
-    WHERE cash_flow.id = s.id
-    AND cash_flow.store_id = s.store_id;
-  """)
-
-conn.commit()
-cur.close()
-conn.close()
-print("Cash flow total updated successfully.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild or check the cash_flow checkpoints.")
+    parser.add_argument("--store", type=int, help="only this store (default: all)")
+    parser.add_argument("--check", action="store_true", help="only report checkpoints that differ")
+    args = parser.parse_args(argv)
+
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        store_ids = list_store_ids(cur, args.store)
+
+    drift = 0
+    for store_id in store_ids:
+        with Database(HOST, DATABASE, USER, PASS) as cur:
+            if args.check:
+                mismatches = verify_checkpoints(cur, store_id)
+                drift += len(mismatches)
+                print(f"store {store_id}: {len(mismatches)} checkpoint(s) differ")
+                for row in mismatches[:20]:
+                    print(f"  {row['day']}: stored {row['stored']:.2f}, expected {row['expected']:.2f}")
+            else:
+                sealed = rebuild_checkpoints(cur, store_id)
+                print(f"store {store_id}: {sealed} checkpoint(s) rebuilt")
+
+    if args.check and drift:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
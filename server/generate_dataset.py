@@ -0,0 +1,998 @@
+"""
+Synthetic store dataset generator for scale testing.
+
+Rebuilds the schema exactly like init.py (create_all_tables /
+create_all_triggers). It then bulk-loads a seeded, production-sized dataset
+into the database from .env: stores, products, parties, employees, shifts,
+bills of every type with payment splits, products_flow lines, installments and
+their payments, reservations, expiry batches, salaries and manual cash
+movements.
+
+To keep loading fast, the rows are streamed with COPY while user triggers are
+disabled on the loaded tables. Everything the triggers would have produced is
+then rebuilt in a few set-based statements:
+
+- product_inventory stock
+- products_flow running totals
+- cash_flow daily checkpoints
+- the cash_flow rows for bills, installments and salaries
+- the account_transactions mirror (account_balances follows through its
+  triggers)
+- bills_collections
+
+Finally the triggers are re-enabled, so the result matches a database that
+grew through the API.
+
+Usage (DESTROYS the target database's data, hence --yes):
+
+    python generate_dataset.py --yes
+    python generate_dataset.py --yes --stores 3 --products 50000 --days 730 \\
+        --bills-per-day 800 --mix "sell=80,return=4,buy=5,BNPL=3,installment=4,reserve=2,buy-return=2"
+
+Defaults give roughly 2 stores x 365 days x 500 bills, which is about 365k
+bills, 1.1M products_flow rows and 400k cash_flow rows. The same --seed
+always produces the same data.
+"""
+
+import argparse
+import io
+import json
+import math
+import random
+import time
+from datetime import date, datetime, timedelta
+from os import getenv
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv  # type: ignore
+
+from init import (
+    connect_to_database,
+    create_all_tables,
+    create_all_triggers,
+    drop_all_tables,
+)
+
+load_dotenv()
+
+BILL_TYPES = ("sell", "return", "buy", "BNPL", "installment", "reserve", "buy-return")
+DEFAULT_MIX = "sell=82,return=3,buy=5,BNPL=3,installment=3,reserve=2,buy-return=2"
+
+# Bills whose money changes hands carry a payments split (see main._resolve_bill_payments)
+PAYMENT_BILL_TYPES = ("sell", "return", "buy", "buy-return")
+# Bill types that take stock out of the store (see main._add_bill_internal)
+OUTGOING_BILL_TYPES = ("sell", "BNPL", "installment", "reserve", "buy-return")
+# Bill types that always belong to a party
+PARTY_BILL_TYPES = ("buy", "buy-return", "BNPL", "installment", "reserve")
+
+# Tables loaded with COPY while their user triggers are disabled
+LOADED_TABLES = (
+    "products",
+    "assosiated_parties",
+    "bills",
+    "products_flow",
+    "cash_flow",
+    "installments",
+    "installments_flow",
+    "reserved_products",
+    "product_batches",
+    "shifts",
+    "employee",
+    "salaries",
+)
+
+CATEGORIES = [
+    "مواد غذائية",
+    "مشروبات",
+    "منظفات",
+    "عناية شخصية",
+    "أدوات منزلية",
+    "ألبان",
+    "مجمدات",
+    "حلويات",
+    "أدوات مكتبية",
+    "إلكترونيات",
+]
+EXTRA_PAYMENT_METHODS = ["فيزا", "انستاباي", "فودافون كاش"]
+OPENING_HOUR = 9
+CLOSING_HOUR = 23
+REORDER_LEVEL = 10
+COPY_CHUNK_ROWS = 50_000
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parse "sell=80,return=5,..." into normalized bill type weights."""
+    weights: Dict[str, float] = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name not in BILL_TYPES:
+            raise argparse.ArgumentTypeError(
+                f"unknown bill type {name!r} (expected one of {', '.join(BILL_TYPES)})"
+            )
+        weights[name] = float(value)
+    total = sum(weights.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("bill mix weights must add up to > 0")
+    return {name: weight / total for name, weight in weights.items()}
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    text = str(value)
+    if "\\" in text or "\t" in text or "\n" in text or "\r" in text:
+        text = (
+            text.replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+    return text
+
+
+class CopyWriter:
+    """
+    Buffers rows and streams them to a table with COPY ... FROM STDIN.
+
+    Foreign keys stay enforced while the user triggers are disabled, so the
+    writers of referenced tables are passed as parents and flushed first.
+    """
+
+    def __init__(
+        self, cur, table: str, columns: Sequence[str], parents: Sequence["CopyWriter"] = ()
+    ):
+        self.cur = cur
+        self.table = table
+        self.parents = parents
+        self.sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+        self.buffer = io.StringIO()
+        self.pending = 0
+        self.rows = 0
+
+    def write(self, row: Iterable) -> None:
+        self.buffer.write("\t".join(_copy_value(v) for v in row))
+        self.buffer.write("\n")
+        self.pending += 1
+        if self.pending >= COPY_CHUNK_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        for parent in self.parents:
+            parent.flush()
+        if not self.pending:
+            return
+        self.buffer.seek(0)
+        self.cur.copy_expert(self.sql, self.buffer)
+        self.rows += self.pending
+        self.pending = 0
+        self.buffer = io.StringIO()
+
+
+class Generator:
+    def __init__(self, cur, args):
+        self.cur = cur
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.end_day: date = args.end_date
+        self.start_day: date = self.end_day - timedelta(days=args.days - 1)
+
+        self.store_ids: List[int] = []
+        self.payment_methods: List[Tuple[int, str]] = []
+        self.product_prices: List[Tuple[float, float]] = []  # index = product id - 1
+        self.product_cum_weights: List[float] = []
+        self.batch_products: List[int] = []
+        self.customers: List[int] = []
+        self.suppliers: List[int] = []
+        self.next_bill_id = 1
+        self.next_installment_id = 1
+
+    # -- helpers ---------------------------------------------------------
+
+    def step(self, message: str) -> float:
+        print(f"- {message}...", flush=True)
+        return time.perf_counter()
+
+    def done(self, started: float, detail: str = "") -> None:
+        elapsed = time.perf_counter() - started
+        print(f"  done in {elapsed:.1f}s {detail}".rstrip(), flush=True)
+
+    def pick_products(self, count: int) -> List[int]:
+        """Distinct product ids, popular products (Zipf-like) more likely."""
+        picked = self.rng.choices(
+            range(1, self.args.products + 1),
+            cum_weights=self.product_cum_weights,
+            k=count,
+        )
+        return list(dict.fromkeys(picked))
+
+    def line_count(self) -> int:
+        # Geometric distribution with the requested mean, at least one line
+        mean = max(1.0, self.args.lines_per_bill)
+        if mean == 1.0:
+            return 1
+        p = 1.0 / mean
+        return 1 + int(math.log(1.0 - self.rng.random()) / math.log(1.0 - p))
+
+    def bill_time(self, day: date) -> datetime:
+        seconds = self.rng.randrange((CLOSING_HOUR - OPENING_HOUR) * 3600)
+        return datetime(day.year, day.month, day.day, OPENING_HOUR) + timedelta(
+            seconds=seconds
+        )
+
+    def payments_for(self, amount: float) -> List[dict]:
+        methods = self.payment_methods
+        if len(methods) > 1 and self.rng.random() < self.args.split_ratio:
+            chosen = self.rng.sample(methods, k=min(len(methods), self.rng.randint(2, 3)))
+            remaining = round(amount, 2)
+            lines = []
+            for i, (method_id, name) in enumerate(chosen):
+                if i == len(chosen) - 1:
+                    part = remaining
+                else:
+                    part = round(remaining * self.rng.uniform(0.2, 0.7), 2)
+                remaining = round(remaining - part, 2)
+                if part > 0:
+                    lines.append({"method_id": method_id, "name": name, "amount": part})
+            return lines
+        if len(methods) > 1 and self.rng.random() < self.args.split_ratio:
+            method_id, name = self.rng.choice(methods[1:])
+        else:
+            method_id, name = methods[0]
+        return [{"method_id": method_id, "name": name, "amount": round(amount, 2)}]
+
+    # -- schema ----------------------------------------------------------
+
+    def build_schema(self) -> None:
+        started = self.step("Rebuilding schema (drop_all_tables / create_all_tables / create_all_triggers)")
+        drop_all_tables(self.cur)
+        create_all_tables(self.cur)
+        create_all_triggers(self.cur)
+        self.done(started)
+
+    def create_stores(self) -> None:
+        """Stores and payment methods go through the normal triggers (few rows)."""
+        started = self.step(f"Creating {self.args.stores} store(s) and payment methods")
+        cur = self.cur
+        cur.execute("SELECT id FROM store_data WHERE id > 0 ORDER BY id")
+        self.store_ids = [row[0] for row in cur.fetchall()]
+        while len(self.store_ids) < self.args.stores:
+            n = len(self.store_ids) + 1
+            cur.execute(
+                """
+                INSERT INTO store_data (name, address, phone, extra_info)
+                VALUES (%s, '', '', '{}')
+                RETURNING id
+                """,
+                (f"فرع {n}",),
+            )
+            self.store_ids.append(cur.fetchone()[0])
+        self.store_ids = self.store_ids[: self.args.stores]
+
+        # create_all_tables only seeds the -1 placeholder bill for store 0
+        cur.execute(
+            """
+            INSERT INTO bills (id, store_id)
+            SELECT -1, id FROM store_data
+            ON CONFLICT DO NOTHING
+            """
+        )
+
+        for name in EXTRA_PAYMENT_METHODS[: max(0, self.args.payment_methods - 1)]:
+            cur.execute(
+                "INSERT INTO payment_methods (name, is_default, is_deleted) VALUES (%s, FALSE, FALSE)",
+                (name,),
+            )
+        cur.execute(
+            "SELECT id, name FROM payment_methods WHERE is_deleted = FALSE ORDER BY is_default DESC, id"
+        )
+        self.payment_methods = [(row[0], row[1]) for row in cur.fetchall()]
+        self.done(started)
+
+    def disable_triggers(self) -> None:
+        for table in LOADED_TABLES:
+            self.cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+
+    def enable_triggers(self) -> None:
+        for table in LOADED_TABLES:
+            self.cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+
+    # -- reference data --------------------------------------------------
+
+    def load_products(self) -> None:
+        args = self.args
+        started = self.step(f"Loading {args.products} products")
+        writer = CopyWriter(
+            self.cur,
+            "products",
+            ("id", "name", "bar_code", "wholesale_price", "price", "category"),
+        )
+        cum = 0.0
+        for product_id in range(1, args.products + 1):
+            wholesale = round(min(5000.0, self.rng.lognormvariate(3.5, 1.0)), 2)
+            price = round(wholesale * self.rng.uniform(1.1, 1.5), 2)
+            self.product_prices.append((wholesale, price))
+            # Zipf-like popularity: a small head of products dominates sales
+            cum += 1.0 / (product_id ** args.popularity_skew)
+            self.product_cum_weights.append(cum)
+            writer.write(
+                (
+                    product_id,
+                    f"منتج {product_id}",
+                    f"{product_id:013d}",
+                    wholesale,
+                    price,
+                    CATEGORIES[product_id % len(CATEGORIES)],
+                )
+            )
+        writer.flush()
+
+        # add_product_to_all_stores is disabled; give every store a row
+        self.cur.execute(
+            """
+            INSERT INTO product_inventory (store_id, product_id, stock)
+            SELECT s.id, p.id, 0
+            FROM store_data s CROSS JOIN products p
+            ON CONFLICT (store_id, product_id) DO NOTHING
+            """
+        )
+        self.batch_products = [
+            pid for pid in range(1, args.products + 1) if self.rng.random() < args.batch_ratio
+        ]
+        self.done(started)
+
+    def load_parties(self) -> None:
+        args = self.args
+        started = self.step(f"Loading {args.parties} parties")
+        self.cur.execute("SELECT COALESCE(MAX(id), 0) FROM assosiated_parties")
+        next_id = self.cur.fetchone()[0] + 1
+        writer = CopyWriter(
+            self.cur,
+            "assosiated_parties",
+            ("id", "name", "phone", "address", "type", "extra_info", "bar_code"),
+        )
+        n_suppliers = max(1, int(args.parties * args.supplier_ratio))
+        for i in range(args.parties):
+            party_id = next_id + i
+            is_supplier = i < n_suppliers
+            if is_supplier:
+                self.suppliers.append(party_id)
+            else:
+                self.customers.append(party_id)
+            writer.write(
+                (
+                    party_id,
+                    f"{'مورد' if is_supplier else 'عميل'} {i + 1}",
+                    f"01{self.rng.randrange(10**9):09d}",
+                    "",
+                    "مورد" if is_supplier else "عميل",
+                    {},
+                    None if is_supplier else f"CL{party_id:010d}",
+                )
+            )
+        writer.flush()
+        if not self.customers:
+            self.customers = list(self.suppliers)
+        self.done(started)
+
+    def load_staff(self) -> None:
+        """Employees, monthly salaries and one shift per store per day."""
+        args = self.args
+        started = self.step("Loading employees, salaries and shifts")
+        employees = CopyWriter(
+            self.cur,
+            "employee",
+            ("id", "store_id", "name", "phone", "address", "salary", "started_on"),
+        )
+        salaries = CopyWriter(
+            self.cur,
+            "salaries",
+            ("employee_id", "amount", "bonus", "deductions", "time", "payment_method_id"),
+            parents=(employees,),
+        )
+        shifts = CopyWriter(
+            self.cur,
+            "shifts",
+            ("store_id", "start_date_time", "end_date_time", "current", "user_id"),
+        )
+        cash_method = self.payment_methods[0][0]
+        employee_id = 0
+        for store_id in self.store_ids:
+            for n in range(args.employees_per_store):
+                employee_id += 1
+                salary = float(self.rng.randrange(4000, 12000, 500))
+                employees.write(
+                    (
+                        employee_id,
+                        store_id,
+                        f"موظف {store_id}-{n + 1}",
+                        f"01{self.rng.randrange(10**9):09d}",
+                        "",
+                        salary,
+                        datetime.combine(self.start_day, datetime.min.time()),
+                    )
+                )
+                day = self.start_day
+                while day <= self.end_day:
+                    if day.day == 1:
+                        bonus = float(self.rng.choice((0, 0, 0, 250, 500)))
+                        deductions = float(self.rng.choice((0, 0, 0, 0, 100)))
+                        salaries.write(
+                            (
+                                employee_id,
+                                salary,
+                                bonus,
+                                deductions,
+                                datetime(day.year, day.month, day.day, 10),
+                                cash_method,
+                            )
+                        )
+                    day += timedelta(days=1)
+
+            day = self.start_day
+            while day <= self.end_day:
+                start = datetime(day.year, day.month, day.day, OPENING_HOUR)
+                is_last = day == self.end_day
+                shifts.write(
+                    (
+                        store_id,
+                        start,
+                        None if is_last else start.replace(hour=CLOSING_HOUR),
+                        is_last,
+                        1,
+                    )
+                )
+                day += timedelta(days=1)
+        employees.flush()
+        salaries.flush()
+        shifts.flush()
+        self.done(started, f"({employees.rows} employees, {salaries.rows} salaries, {shifts.rows} shifts)")
+
+    # -- transactions ----------------------------------------------------
+
+    def load_transactions(self) -> None:
+        args = self.args
+        started = self.step(
+            f"Generating {args.days} days x {args.bills_per_day} bills/day x {len(self.store_ids)} store(s)"
+        )
+        cur = self.cur
+        bills = CopyWriter(
+            cur,
+            "bills",
+            ("id", "store_id", "time", "discount", "total", "type", "note", "party_id", "payments"),
+        )
+        flows = CopyWriter(
+            cur,
+            "products_flow",
+            ("store_id", "bill_id", "product_id", "wholesale_price", "price", "amount", "time"),
+            parents=(bills,),
+        )
+        installments = CopyWriter(
+            cur,
+            "installments",
+            ("id", "bill_id", "store_id", "paid", "installments_count", "installment_interval"),
+            parents=(bills,),
+        )
+        installment_flows = CopyWriter(
+            cur, "installments_flow", ("installment_id", "amount", "time"), parents=(installments,)
+        )
+        reserved = CopyWriter(
+            cur, "reserved_products", ("store_id", "bill_id", "product_id", "amount"), parents=(bills,)
+        )
+        manual_cash = CopyWriter(
+            cur,
+            "cash_flow",
+            ("store_id", "time", "amount", "type", "description", "party_id", "payment_method_id"),
+        )
+
+        mix = args.mix
+        types = list(mix.keys())
+        type_weights = list(mix.values())
+        end_of_data = datetime.combine(self.end_day, datetime.max.time())
+
+        for store_id in self.store_ids:
+            stock = [0] * (args.products + 1)
+            low_stock = set()
+
+            # Opening stock: one big purchase per store before the first day
+            opening_time = datetime.combine(
+                self.start_day - timedelta(days=1), datetime.min.time()
+            ).replace(hour=OPENING_HOUR)
+            opening_lines = []
+            for product_id in range(1, args.products + 1):
+                quantity = self.rng.randint(20, 200)
+                stock[product_id] += quantity
+                opening_lines.append((product_id, quantity))
+            self._write_bill(
+                bills, flows, store_id, opening_time, "buy",
+                self.rng.choice(self.suppliers), opening_lines, 0.0,
+            )
+
+            day = self.start_day
+            while day <= self.end_day:
+                count = max(1, int(self.rng.gauss(args.bills_per_day, args.bills_per_day * 0.15)))
+                times = sorted(self.bill_time(day) for _ in range(count))
+                day_types = self.rng.choices(types, weights=type_weights, k=count)
+
+                for bill_time, bill_type in zip(times, day_types):
+                    if bill_type == "buy":
+                        # Restock what ran low, topped up with random products
+                        wanted = self.line_count() * 3
+                        restock = [low_stock.pop() for _ in range(min(len(low_stock), wanted))]
+                        restock += self.pick_products(max(0, wanted - len(restock)))
+                        lines = [
+                            (pid, self.rng.randint(50, 200))
+                            for pid in dict.fromkeys(restock)
+                        ]
+                    else:
+                        lines = [
+                            (pid, self.rng.choice((1, 1, 1, 1, 2, 2, 3, 5)))
+                            for pid in self.pick_products(self.line_count())
+                        ]
+
+                    outgoing = bill_type in OUTGOING_BILL_TYPES
+                    for pid, quantity in lines:
+                        stock[pid] += -quantity if outgoing else quantity
+                        if stock[pid] < REORDER_LEVEL:
+                            low_stock.add(pid)
+                        else:
+                            low_stock.discard(pid)
+
+                    if bill_type in ("buy", "buy-return"):
+                        party_id = self.rng.choice(self.suppliers)
+                    elif bill_type in PARTY_BILL_TYPES or self.rng.random() < args.party_ratio:
+                        party_id = self.rng.choice(self.customers)
+                    else:
+                        party_id = None
+
+                    discount = 0.0
+                    if bill_type == "sell" and self.rng.random() < args.discount_ratio:
+                        discount = float(self.rng.choice((1, 2, 5, 10, 20)))
+
+                    bill_id, value = self._write_bill(
+                        bills, flows, store_id, bill_time, bill_type, party_id, lines, discount
+                    )
+
+                    if bill_type == "reserve":
+                        for pid, quantity in lines:
+                            reserved.write((store_id, bill_id, pid, quantity))
+                    elif bill_type == "installment":
+                        self._write_installment(
+                            installments, installment_flows, store_id, bill_id,
+                            bill_time, value, end_of_data,
+                        )
+
+                for _ in range(args.manual_cash_per_day):
+                    is_in = self.rng.random() < 0.3
+                    amount = round(self.rng.uniform(20, 1500), 2)
+                    manual_cash.write(
+                        (
+                            store_id,
+                            self.bill_time(day),
+                            amount if is_in else -amount,
+                            "in" if is_in else "out",
+                            "ايداع" if is_in else self.rng.choice(("مصروفات", "نثريات", "كهرباء", "مواصلات")),
+                            None,
+                            self.rng.choice(self.payment_methods)[0],
+                        )
+                    )
+                day += timedelta(days=1)
+
+        for writer in (bills, flows, installments, installment_flows, reserved, manual_cash):
+            writer.flush()
+        self.done(
+            started,
+            f"({bills.rows} bills, {flows.rows} products_flow, {installments.rows} installments, "
+            f"{installment_flows.rows} installment payments, {manual_cash.rows} manual cash rows)",
+        )
+
+    def _write_bill(
+        self,
+        bills: CopyWriter,
+        flows: CopyWriter,
+        store_id: int,
+        bill_time: datetime,
+        bill_type: str,
+        party_id: Optional[int],
+        lines: List[Tuple[int, int]],
+        discount: float,
+    ) -> Tuple[int, float]:
+        bill_id = self.next_bill_id
+        self.next_bill_id += 1
+
+        use_wholesale = bill_type in ("buy", "buy-return")
+        value = 0.0
+        outgoing = bill_type in OUTGOING_BILL_TYPES
+        flow_rows = []
+        for product_id, quantity in lines:
+            wholesale, price = self.product_prices[product_id - 1]
+            value += quantity * (wholesale if use_wholesale else price)
+            flow_rows.append(
+                (
+                    store_id,
+                    bill_id,
+                    product_id,
+                    wholesale,
+                    price,
+                    -quantity if outgoing else quantity,
+                    bill_time,
+                )
+            )
+        value = round(max(0.0, value - discount), 2)
+
+        # Same sign convention as main._add_bill_internal
+        if bill_type in ("sell", "reserve", "buy-return"):
+            total = value
+        elif bill_type in ("buy", "return"):
+            total = -value
+        else:
+            total = 0.0
+
+        payments = self.payments_for(value) if bill_type in PAYMENT_BILL_TYPES else None
+        # The bill goes first: a flush of the lines flushes the bills before them
+        bills.write(
+            (bill_id, store_id, bill_time, discount, total, bill_type, "", party_id, payments)
+        )
+        for row in flow_rows:
+            flows.write(row)
+        return bill_id, value
+
+    def _write_installment(
+        self,
+        installments: CopyWriter,
+        installment_flows: CopyWriter,
+        store_id: int,
+        bill_id: int,
+        bill_time: datetime,
+        value: float,
+        end_of_data: datetime,
+    ) -> None:
+        installment_id = self.next_installment_id
+        self.next_installment_id += 1
+        paid = round(value * self.rng.uniform(0.1, 0.3), 2)
+        count = self.rng.choice((3, 6, 6, 10, 12))
+        interval = 30
+        installments.write((installment_id, bill_id, store_id, paid, count, interval))
+
+        per_installment = round((value - paid) / count, 2)
+        for n in range(1, count + 1):
+            paid_at = bill_time + timedelta(days=interval * n + self.rng.randint(-3, 10))
+            if paid_at > end_of_data:
+                break
+            installment_flows.write((installment_id, per_installment, paid_at))
+
+    def load_batches(self) -> None:
+        """Expiry batches covering the final stock of batch-tracked products."""
+        started = self.step(f"Loading expiry batches for {len(self.batch_products)} products")
+        self.cur.execute(
+            """
+            SELECT store_id, product_id, SUM(amount) AS stock
+            FROM products_flow
+            WHERE product_id = ANY(%s)
+            GROUP BY store_id, product_id
+            HAVING SUM(amount) > 0
+            """,
+            (self.batch_products,),
+        )
+        writer = CopyWriter(
+            self.cur, "product_batches", ("store_id", "product_id", "quantity", "expiration_date")
+        )
+        for store_id, product_id, stock in self.cur.fetchall():
+            n_batches = min(int(stock), self.rng.randint(1, 3))
+            remaining = int(stock)
+            used_dates = set()
+            for n in range(n_batches):
+                quantity = remaining if n == n_batches - 1 else self.rng.randint(1, remaining - (n_batches - n - 1))
+                remaining -= quantity
+                expires = self.end_day + timedelta(days=self.rng.randint(-20, 400))
+                while expires in used_dates:
+                    expires += timedelta(days=1)
+                used_dates.add(expires)
+                writer.write((store_id, product_id, quantity, expires))
+        writer.flush()
+        self.done(started, f"({writer.rows} batches)")
+
+    # -- derived data ------------------------------------------------------
+
+    def rebuild_derived(self) -> None:
+        started = self.step("Rebuilding what the disabled triggers would have written")
+        rebuild_derived_data(self.cur)
+        self.done(started)
+
+
+def rebuild_derived_data(cur) -> None:
+    """
+    Set-based equivalent of the row triggers for bulk-loaded rows: cash_flow
+    rows for bills / installments / salaries, stock, running totals, the
+    accounts mirror, bills_collections and the cash_flow checkpoints. Expects
+    the derived tables to be empty apart from manual cash_flow rows.
+    """
+    # products_flow_after_insert: stock
+    cur.execute(
+        """
+        UPDATE product_inventory pi
+        SET stock = s.stock
+        FROM (
+            SELECT store_id, product_id, SUM(amount) AS stock
+            FROM products_flow
+            GROUP BY store_id, product_id
+        ) s
+        WHERE pi.store_id = s.store_id AND pi.product_id = s.product_id
+        """
+    )
+
+    # products_flow_after_insert: running totals
+    cur.execute(
+        """
+        UPDATE products_flow pf
+        SET total = s.running
+        FROM (
+            SELECT
+                id,
+                store_id,
+                SUM(COALESCE(amount, 0)) OVER (
+                    PARTITION BY store_id, product_id ORDER BY time, id
+                ) AS running
+            FROM products_flow
+        ) s
+        WHERE pf.id = s.id AND pf.store_id = s.store_id
+        """
+    )
+
+    # insert_cash_flow_after_insert (bills), _installment (down payments),
+    # _installment_flow (payments) and _salary, in time order so ids follow time
+    cur.execute(
+        """
+        INSERT INTO cash_flow (
+            store_id, time, amount, type, bill_id, description, party_id, payment_method_id
+        )
+        SELECT store_id, time, amount, type, bill_id, description, party_id, payment_method_id
+        FROM (
+            SELECT
+                b.store_id, b.time, b.total AS amount,
+                CASE WHEN b.type IN ('sell', 'BNPL', 'reserve', 'installment', 'buy-return')
+                     THEN 'in' ELSE 'out' END AS type,
+                b.id AS bill_id,
+                CASE WHEN b.type = 'sell' THEN 'فاتورة بيع'
+                     WHEN b.type = 'buy' THEN 'فاتورة شراء'
+                     WHEN b.type = 'return' THEN 'فاتورة مرتجع'
+                     WHEN b.type = 'reserve' THEN 'فاتورة حجز'
+                     WHEN b.type = 'installment' THEN 'فاتورة تقسيط'
+                     WHEN b.type = 'BNPL' THEN 'فاتورة اجل'
+                     WHEN b.type = 'buy-return' THEN 'فاتورة مرتجع شراء'
+                     ELSE 'فاتورة' END AS description,
+                b.party_id,
+                NULL::BIGINT AS payment_method_id,
+                0 AS ord
+            FROM bills b
+            WHERE b.id > 0
+
+            UNION ALL
+            SELECT i.store_id, b.time, i.paid, 'in', i.bill_id, 'مقدم', b.party_id, NULL, 1
+            FROM installments i
+            JOIN bills b ON b.id = i.bill_id AND b.store_id = i.store_id
+
+            UNION ALL
+            SELECT i.store_id, f.time, f.amount, 'in', i.bill_id, 'قسط', b.party_id, NULL, 1
+            FROM installments_flow f
+            JOIN installments i ON i.id = f.installment_id
+            JOIN bills b ON b.id = i.bill_id AND b.store_id = i.store_id
+
+            UNION ALL
+            SELECT
+                e.store_id, s.time, -s.amount - s.bonus + s.deductions, 'out', NULL,
+                'راتب ' || e.name || ' بمبلغ ' || s.amount || ' ومكافأة ' || s.bonus
+                    || ' وخصم ' || s.deductions,
+                NULL, s.payment_method_id, 1
+            FROM salaries s
+            JOIN employee e ON e.id = s.employee_id
+        ) rows
+        ORDER BY time, ord
+        """
+    )
+
+    # mirror_cash_flow_to_accounts: split bills first, then everything else
+    cur.execute("DELETE FROM account_transactions WHERE cash_flow_id IS NOT NULL")
+    cur.execute(
+        """
+        WITH default_method AS (
+            SELECT id FROM payment_methods
+            WHERE is_deleted = FALSE
+            ORDER BY is_default DESC, id ASC
+            LIMIT 1
+        ),
+        split AS (
+            SELECT cf.id, cf.store_id, cf.amount, cf.time, b.payments,
+                   (SELECT SUM((e->>'amount')::numeric)
+                    FROM jsonb_array_elements(b.payments) e) AS payments_sum
+            FROM cash_flow cf
+            JOIN bills b ON b.id = cf.bill_id AND b.store_id = cf.store_id
+            WHERE COALESCE(cf.amount, 0) <> 0
+              AND jsonb_typeof(b.payments) = 'array'
+              AND jsonb_array_length(b.payments) > 0
+        )
+        INSERT INTO account_transactions
+            (store_id, payment_method_id, cash_flow_id, amount, source, time)
+        SELECT
+            s.store_id,
+            COALESCE(NULLIF(e->>'method_id', '')::bigint, dm.id),
+            s.id,
+            s.amount * ((e->>'amount')::numeric / s.payments_sum),
+            'bill',
+            s.time
+        FROM split s
+        CROSS JOIN default_method dm
+        CROSS JOIN LATERAL jsonb_array_elements(s.payments) e
+        WHERE s.payments_sum > 0
+        """
+    )
+    cur.execute(
+        """
+        WITH default_method AS (
+            SELECT id FROM payment_methods
+            WHERE is_deleted = FALSE
+            ORDER BY is_default DESC, id ASC
+            LIMIT 1
+        )
+        INSERT INTO account_transactions
+            (store_id, payment_method_id, cash_flow_id, amount, source, time)
+        SELECT
+            cf.store_id,
+            COALESCE(cf.payment_method_id, dm.id),
+            cf.id,
+            cf.amount,
+            CASE WHEN cf.bill_id IS NOT NULL THEN 'bill' ELSE 'manual' END,
+            cf.time
+        FROM cash_flow cf
+        CROSS JOIN default_method dm
+        WHERE COALESCE(cf.amount, 0) <> 0
+          AND NOT EXISTS (
+              SELECT 1 FROM account_transactions at
+              WHERE at.cash_flow_id = cf.id AND at.store_id = cf.store_id
+          )
+        """
+    )
+
+    # add_bill_to_collections: one open collection per party
+    cur.execute(
+        """
+        INSERT INTO bills_collections
+            (collection_id, party_id, bill_id, store_id, is_closed, created_at)
+        SELECT c.collection_id, b.party_id, b.id, b.store_id, FALSE, b.time
+        FROM bills b
+        JOIN (
+            SELECT party_id, gen_random_uuid() AS collection_id
+            FROM bills
+            WHERE party_id IS NOT NULL
+            GROUP BY party_id
+        ) c ON c.party_id = b.party_id
+        WHERE b.id > 0
+        ORDER BY b.time, b.id
+        """
+    )
+
+    # cash_flow_checkpoints: seal the loaded history
+    cur.execute("SELECT seal_cash_flow_checkpoints(id) FROM store_data")
+
+
+def reset_sequences(cur) -> None:
+    """Move serial sequences past the explicitly loaded ids."""
+    for table in ("products", "assosiated_parties", "bills", "installments", "employee"):
+        cur.execute(
+            f"""
+            SELECT setval(
+                pg_get_serial_sequence('{table}', 'id'),
+                GREATEST((SELECT MAX(id) FROM {table}), 1)
+            )
+            """
+        )
+
+
+def print_summary(cur) -> None:
+    print("\nRow counts:")
+    for table in (
+        "store_data",
+        "products",
+        "product_inventory",
+        "assosiated_parties",
+        "bills",
+        "products_flow",
+        "cash_flow",
+        "cash_flow_checkpoints",
+        "account_transactions",
+        "account_balances",
+        "installments",
+        "installments_flow",
+        "reserved_products",
+        "product_batches",
+        "bills_collections",
+        "shifts",
+        "employee",
+        "salaries",
+    ):
+        cur.execute(f"SELECT COUNT(*) FROM {table}")
+        print(f"  {table:<22} {cur.fetchone()[0]:>12,}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Rebuild the schema and bulk-load a synthetic, seeded store dataset."
+    )
+    parser.add_argument("--yes", action="store_true", help="confirm wiping the target database")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--stores", type=int, default=2, help="retail stores (besides the warehouse, id 0)")
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--parties", type=int, default=5_000)
+    parser.add_argument("--supplier-ratio", type=float, default=0.05, help="share of parties that are suppliers")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument(
+        "--end-date",
+        type=date.fromisoformat,
+        default=date.today(),
+        help="last day of data, YYYY-MM-DD (default: today)",
+    )
+    parser.add_argument("--bills-per-day", type=int, default=500, help="average bills per store per day")
+    parser.add_argument("--lines-per-bill", type=float, default=3.0, help="average products per bill")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"bill type weights (default {DEFAULT_MIX})")
+    parser.add_argument("--popularity-skew", type=float, default=1.0, help="Zipf exponent of product popularity")
+    parser.add_argument("--party-ratio", type=float, default=0.2, help="share of sell/return bills tied to a customer")
+    parser.add_argument("--split-ratio", type=float, default=0.15, help="share of bills paid with non-cash / split payments")
+    parser.add_argument("--discount-ratio", type=float, default=0.1, help="share of sell bills with a discount")
+    parser.add_argument("--payment-methods", type=int, default=4, help="payment methods including cash (max 4)")
+    parser.add_argument("--batch-ratio", type=float, default=0.2, help="share of products tracked in expiry batches")
+    parser.add_argument("--employees-per-store", type=int, default=4)
+    parser.add_argument("--manual-cash-per-day", type=int, default=3, help="manual cash movements per store per day")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.yes:
+        print(
+            f"This drops and recreates every table in database {getenv('DATABASE')!r} "
+            f"on {getenv('HOST')!r}. Re-run with --yes to continue."
+        )
+        return
+
+    started = time.perf_counter()
+    conn, cur = connect_to_database()
+    try:
+        generator = Generator(cur, args)
+        generator.build_schema()
+        generator.create_stores()
+        generator.disable_triggers()
+        generator.load_products()
+        generator.load_parties()
+        generator.load_staff()
+        generator.load_transactions()
+        generator.load_batches()
+        generator.rebuild_derived()
+        reset_sequences(cur)
+        generator.enable_triggers()
+        conn.commit()
+
+        # Fresh planner statistics, otherwise the first queries plan for empty tables
+        conn.autocommit = True
+        step = generator.step("Analyzing tables")
+        cur.execute("ANALYZE")
+        generator.done(step)
+
+        print_summary(cur)
+        print(f"\nDataset generated in {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error generating dataset: {e}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Idempotency keys for write endpoints that terminals retry (POST /bill,
+POST /cash-flow, POST /admin/move-products).
+
+The client sends an Idempotency-Key header, unique per store. The first
+request claims the key in idempotency_keys, inside the same transaction as
+its writes when it has only one, and stores its response there. A retry gets
+the stored response back from one primary key lookup, and nothing is written
+twice. A retry that arrives while the first request is still running waits
+for its commit on the primary key. For endpoints that commit in several
+steps it gets 409 instead, and should retry later. Reusing a key for a
+different request gets 422.
+
+The leader worker deletes keys older than IDEMPOTENCY_KEY_TTL_HOURS (default
+72) every hour.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+from os import getenv
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from psycopg2.extras import Json
+
+from database import Database
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+IDEMPOTENCY_KEY_TTL_HOURS = float(getenv("IDEMPOTENCY_KEY_TTL_HOURS") or 72)
+IDEMPOTENCY_PURGE_INTERVAL = 3600
+
+logger = logging.getLogger(__name__)
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """Hash of the request, to tell a retry from a reused key"""
+    payload = json.dumps(jsonable_encoder(parts), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def claim_idempotency_key(
+    cur, store_id: int, key: str, endpoint: str, fingerprint: str
+) -> Optional[dict]:
+    """
+    Claim the key in the caller's transaction.
+
+    Returns None when the key is new: the caller does the work and calls
+    save_idempotent_response before committing. Returns the stored response
+    when the request already completed. Raises 409 while it is still in
+    progress, and 422 when the key was used for a different request.
+    """
+    # Waits here while another transaction holds the same key uncommitted
+    cur.execute(
+        """
+        INSERT INTO idempotency_keys (store_id, key, endpoint, request_hash)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (store_id, key) DO NOTHING
+        RETURNING key
+        """,
+        (store_id, key, endpoint, fingerprint),
+    )
+    if cur.fetchone():
+        return None
+
+    cur.execute(
+        """
+        SELECT endpoint, request_hash, response
+        FROM idempotency_keys
+        WHERE store_id = %s AND key = %s
+        """,
+        (store_id, key),
+    )
+    row = cur.fetchone()
+    if row is None:
+        # Purged between the two statements
+        raise HTTPException(status_code=409, detail="Idempotency key expired, retry")
+    if row["endpoint"] != endpoint or row["request_hash"] != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency key was already used for a different request",
+        )
+    if row["response"] is None:
+        raise HTTPException(
+            status_code=409, detail="A request with this idempotency key is in progress"
+        )
+    return row["response"]
+
+
+def save_idempotent_response(cur, store_id: int, key: str, response: Any) -> Any:
+    """Store the response of a claimed key. Returns the response as stored."""
+    encoded = jsonable_encoder(response)
+    cur.execute(
+        """
+        UPDATE idempotency_keys
+        SET response = %s
+        WHERE store_id = %s AND key = %s
+        """,
+        (Json(encoded), store_id, key),
+    )
+    return encoded
+
+
+def release_idempotency_key(store_id: int, key: str) -> None:
+    """Forget an unfinished key after a failure, so a retry runs again"""
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        cur.execute(
+            """
+            DELETE FROM idempotency_keys
+            WHERE store_id = %s AND key = %s AND response IS NULL
+            """,
+            (store_id, key),
+        )
+
+
+def purge_idempotency_keys() -> int:
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        cur.execute(
+            """
+            DELETE FROM idempotency_keys
+            WHERE created_at < NOW() - make_interval(secs => %s)
+            """,
+            (IDEMPOTENCY_KEY_TTL_HOURS * 3600,),
+        )
+        return cur.rowcount
+
+
+async def idempotency_purge_loop() -> None:
+    logger.info("Starting idempotency key purge job...")
+    while True:
+        try:
+            purged = await asyncio.to_thread(purge_idempotency_keys)
+            if purged:
+                logger.info(f"Purged {purged} idempotency key(s)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error purging idempotency keys: {e}")
+        await asyncio.sleep(IDEMPOTENCY_PURGE_INTERVAL)
+
+
+def start_idempotency_purge_job() -> asyncio.Task:
+    """Must be called from the running event loop (see leader_election)."""
+    return asyncio.create_task(idempotency_purge_loop())
@@ -3,6 +3,9 @@ from dotenv import load_dotenv  # type: ignore
 from os import getenv
 import bcrypt  # type: ignore
 
+# Tables whose writes bump their table_versions counter (see etags.py)
+TABLE_VERSIONED_TABLES = ("assosiated_parties", "payment_methods", "scopes", "store_data")
+
 
 def connect_to_database():
     """Connect to the PostgreSQL database and return connection and cursor"""
@@ -42,6 +45,10 @@ def drop_all_tables(cur):
     cur.execute("DROP TABLE IF EXISTS product_inventory CASCADE")
     cur.execute("DROP TABLE IF EXISTS bills CASCADE")
     cur.execute("DROP TABLE IF EXISTS cash_flow CASCADE")
+    cur.execute("DROP TABLE IF EXISTS cash_flow_checkpoints CASCADE")
+    cur.execute("DROP TABLE IF EXISTS idempotency_keys CASCADE")
+    cur.execute("DROP TABLE IF EXISTS table_versions CASCADE")
+    cur.execute("DROP SEQUENCE IF EXISTS table_versions_seq CASCADE")
     cur.execute("DROP TABLE IF EXISTS products_flow CASCADE")
     cur.execute("DROP TABLE IF EXISTS shifts CASCADE")
     cur.execute("DROP TABLE IF EXISTS assosiated_parties CASCADE")
@@ -55,7 +62,9 @@ def drop_all_tables(cur):
     cur.execute("DROP TABLE IF EXISTS product_batches CASCADE")
     cur.execute("DROP TABLE IF EXISTS payment_methods CASCADE")
     cur.execute("DROP TABLE IF EXISTS account_transactions CASCADE")
+    cur.execute("DROP TABLE IF EXISTS account_balances CASCADE")
     cur.execute("DROP TABLE IF EXISTS db_meta CASCADE")
+    cur.execute("DROP TABLE IF EXISTS slow_queries CASCADE")
     cur.execute("SET TIME ZONE 'Africa/Cairo'")
     cur.execute(f"ALTER DATABASE {DATABASE} SET timezone TO 'Africa/Cairo';")
 
@@ -170,7 +179,8 @@ def create_all_tables(cur):
       bar_code VARCHAR UNIQUE,
       wholesale_price FLOAT,
       price FLOAT,
-      category VARCHAR
+      category VARCHAR,
+      version BIGINT NOT NULL DEFAULT 0
     )
     """)
 
@@ -182,6 +192,7 @@ def create_all_tables(cur):
       product_id BIGINT,
       stock INT DEFAULT 0,
       is_deleted BOOLEAN DEFAULT FALSE,
+      version BIGINT NOT NULL DEFAULT 0,
       UNIQUE(store_id, product_id),
       FOREIGN KEY (product_id) REFERENCES products(id),
       FOREIGN KEY (store_id) REFERENCES store_data(id)
@@ -235,7 +246,7 @@ def create_all_tables(cur):
     )
     """)
     cur.execute("""
-    INSERT INTO db_meta (key, value) VALUES ('version', '23')
+    INSERT INTO db_meta (key, value) VALUES ('version', '38')
     """)
 
     # Create the payment_methods table (dynamic, user-managed payment methods)
@@ -352,7 +363,6 @@ def create_all_tables(cur):
       type VARCHAR,
       bill_id BIGINT,
       description VARCHAR,
-      total FLOAT,
       party_id BIGINT,
       payment_method_id BIGINT REFERENCES payment_methods(id),
       PRIMARY KEY (id, store_id),
@@ -360,6 +370,43 @@ def create_all_tables(cur):
     )
     """)
 
+    # Create the cash_flow_checkpoints table (closing cash total per store and
+    # day, for sealed days only; running totals are derived from it on read)
+    cur.execute("""
+    CREATE TABLE cash_flow_checkpoints (
+        store_id BIGINT REFERENCES store_data(id),
+        day DATE,
+        total FLOAT NOT NULL,
+        PRIMARY KEY (store_id, day)
+    )
+    """)
+
+    # Change counters of rarely written tables, for ETags (see etags.py)
+    cur.execute("""
+    CREATE SEQUENCE table_versions_seq;
+    CREATE TABLE table_versions (
+        table_name VARCHAR PRIMARY KEY,
+        version BIGINT NOT NULL
+    )
+    """)
+
+    # Create the idempotency_keys table (stored responses of retried writes,
+    # see idempotency.py)
+    cur.execute("""
+    CREATE TABLE idempotency_keys (
+        store_id BIGINT REFERENCES store_data(id),
+        key VARCHAR,
+        endpoint VARCHAR NOT NULL,
+        request_hash VARCHAR NOT NULL,
+        response JSONB,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (store_id, key)
+    )
+    """)
+    cur.execute("""
+    CREATE INDEX idx_idempotency_keys_created ON idempotency_keys (created_at)
+    """)
+
     # Create the account_transactions table (per-payment-method ledger,
     # a mirror of cash_flow; balance per account = SUM(amount))
     cur.execute("""
@@ -385,6 +432,18 @@ def create_all_tables(cur):
         ON account_transactions (store_id, cash_flow_id)
     """)
 
+    # Maintained balance per account, split into slots so concurrent sales
+    # do not queue on one row (see account_balances.py)
+    cur.execute("""
+    CREATE TABLE account_balances (
+        store_id BIGINT NOT NULL,
+        payment_method_id BIGINT NOT NULL REFERENCES payment_methods(id),
+        slot SMALLINT NOT NULL,
+        balance FLOAT NOT NULL DEFAULT 0,
+        PRIMARY KEY (store_id, payment_method_id, slot)
+    )
+    """)
+
     # Create Installments table
     cur.execute("""
     CREATE TABLE installments (
@@ -511,9 +570,26 @@ def create_all_tables(cur):
         CREATE INDEX idx_product_batches_store_expiration ON product_batches(store_id, expiration_date);
     """)
 
+    # Slow-query log, written by the API server when SLOW_QUERY_MS is set
+    cur.execute("""
+    CREATE TABLE slow_queries (
+        id BIGSERIAL PRIMARY KEY,
+        time TIMESTAMP NOT NULL DEFAULT NOW(),
+        duration_ms FLOAT NOT NULL,
+        endpoint VARCHAR,
+        statement TEXT NOT NULL,
+        params TEXT,
+        plan TEXT
+    )
+    """)
+    cur.execute("""
+        CREATE INDEX idx_slow_queries_duration ON slow_queries (duration_ms DESC);
+    """)
+
     # Performance indexes (kept in sync with update_db_21.py).
-    # Hot paths: running-total triggers on cash_flow / products_flow, the account
-    # ledger window, and the bills <-> lines / cash joins used everywhere.
+    # Hot paths: the cash_flow running total (derived on read), the
+    # products_flow trigger, the account ledger window, and the
+    # bills <-> lines / cash joins used everywhere.
     cur.execute("""
         CREATE INDEX idx_cash_flow_store_time ON cash_flow (store_id, time, id);
         CREATE INDEX idx_cash_flow_store_bill ON cash_flow (store_id, bill_id);
@@ -522,12 +598,473 @@ def create_all_tables(cur):
         CREATE INDEX idx_bills_party ON bills (party_id);
         CREATE INDEX idx_products_flow_store_bill ON products_flow (store_id, bill_id);
         CREATE INDEX idx_products_flow_store_product_time ON products_flow (store_id, product_id, time, id);
+        CREATE INDEX idx_products_flow_store_time ON products_flow (store_id, time, id);
+        -- FIFO start point: latest row where the product's stock was zero
+        CREATE INDEX idx_products_flow_zero_stock ON products_flow (store_id, product_id, time) WHERE total = 0;
         CREATE INDEX idx_account_transactions_ledger ON account_transactions (store_id, payment_method_id, time, id);
         CREATE INDEX idx_installments_flow_installment ON installments_flow (installment_id);
         CREATE INDEX idx_salaries_employee ON salaries (employee_id);
+        -- GET /products/changes
+        CREATE INDEX idx_products_version ON products (version);
+        CREATE INDEX idx_product_inventory_version ON product_inventory (store_id, version);
+        CREATE INDEX idx_reserved_products_product ON reserved_products (store_id, product_id);
+        -- GET /admin/products/matrix pages
+        CREATE INDEX idx_products_name ON products (name, id);
+        -- GET /parties/bills pages
+        CREATE INDEX idx_bills_collections_bill ON bills_collections (store_id, bill_id);
+        CREATE INDEX idx_bills_collections_collection ON bills_collections (collection_id);
+    """)
+
+
+def create_products_flow_triggers(cur):
+    """
+    Triggers keeping product_inventory.stock, products_flow.total and buy
+    prices in sync with inserted products_flow rows. Each row gets its running
+    total as it is written; all lines of a bill are then handled in one
+    statement-level pass, which rewrites a total only when it is off.
+    """
+    cur.execute("""
+    -- The running total as the row is written: the latest earlier row of the
+    -- product (rows of this statement already written included) plus its
+    -- amount. In the usual case (no concurrent bill on the product, lines in
+    -- (time, id) order) it is final, and products_flow_after_insert does not
+    -- rewrite the row.
+    CREATE OR REPLACE FUNCTION products_flow_before_insert()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.total := COALESCE(NEW.amount, 0) + COALESCE((
+            SELECT p.total
+            FROM products_flow p
+            WHERE p.store_id = NEW.store_id
+            AND p.product_id = NEW.product_id
+            AND (p.time < NEW.time OR (p.time = NEW.time AND p.id < NEW.id))
+            ORDER BY p.time DESC, p.id DESC
+            LIMIT 1
+        ), 0);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trigger_products_flow_before_insert
+    BEFORE INSERT ON products_flow
+    FOR EACH ROW
+    EXECUTE FUNCTION products_flow_before_insert();
+
+    CREATE OR REPLACE FUNCTION products_flow_after_insert()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        fresh RECORD;
+        expected INTEGER;
+        has_buy BOOLEAN := FALSE;
+    BEGIN
+        -- Stock first. The upsert locks the touched inventory rows in a fixed
+        -- order, so concurrent bills on the same products queue here instead
+        -- of deadlocking, and the statements below (new snapshot) see the
+        -- rows those bills committed.
+        INSERT INTO product_inventory (store_id, product_id, stock)
+        SELECT store_id, product_id, SUM(amount)
+        FROM new_products_flow
+        GROUP BY store_id, product_id
+        ORDER BY store_id, product_id
+        ON CONFLICT (store_id, product_id)
+        DO UPDATE SET stock = product_inventory.stock + EXCLUDED.stock;
+
+        -- Running totals, each new row in (time, id) order per product
+        FOR fresh IN
+            SELECT
+                n.id,
+                n.store_id,
+                n.product_id,
+                n.time,
+                n.amount,
+                n.total,
+                b.type = 'buy' AS buy,
+                ROW_NUMBER() OVER (
+                    PARTITION BY n.store_id, n.product_id
+                    ORDER BY n.time, n.id
+                ) = 1 AS first_of_product
+            FROM new_products_flow n
+            LEFT JOIN bills b ON b.id = n.bill_id AND b.store_id = n.store_id
+            ORDER BY n.store_id, n.product_id, n.time, n.id
+        LOOP
+            has_buy := has_buy OR COALESCE(fresh.buy, FALSE);
+
+            -- Backdated lines (a bill time earlier than rows already in the
+            -- ledger) shift the totals of the product's later rows, so every
+            -- stored total stays exact. The EXISTS probe is one index range
+            -- scan per product, and in-order bills stop there.
+            IF fresh.first_of_product AND EXISTS (
+                SELECT 1
+                FROM products_flow p
+                WHERE p.store_id = fresh.store_id
+                AND p.product_id = fresh.product_id
+                AND p.time >= fresh.time
+                AND (p.time > fresh.time OR p.id > fresh.id)
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM new_products_flow n
+                    WHERE n.id = p.id
+                    AND n.store_id = p.store_id
+                )
+            ) THEN
+                UPDATE products_flow p
+                SET total = p.total + COALESCE((
+                    SELECT SUM(COALESCE(n.amount, 0))
+                    FROM new_products_flow n
+                    WHERE n.store_id = p.store_id
+                    AND n.product_id = p.product_id
+                    AND (n.time < p.time OR (n.time = p.time AND n.id < p.id))
+                ), 0)
+                WHERE p.store_id = fresh.store_id
+                AND p.product_id = fresh.product_id
+                AND p.time >= fresh.time
+                AND (p.time > fresh.time OR p.id > fresh.id)
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM new_products_flow n
+                    WHERE n.id = p.id
+                    AND n.store_id = p.store_id
+                );
+            END IF;
+
+            -- The rows before this one are exact now (older rows shifted,
+            -- earlier new rows checked), so its total is the latest earlier
+            -- row's plus its amount. It is only rewritten when the total
+            -- products_flow_before_insert gave it is off: a concurrent bill
+            -- committed an earlier row before the lock above, or a later line
+            -- of this statement has an earlier time.
+            expected := COALESCE(fresh.amount, 0) + COALESCE((
+                SELECT p.total
+                FROM products_flow p
+                WHERE p.store_id = fresh.store_id
+                AND p.product_id = fresh.product_id
+                AND (p.time < fresh.time OR (p.time = fresh.time AND p.id < fresh.id))
+                ORDER BY p.time DESC, p.id DESC
+                LIMIT 1
+            ), 0);
+            IF expected IS DISTINCT FROM fresh.total THEN
+                UPDATE products_flow
+                SET total = expected
+                WHERE id = fresh.id
+                AND store_id = fresh.store_id;
+            END IF;
+        END LOOP;
+
+        -- Buy bills set the product prices (last line per product wins).
+        -- NO KEY UPDATE, the lock the UPDATE takes itself, so foreign key
+        -- checks of concurrent bills on these products do not wait.
+        IF has_buy THEN
+            PERFORM 1
+            FROM products
+            WHERE id IN (
+                SELECT n.product_id
+                FROM new_products_flow n
+                JOIN bills b ON b.id = n.bill_id AND b.store_id = n.store_id
+                WHERE b.type = 'buy'
+            )
+            ORDER BY id
+            FOR NO KEY UPDATE;
+
+            UPDATE products p
+            SET
+                wholesale_price = l.wholesale_price,
+                price = l.price
+            FROM (
+                SELECT DISTINCT ON (n.product_id) n.product_id, n.wholesale_price, n.price
+                FROM new_products_flow n
+                JOIN bills b ON b.id = n.bill_id AND b.store_id = n.store_id
+                WHERE b.type = 'buy'
+                ORDER BY n.product_id, n.id DESC
+            ) l
+            WHERE p.id = l.product_id;
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trigger_products_flow_after_insert
+    AFTER INSERT ON products_flow
+    REFERENCING NEW TABLE AS new_products_flow
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION products_flow_after_insert();
+    """)
+
+
+def create_cash_flow_checkpoint_functions(cur):
+    """
+    Daily cash_flow checkpoints: the sealer, the read helper and the trigger
+    that moves sealed checkpoints when a backdated row changes.
+    """
+    cur.execute("""
+    -- Seal every day up to two days ago that has movement and no checkpoint
+    -- yet. Today and yesterday stay open, so the insert path never writes a
+    -- checkpoint. Returns the number of days sealed.
+    CREATE OR REPLACE FUNCTION seal_cash_flow_checkpoints(p_store_id BIGINT)
+    RETURNS INTEGER AS $$
+    DECLARE
+        last_day DATE;
+        last_total FLOAT;
+        sealed INTEGER;
+    BEGIN
+        -- Waits for backdated writers of this store (they hold the lock
+        -- shared), so no committed row is missed or counted twice
+        PERFORM pg_advisory_xact_lock(hashtext('cash_flow_checkpoints'), p_store_id::INT);
+
+        SELECT day, total INTO last_day, last_total
+        FROM cash_flow_checkpoints
+        WHERE store_id = p_store_id
+        ORDER BY day DESC
+        LIMIT 1;
+
+        INSERT INTO cash_flow_checkpoints (store_id, day, total)
+        SELECT
+            p_store_id,
+            d.day,
+            COALESCE(last_total, 0) + SUM(d.amount) OVER (ORDER BY d.day)
+        FROM (
+            SELECT time::DATE AS day, SUM(COALESCE(amount, 0)) AS amount
+            FROM cash_flow
+            WHERE store_id = p_store_id
+            AND time >= COALESCE((last_day + 1)::TIMESTAMP, '-infinity')
+            AND time < (CURRENT_DATE - 1)::TIMESTAMP
+            GROUP BY 1
+        ) d;
+
+        GET DIAGNOSTICS sealed = ROW_COUNT;
+        RETURN sealed;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- Store cash total of everything before p_time: the latest checkpoint
+    -- before that day plus the rows after it
+    CREATE OR REPLACE FUNCTION cash_flow_total_before(p_store_id BIGINT, p_time TIMESTAMP)
+    RETURNS FLOAT AS $$
+    DECLARE
+        checkpoint_day DATE;
+        checkpoint_total FLOAT;
+        rest FLOAT;
+    BEGIN
+        SELECT day, total INTO checkpoint_day, checkpoint_total
+        FROM cash_flow_checkpoints
+        WHERE store_id = p_store_id
+        AND day < p_time::DATE
+        ORDER BY day DESC
+        LIMIT 1;
+
+        SELECT SUM(amount) INTO rest
+        FROM cash_flow
+        WHERE store_id = p_store_id
+        AND time >= COALESCE((checkpoint_day + 1)::TIMESTAMP, '-infinity')
+        AND time < p_time;
+
+        RETURN COALESCE(checkpoint_total, 0) + COALESCE(rest, 0);
+    END;
+    $$ LANGUAGE plpgsql STABLE;
+
+    -- A backdated insert, edit or delete moves the checkpoints from its day
+    -- on by the difference: O(checkpoints), not O(rows). Rows dated today
+    -- skip all of this.
+    CREATE OR REPLACE FUNCTION cash_flow_checkpoints_after_change()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' AND OLD.time < CURRENT_DATE THEN
+            PERFORM pg_advisory_xact_lock_shared(hashtext('cash_flow_checkpoints'), OLD.store_id::INT);
+            UPDATE cash_flow_checkpoints
+            SET total = total - COALESCE(OLD.amount, 0)
+            WHERE store_id = OLD.store_id
+            AND day >= OLD.time::DATE;
+        END IF;
+
+        IF TG_OP <> 'DELETE' AND NEW.time < CURRENT_DATE THEN
+            PERFORM pg_advisory_xact_lock_shared(hashtext('cash_flow_checkpoints'), NEW.store_id::INT);
+            UPDATE cash_flow_checkpoints
+            SET total = total + COALESCE(NEW.amount, 0)
+            WHERE store_id = NEW.store_id
+            AND day >= NEW.time::DATE;
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trigger_cash_flow_checkpoints_insert_delete
+    AFTER INSERT OR DELETE ON cash_flow
+    FOR EACH ROW
+    EXECUTE FUNCTION cash_flow_checkpoints_after_change();
+
+    CREATE TRIGGER trigger_cash_flow_checkpoints_update
+    AFTER UPDATE ON cash_flow
+    FOR EACH ROW
+    WHEN (
+        NEW.amount IS DISTINCT FROM OLD.amount
+        OR NEW.time IS DISTINCT FROM OLD.time
+    )
+    EXECUTE FUNCTION cash_flow_checkpoints_after_change();
+    """)
+
+
+def create_account_balance_functions(cur):
+    """
+    Keep account_balances in step with account_transactions, whoever writes
+    the ledger (the cash_flow mirror, transfers, cascaded deletes).
+    """
+    cur.execute("""
+    -- Adds an amount to the first slot of the account that no other open
+    -- transaction holds (slot advisory lock), so writers never wait on each
+    -- other's balance rows. Rebuilds take the store lock exclusively, writers
+    -- take it shared.
+    CREATE OR REPLACE FUNCTION add_to_account_balance(
+        p_store_id BIGINT, p_method_id BIGINT, p_amount FLOAT
+    )
+    RETURNS VOID AS $$
+    DECLARE
+        s INTEGER := 0;
+    BEGIN
+        PERFORM pg_advisory_xact_lock_shared(hashtext('account_balances'), p_store_id::INT);
+
+        WHILE NOT pg_try_advisory_xact_lock(
+            hashtext('account_balance_slots'),
+            hashtext(p_store_id || '/' || p_method_id || '/' || s)
+        ) LOOP
+            s := s + 1;
+        END LOOP;
+
+        INSERT INTO account_balances (store_id, payment_method_id, slot, balance)
+        VALUES (p_store_id, p_method_id, s, p_amount)
+        ON CONFLICT (store_id, payment_method_id, slot)
+        DO UPDATE SET balance = account_balances.balance + EXCLUDED.balance;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- One balance update per account touched by the statement
+    CREATE OR REPLACE FUNCTION account_balances_after_change()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM add_to_account_balance(store_id, payment_method_id, SUM(amount))
+            FROM new_rows
+            GROUP BY store_id, payment_method_id;
+        END IF;
+
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM add_to_account_balance(store_id, payment_method_id, -SUM(amount))
+            FROM old_rows
+            GROUP BY store_id, payment_method_id;
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trigger_account_balances_insert
+    AFTER INSERT ON account_transactions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION account_balances_after_change();
+
+    CREATE TRIGGER trigger_account_balances_delete
+    AFTER DELETE ON account_transactions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION account_balances_after_change();
+
+    CREATE TRIGGER trigger_account_balances_update
+    AFTER UPDATE ON account_transactions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION account_balances_after_change();
     """)
 
 
+def create_catalog_version_triggers(cur):
+    """
+    Catalog versions for GET /products/changes: every write to a product or
+    to its store inventory stamps the row with the writer's transaction id,
+    and a reservation made or released stamps the inventory row it affects.
+    """
+    cur.execute("""
+    CREATE OR REPLACE FUNCTION stamp_catalog_version()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.version := pg_current_xact_id()::TEXT::BIGINT;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trigger_products_version_insert
+    BEFORE INSERT ON products
+    FOR EACH ROW
+    EXECUTE FUNCTION stamp_catalog_version();
+
+    CREATE TRIGGER trigger_products_version_update
+    BEFORE UPDATE ON products
+    FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE FUNCTION stamp_catalog_version();
+
+    CREATE TRIGGER trigger_product_inventory_version_insert
+    BEFORE INSERT ON product_inventory
+    FOR EACH ROW
+    EXECUTE FUNCTION stamp_catalog_version();
+
+    CREATE TRIGGER trigger_product_inventory_version_update
+    BEFORE UPDATE ON product_inventory
+    FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE FUNCTION stamp_catalog_version();
+
+    -- reserved_products references product_inventory by foreign key, so the
+    -- inventory row of a reservation is always there to stamp
+    CREATE OR REPLACE FUNCTION stamp_reserved_product_version()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            UPDATE product_inventory
+            SET version = pg_current_xact_id()::TEXT::BIGINT
+            WHERE store_id = OLD.store_id AND product_id = OLD.product_id;
+        END IF;
+
+        IF TG_OP <> 'DELETE' THEN
+            UPDATE product_inventory
+            SET version = pg_current_xact_id()::TEXT::BIGINT
+            WHERE store_id = NEW.store_id AND product_id = NEW.product_id;
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trigger_reserved_products_version
+    AFTER INSERT OR UPDATE OR DELETE ON reserved_products
+    FOR EACH ROW
+    EXECUTE FUNCTION stamp_reserved_product_version();
+    """)
+
+
+def create_table_version_triggers(cur):
+    """Bump the table_versions counter of a tracked table on every write"""
+    cur.execute("""
+    CREATE OR REPLACE FUNCTION bump_table_version()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        INSERT INTO table_versions (table_name, version)
+        VALUES (TG_TABLE_NAME, nextval('table_versions_seq'))
+        ON CONFLICT (table_name)
+        DO UPDATE SET version = EXCLUDED.version;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    for table in TABLE_VERSIONED_TABLES:
+        cur.execute(f"""
+        CREATE TRIGGER trigger_{table}_table_version
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION bump_table_version();
+        """)
+
+
 def create_all_triggers(cur):
     """Create all database triggers"""
     print("Creating database triggers...")
@@ -553,25 +1090,8 @@ def create_all_triggers(cur):
     EXECUTE FUNCTION add_product_to_all_stores();
     """)
 
-    # Update the trigger to update stock after inserting a product flow
-    cur.execute("""
-    -- Trigger to update stock after insert in product_inventory
-    CREATE OR REPLACE FUNCTION update_stock_after_insert()
-    RETURNS TRIGGER AS $$
-    BEGIN
-        INSERT INTO product_inventory (store_id, product_id, stock)
-        VALUES (NEW.store_id, NEW.product_id, NEW.amount)
-        ON CONFLICT (store_id, product_id)
-        DO UPDATE SET stock = product_inventory.stock + NEW.amount;
-        RETURN NEW;
-    END;
-    $$ LANGUAGE plpgsql;
-
-    CREATE TRIGGER trigger_update_stock_insert
-    AFTER INSERT ON products_flow
-    FOR EACH ROW
-    EXECUTE FUNCTION update_stock_after_insert();
-    """)
+    # Stock, running totals and buy prices after inserting products_flow rows
+    create_products_flow_triggers(cur)
 
     # Create the trigger to insert into cash_flow after inserting a bill
     cur.execute("""
@@ -703,6 +1223,43 @@ def create_all_triggers(cur):
     EXECUTE FUNCTION sync_store_to_associated_party();
     """)
 
+    # Tell every API worker to drop its cached copy of a store's data/settings
+    cur.execute("""
+    CREATE OR REPLACE FUNCTION notify_store_data_change()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        PERFORM pg_notify('store_data_changed', COALESCE(NEW.id, OLD.id)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trigger_notify_store_data_change
+    AFTER INSERT OR UPDATE OR DELETE ON store_data
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_store_data_change();
+    """)
+
+    # Tell every API worker to drop its cached copy of a logged-in user
+    cur.execute("""
+    CREATE OR REPLACE FUNCTION notify_users_change()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM pg_notify('users_changed', COALESCE(OLD.username, ''));
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM pg_notify('users_changed', COALESCE(NEW.username, ''));
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trigger_notify_users_change
+    AFTER INSERT OR UPDATE OR DELETE ON users
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_users_change();
+    """)
+
     # Create the trigger to insert into cash_flow after inserting a salary
     cur.execute("""
     -- Trigger to insert into cash_flow after inserting a salary
@@ -814,135 +1371,6 @@ def create_all_triggers(cur):
     EXECUTE FUNCTION insert_cash_flow_after_insert_installment_flow();
     """)
 
-    # Update the trigger to update product price when inserting a buy bill
-    cur.execute("""
-    -- Trigger to update product price when inserting a buy bill
-    CREATE OR REPLACE FUNCTION update_product_price_after_insert()
-    RETURNS TRIGGER AS $$
-    BEGIN
-      IF (SELECT type FROM bills WHERE id = NEW.bill_id AND store_id = new.store_id LIMIT 1) = 'buy' THEN 
-        UPDATE products
-        SET
-          wholesale_price = NEW.wholesale_price,
-          price = NEW.price
-        WHERE id = NEW.product_id;
-      END IF;
-      RETURN NEW;
-    END;
-    $$ LANGUAGE plpgsql;
-
-    CREATE TRIGGER trigger_update_product_price_after_insert
-    AFTER INSERT ON products_flow
-    FOR EACH ROW
-    EXECUTE FUNCTION update_product_price_after_insert();
-    """)
-
-    # Create the trigger to update total after inserting a cash_flow
-    cur.execute("""
-    -- Trigger to update total after insert
-    CREATE OR REPLACE FUNCTION update_total_after_insert()
-    RETURNS TRIGGER AS $$
-    DECLARE
-        latest_total NUMERIC;
-        latest_record RECORD;
-    BEGIN
-        -- Lock the latest cash_flow record for this store to prevent race conditions
-        SELECT id, total INTO latest_record
-        FROM cash_flow
-        WHERE store_id = NEW.store_id
-        AND (time < NEW.time OR (time = NEW.time AND id < NEW.id))
-        ORDER BY time DESC, id DESC
-        LIMIT 1
-        FOR UPDATE;
-
-        -- If no previous record exists, start from 0
-        IF latest_record.total IS NULL THEN
-            latest_total := 0;
-        ELSE
-            latest_total := latest_record.total;
-        END IF;
-
-        -- Update the total for the current row
-        UPDATE cash_flow
-        SET total = COALESCE(NEW.amount, 0) + latest_total
-        WHERE id = NEW.id
-        AND store_id = NEW.store_id;
-
-        RETURN NEW;
-    END;
-    $$ LANGUAGE plpgsql;
-
-    CREATE TRIGGER trigger_update_total_after_insert
-    AFTER INSERT ON cash_flow
-    FOR EACH ROW
-    EXECUTE FUNCTION update_total_after_insert();
-    """)
-
-    # Create the trigger to bubble fix the total after updating a cash_flow
-    cur.execute("""
-    -- Trigger to bubble fix the total after update
-    CREATE OR REPLACE FUNCTION bubble_fix_total_after_update()
-    RETURNS TRIGGER AS $$
-    DECLARE
-        previous_total NUMERIC;
-        current_total NUMERIC;
-        rec RECORD;
-    BEGIN
-        -- Only process if amount actually changed
-        IF NEW.amount = OLD.amount THEN
-            RETURN NEW;
-        END IF;
-
-        -- First, fix the total of the current row
-        -- Get the previous row's total
-        SELECT total INTO previous_total
-        FROM cash_flow
-        WHERE store_id = NEW.store_id
-        AND (time < NEW.time OR (time = NEW.time AND id < NEW.id))
-        ORDER BY time DESC, id DESC
-        LIMIT 1;
-        
-        IF previous_total IS NULL THEN
-            previous_total := 0;
-        END IF;
-        
-        -- Update the current row's total
-        UPDATE cash_flow
-        SET total = NEW.amount + previous_total
-        WHERE id = NEW.id
-        AND store_id = NEW.store_id;
-        
-        -- Get the updated total
-        current_total := NEW.amount + previous_total;
-
-        -- Now update all subsequent records
-        FOR rec IN 
-            SELECT id, amount
-            FROM cash_flow
-            WHERE store_id = NEW.store_id
-            AND (time > NEW.time OR (time = NEW.time AND id > NEW.id))
-            ORDER BY time ASC, id ASC
-            FOR UPDATE
-        LOOP
-            current_total := current_total + rec.amount;
-            
-            UPDATE cash_flow
-            SET total = current_total
-            WHERE id = rec.id
-            AND store_id = NEW.store_id;
-        END LOOP;
-
-        RETURN NEW;
-    END;
-    $$ LANGUAGE plpgsql;
-
-    CREATE TRIGGER trigger_bubble_fix_total_after_update
-    AFTER UPDATE ON cash_flow
-    FOR EACH ROW
-    WHEN (NEW.amount != OLD.amount)
-    EXECUTE FUNCTION bubble_fix_total_after_update();
-    """)
-
     # Create the trigger to update cash_flow after updating a bill
     cur.execute("""
     -- Trigger to update cash_flow after update
@@ -951,7 +1379,7 @@ def create_all_triggers(cur):
     BEGIN
         -- Only update if total actually changed
         IF NEW.total != OLD.total THEN
-            -- Just update the amount - let the cash_flow update trigger handle the bubble fix
+            -- Just update the amount - running totals are derived on read
             UPDATE cash_flow
             SET amount = NEW.total
             WHERE bill_id = NEW.id
@@ -985,57 +1413,6 @@ def create_all_triggers(cur):
     EXECUTE FUNCTION add_negative_one_bill();
     """)
 
-    # Trigger to bubble fix the total after delete
-    cur.execute("""
-    -- Trigger to bubble fix the total after delete
-    CREATE OR REPLACE FUNCTION bubble_fix_total_after_delete()
-    RETURNS TRIGGER AS $$
-    DECLARE
-        previous_total NUMERIC;
-        current_total NUMERIC;
-        rec RECORD;
-    BEGIN
-        -- Get the total from the record before the deleted one
-        SELECT total INTO previous_total
-        FROM cash_flow
-        WHERE store_id = OLD.store_id
-        AND (time < OLD.time OR (time = OLD.time AND id < OLD.id))
-        ORDER BY time DESC, id DESC
-        LIMIT 1;
-
-        IF previous_total IS NULL THEN
-            previous_total := 0;
-        END IF;
-
-        current_total := previous_total;
-
-        -- Update all subsequent records to fix their totals
-        FOR rec IN
-            SELECT id, amount
-            FROM cash_flow
-            WHERE store_id = OLD.store_id
-            AND (time > OLD.time OR (time = OLD.time AND id > OLD.id))
-            ORDER BY time ASC, id ASC
-            FOR UPDATE
-        LOOP
-            current_total := current_total + rec.amount;
-
-            UPDATE cash_flow
-            SET total = current_total
-            WHERE id = rec.id
-            AND store_id = OLD.store_id;
-        END LOOP;
-
-        RETURN OLD;
-    END;
-    $$ LANGUAGE plpgsql;
-
-    CREATE TRIGGER trigger_bubble_fix_total_after_delete
-    AFTER DELETE ON cash_flow
-    FOR EACH ROW
-    EXECUTE FUNCTION bubble_fix_total_after_delete();
-    """)
-
     # Create the trigger to delete cash_flow after deleting installment flow
     cur.execute("""
     -- Trigger to delete cash_flow after deleting installment flow
@@ -1111,48 +1488,6 @@ def create_all_triggers(cur):
     EXECUTE FUNCTION delete_cash_flow_after_delete_installment();
     """)
 
-    # Create the trigger to update total after inserting a products_flow
-    cur.execute("""
-    -- Trigger to update total after insert in products_flow
-    CREATE OR REPLACE FUNCTION update_products_flow_total_after_insert()
-    RETURNS TRIGGER AS $$
-    DECLARE
-        latest_total INTEGER;
-        latest_record RECORD;
-    BEGIN
-        -- Lock the latest products_flow record for this store and product to prevent race conditions
-        SELECT id, total INTO latest_record
-        FROM products_flow
-        WHERE store_id = NEW.store_id
-        AND product_id = NEW.product_id
-        AND (time < NEW.time OR (time = NEW.time AND id < NEW.id))
-        ORDER BY time DESC, id DESC
-        LIMIT 1
-        FOR UPDATE;
-
-        -- If no previous record exists, start from 0
-        IF latest_record.total IS NULL THEN
-            latest_total := 0;
-        ELSE
-            latest_total := latest_record.total;
-        END IF;
-
-        -- Update the total for the current row
-        UPDATE products_flow
-        SET total = COALESCE(NEW.amount, 0) + latest_total
-        WHERE id = NEW.id
-        AND store_id = NEW.store_id;
-
-        RETURN NEW;
-    END;
-    $$ LANGUAGE plpgsql;
-
-    CREATE TRIGGER trigger_update_products_flow_total_after_insert
-    AFTER INSERT ON products_flow
-    FOR EACH ROW
-    EXECUTE FUNCTION update_products_flow_total_after_insert();
-    """)
-
     # Create trigger to update notifications updated_at timestamp
     cur.execute("""
     -- Trigger to update updated_at timestamp on notifications
@@ -1170,6 +1505,11 @@ def create_all_triggers(cur):
     EXECUTE FUNCTION update_notification_timestamp();
     """)
 
+    create_catalog_version_triggers(cur)
+    create_table_version_triggers(cur)
+
+    create_cash_flow_checkpoint_functions(cur)
+
     # Mirror every cash_flow movement into per-account ledger rows so each
     # payment method has a balance and SUM(accounts) == store cash total.
     cur.execute("""
@@ -1251,6 +1591,8 @@ def create_all_triggers(cur):
     EXECUTE FUNCTION mirror_cash_flow_to_accounts();
     """)
 
+    create_account_balance_functions(cur)
+
 
 def main():
     """Main function to initialize the database"""
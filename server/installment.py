@@ -1,7 +1,7 @@
 from fastapi import HTTPException, Depends
 from fastapi.responses import JSONResponse
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from database import Database
 import logging
 from dotenv import load_dotenv
 from os import getenv
@@ -24,35 +24,6 @@ ALGORITHM = getenv("ALGORITHM") or ""
 router = APIRouter()
 
 
-class Database:
-    "Database context manager to handle the connection and cursor"
-
-    def __init__(self, host, database, user, password, real_dict_cursor=True):
-        self.host = host
-        self.database = database
-        self.user = user
-        self.password = password
-        self.real_dict_cursor = real_dict_cursor
-
-    def __enter__(self):
-        self.conn = psycopg2.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password,
-        )
-        return self.conn.cursor(
-            cursor_factory=RealDictCursor if self.real_dict_cursor else None
-        )
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is not None:
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-        self.conn.close()
-
-
 @router.get("/installments")
 def get_installments(
     store_id: int,
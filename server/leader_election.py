@@ -0,0 +1,210 @@
+"""
+Leader election for background jobs, so the API can run with several uvicorn
+workers.
+
+Every worker process competes for one session-level Postgres advisory lock
+(pg_try_advisory_lock) on a dedicated connection. The process holding it is
+the leader and runs the background jobs (expiration schedulers, Telegram
+command worker); the others only serve requests. Postgres releases a session
+lock when its connection ends, so if the leader process dies or loses its
+database connection, another worker takes over on its next attempt, every
+LEADER_ELECTION_INTERVAL seconds (default 5). A leader that can no longer
+reach its connection stops its jobs before anyone else can be elected.
+
+BACKGROUND_JOBS selects the mode:
+
+- elect (default): take part in the election
+- always: run the jobs without an election (single process, previous behaviour)
+- never: never run the jobs in this process
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime
+from os import getenv
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2
+from dotenv import load_dotenv
+
+from database import Database
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+BACKGROUND_JOBS = (getenv("BACKGROUND_JOBS") or "elect").lower()
+LEADER_ELECTION_INTERVAL = float(getenv("LEADER_ELECTION_INTERVAL") or 5)
+# Arbitrary, but must not collide with other advisory locks on the database
+LEADER_LOCK_KEY = int(getenv("LEADER_LOCK_KEY") or 741_852_001)
+
+logger = logging.getLogger(__name__)
+
+_conn = None
+_election_task: Optional[asyncio.Task] = None
+_jobs: List[asyncio.Task] = []
+_is_leader = False
+_leader_since: Optional[datetime] = None
+_last_error: Optional[str] = None
+
+
+def _application_name() -> str:
+    return f"store-leader:{socket.gethostname()}:{os.getpid()}"[:63]
+
+
+def _connect():
+    # The lock lives as long as this session, so it deliberately bypasses the
+    # shared pool. Keepalives make a vanished peer show up within ~30s.
+    conn = psycopg2.connect(
+        host=HOST,
+        database=DATABASE,
+        user=USER,
+        password=PASS,
+        application_name=_application_name(),
+        keepalives=1,
+        keepalives_idle=10,
+        keepalives_interval=5,
+        keepalives_count=3,
+    )
+    conn.autocommit = True
+    return conn
+
+
+def _try_acquire(conn) -> bool:
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (LEADER_LOCK_KEY,))
+        return bool(cur.fetchone()[0])
+
+
+def _ping(conn) -> None:
+    """Raises if the session (and with it the lock) is gone."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+
+
+def _close_connection() -> None:
+    global _conn
+
+    if _conn is not None:
+        try:
+            _conn.close()
+        except Exception:
+            pass
+    _conn = None
+
+
+def _become_leader(start_jobs: Callable[[], List[asyncio.Task]]) -> None:
+    global _is_leader, _leader_since, _jobs
+
+    _is_leader = True
+    _leader_since = datetime.now()
+    logger.info(f"Elected leader ({_application_name()}), starting background jobs")
+    _jobs = start_jobs()
+
+
+async def _step_down() -> None:
+    global _is_leader, _leader_since, _jobs
+
+    if not _is_leader:
+        return
+    logger.info("Leadership lost, stopping background jobs")
+    jobs, _jobs = _jobs, []
+    for job in jobs:
+        job.cancel()
+    await asyncio.gather(*jobs, return_exceptions=True)
+    _is_leader = False
+    _leader_since = None
+
+
+async def _election_loop(start_jobs: Callable[[], List[asyncio.Task]]) -> None:
+    global _conn, _last_error
+
+    while True:
+        try:
+            if _conn is None or _conn.closed:
+                _conn = await asyncio.to_thread(_connect)
+            if _is_leader:
+                await asyncio.to_thread(_ping, _conn)
+            elif await asyncio.to_thread(_try_acquire, _conn):
+                _become_leader(start_jobs)
+            _last_error = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _last_error = str(e)
+            logger.error(f"Leader election error: {e}")
+            await _step_down()
+            _close_connection()
+        await asyncio.sleep(LEADER_ELECTION_INTERVAL)
+
+
+def start_leader_election(start_jobs: Callable[[], List[asyncio.Task]]) -> None:
+    """
+    Run `start_jobs` (which returns the asyncio tasks it created) only in the
+    elected process. Must be called from the running event loop, i.e. the
+    FastAPI startup event.
+    """
+    global _election_task
+
+    if BACKGROUND_JOBS == "never":
+        logger.info("BACKGROUND_JOBS=never, background jobs disabled in this worker")
+        return
+    if BACKGROUND_JOBS == "always":
+        _become_leader(start_jobs)
+        return
+    if _election_task is None or _election_task.done():
+        _election_task = asyncio.create_task(_election_loop(start_jobs))
+
+
+async def stop_leader_election() -> None:
+    """Stop the jobs and release leadership so another worker takes over."""
+    global _election_task
+
+    if _election_task is not None:
+        _election_task.cancel()
+        await asyncio.gather(_election_task, return_exceptions=True)
+        _election_task = None
+    await _step_down()
+    # Closing the session releases the advisory lock
+    _close_connection()
+
+
+def current_leader() -> Optional[Dict[str, Any]]:
+    """The backend currently holding the leader lock, from any worker's view."""
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        cur.execute(
+            """
+            SELECT a.application_name, a.client_addr::text AS client_addr,
+                   a.backend_start
+            FROM pg_locks l
+            JOIN pg_stat_activity a ON a.pid = l.pid
+            WHERE l.locktype = 'advisory'
+              AND l.granted
+              AND l.database = (SELECT oid FROM pg_database WHERE datname = current_database())
+              AND ((l.classid::bigint << 32) | l.objid::bigint) = %s
+            LIMIT 1
+            """,
+            (LEADER_LOCK_KEY,),
+        )
+        row = cur.fetchone()
+
+    if not row:
+        return None
+    row["backend_start"] = row["backend_start"].isoformat() if row["backend_start"] else None
+    return row
+
+
+def leader_status() -> Dict[str, Any]:
+    return {
+        "mode": BACKGROUND_JOBS,
+        "process": _application_name(),
+        "is_leader": _is_leader,
+        "leader_since": _leader_since.isoformat() if _leader_since else None,
+        "running_jobs": sum(1 for job in _jobs if not job.done()),
+        "last_error": _last_error,
+    }
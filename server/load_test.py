@@ -0,0 +1,553 @@
+"""
+HTTP load test for the POS write path.
+
+Simulates many concurrent cashiers hitting a running API server. Each cashier
+is a thread with its own HTTP session, and it loops over a weighted mix of:
+
+- POST /bill (sell, return, installment and reserve bills)
+- PUT /bill (editing one of the bills created earlier in the run)
+- POST /admin/move-products (between the tested stores)
+- POST /cash-flow (manual cash movements)
+
+At the end it reports throughput, latency percentiles per operation, errors,
+deadlocks and lock waits. Deadlocks and lock waits are taken from Postgres:
+the pg_stat_database.deadlocks delta plus a sampler that polls pg_stat_activity
+for backends waiting on locks. The sampler uses the HOST / DATABASE / USER /
+PASS from .env; pass --no-db-stats to skip it.
+
+Run it against a throwaway database, for example one filled by
+generate_dataset.py, since every run writes real bills:
+
+    uvicorn main:app --workers 4 &
+    python load_test.py --stores 1,2 --cashiers 32 --duration 60
+    python load_test.py --mix "sell=100" --hot-products 5 --json before.json
+
+--json writes the full report, so runs before and after a change can be
+compared.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from os import getenv
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import psycopg2
+from dotenv import load_dotenv  # type: ignore
+
+load_dotenv()
+
+OPERATIONS = ("sell", "return", "installment", "reserve", "edit", "move", "cash")
+DEFAULT_MIX = "sell=70,return=5,installment=5,reserve=5,edit=8,move=2,cash=5"
+# Bills created during the run that PUT /bill may edit, per store
+EDITABLE_BILLS_PER_STORE = 200
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parse "sell=70,edit=10,..." into operation weights."""
+    weights: Dict[str, float] = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(
+                f"unknown operation {name!r} (expected one of {', '.join(OPERATIONS)})"
+            )
+        weights[name] = float(value)
+    if sum(weights.values()) <= 0:
+        raise argparse.ArgumentTypeError("operation weights must add up to > 0")
+    return weights
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Results:
+    """Thread-safe latency / outcome collector, per operation."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.error_samples: Dict[str, str] = {}
+        self.deadlock_errors = 0
+        self.lock_errors = 0
+        self.recording = False
+
+    def record(self, operation: str, seconds: float, error: Optional[str]) -> None:
+        if not self.recording:
+            return
+        with self.lock:
+            if error is None:
+                self.latencies[operation].append(seconds)
+                return
+            self.errors[operation] += 1
+            self.error_samples.setdefault(operation, error[:300])
+            lowered = error.lower()
+            if "deadlock detected" in lowered:
+                self.deadlock_errors += 1
+            elif "lock timeout" in lowered or "could not obtain lock" in lowered:
+                self.lock_errors += 1
+
+
+class LockMonitor(threading.Thread):
+    """
+    Samples pg_stat_activity for backends of the target database waiting on a
+    heavyweight lock and reads the pg_stat_database deadlock counter.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__(name="lock-monitor", daemon=True)
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.conn = psycopg2.connect(
+            host=getenv("HOST"),
+            database=getenv("DATABASE"),
+            user=getenv("USER"),
+            password=getenv("PASS"),
+        )
+        self.conn.autocommit = True
+        self.samples = 0
+        self.waiting_samples = 0
+        self.max_waiters = 0
+        self.waits: Dict[Tuple[int, str], float] = {}
+        self.wait_events: Dict[str, int] = defaultdict(int)
+        self.deadlocks_start = self.deadlocks()
+
+    def deadlocks(self) -> int:
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()"
+            )
+            return cur.fetchone()[0]
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            try:
+                with self.conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        SELECT pid, query_start::text, wait_event,
+                               EXTRACT(EPOCH FROM (NOW() - state_change))
+                        FROM pg_stat_activity
+                        WHERE datname = current_database()
+                          AND wait_event_type = 'Lock'
+                          AND pid <> pg_backend_pid()
+                        """
+                    )
+                    rows = cur.fetchall()
+            except Exception as e:
+                print(f"lock monitor: {e}")
+                continue
+
+            self.samples += 1
+            if rows:
+                self.waiting_samples += 1
+            self.max_waiters = max(self.max_waiters, len(rows))
+            for pid, query_start, wait_event, waited in rows:
+                key = (pid, query_start)
+                if key not in self.waits:
+                    self.wait_events[wait_event] += 1
+                self.waits[key] = max(self.waits.get(key, 0.0), float(waited or 0))
+
+    def stop(self) -> Dict[str, Any]:
+        self.stop_event.set()
+        self.join(timeout=5)
+        waited = sorted(self.waits.values())
+        report = {
+            "deadlocks": self.deadlocks() - self.deadlocks_start,
+            "lock_waits": len(waited),
+            "lock_wait_events": dict(self.wait_events),
+            "max_concurrent_waiters": self.max_waiters,
+            "share_of_samples_with_waiters": (
+                round(self.waiting_samples / self.samples, 3) if self.samples else None
+            ),
+            "longest_lock_wait_ms": round(waited[-1] * 1000, 1) if waited else None,
+            "p95_lock_wait_ms": (
+                round(percentile(waited, 0.95) * 1000, 1) if waited else None
+            ),
+        }
+        self.conn.close()
+        return report
+
+
+class Cashier(threading.Thread):
+    def __init__(self, index: int, shared: "SharedState", args):
+        super().__init__(name=f"cashier-{index}", daemon=True)
+        self.shared = shared
+        self.args = args
+        self.rng = random.Random(args.seed * 1000 + index)
+        self.store_id = args.stores[index % len(args.stores)]
+        self.client = httpx.Client(
+            base_url=args.base_url,
+            cookies={"access_token": shared.token},
+            timeout=args.timeout,
+            verify=not args.insecure,
+        )
+        operations = list(args.mix.keys())
+        if len(args.stores) < 2 and "move" in operations:
+            operations.remove("move")
+        self.operations = operations
+        self.weights = [args.mix[name] for name in operations]
+
+    # -- request builders --------------------------------------------------
+
+    def pick_lines(self) -> List[Dict[str, Any]]:
+        products = self.shared.products[self.store_id]
+        count = max(1, min(len(products), int(self.rng.expovariate(1 / self.args.lines))))
+        lines = []
+        for product in self.rng.sample(products, count):
+            lines.append(
+                {
+                    "id": product["id"],
+                    "quantity": self.rng.choice((1, 1, 1, 2, 3)),
+                    "price": float(product["price"] or 0),
+                    "wholesale_price": float(product["wholesale_price"] or 0),
+                }
+            )
+        return lines
+
+    def bill_body(self, lines: List[Dict[str, Any]]) -> Dict[str, Any]:
+        total = round(sum(line["price"] * line["quantity"] for line in lines), 2)
+        return {
+            "time": datetime.now().isoformat(),
+            "discount": 0,
+            "total": total,
+            "note": "load test",
+            "products_flow": lines,
+        }
+
+    def post_bill(self, move_type: str) -> httpx.Response:
+        body = self.bill_body(self.pick_lines())
+        params: Dict[str, Any] = {"move_type": move_type, "store_id": self.store_id}
+        if move_type in ("installment", "reserve"):
+            params["party_id"] = self.rng.choice(self.shared.customers)
+        if move_type == "installment":
+            params["paid"] = round(body["total"] * 0.2, 2)
+            params["installments"] = 6
+            params["installment_interval"] = 30
+        response = self.client.post("/bill", params=params, json=body)
+        if move_type == "sell" and response.status_code == 200:
+            bill = (response.json() or {}).get("bill")
+            if bill and bill.get("id"):
+                self.shared.remember_bill(self.store_id, bill)
+        return response
+
+    def edit_bill(self) -> Optional[httpx.Response]:
+        bill = self.shared.take_bill(self.store_id, self.rng)
+        if bill is None:
+            return self.post_bill("sell")
+        products = [
+            {
+                "id": p["id"],
+                "name": p["name"] or "",
+                "bar_code": p["bar_code"] or "",
+                "amount": max(1, abs(int(p["amount"])) + self.rng.choice((-1, 1))),
+                "wholesale_price": float(p["wholesale_price"] or 0),
+                "price": float(p["price"] or 0),
+            }
+            for p in bill["products"]
+            if p and p.get("id") is not None
+        ]
+        body = {
+            "id": bill["id"],
+            "time": bill["time"],
+            "discount": float(bill["discount"] or 0),
+            "total": round(sum(p["price"] * p["amount"] for p in products), 2),
+            "type": bill["type"],
+            "note": bill.get("note"),
+            "products": products,
+        }
+        return self.client.put("/bill", params={"store_id": self.store_id}, json=body)
+
+    def move_products(self) -> httpx.Response:
+        destination = self.rng.choice([s for s in self.args.stores if s != self.store_id])
+        body = self.bill_body(self.pick_lines())
+        return self.client.post(
+            "/admin/move-products",
+            params={"source_store_id": self.store_id, "destination_store_id": destination},
+            json=body,
+        )
+
+    def add_cash_flow(self) -> httpx.Response:
+        move_type = self.rng.choice(("in", "out"))
+        return self.client.post(
+            "/cash-flow",
+            params={
+                "amount": round(self.rng.uniform(5, 500), 2),
+                "move_type": move_type,
+                "description": "load test",
+                "store_id": self.store_id,
+            },
+        )
+
+    # -- loop ----------------------------------------------------------------
+
+    def run(self) -> None:
+        results = self.shared.results
+        while not self.shared.stop.is_set():
+            operation = self.rng.choices(self.operations, weights=self.weights)[0]
+            started = time.perf_counter()
+            error = None
+            try:
+                if operation in ("sell", "return", "installment", "reserve"):
+                    response = self.post_bill(operation)
+                elif operation == "edit":
+                    response = self.edit_bill()
+                elif operation == "move":
+                    response = self.move_products()
+                else:
+                    response = self.add_cash_flow()
+                if response.status_code >= 400:
+                    error = f"HTTP {response.status_code}: {response.text}"
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}"
+            results.record(operation, time.perf_counter() - started, error)
+
+            if self.args.think_ms:
+                self.shared.stop.wait(self.rng.expovariate(1000 / self.args.think_ms))
+        self.client.close()
+
+
+class SharedState:
+    def __init__(self, token: str, results: Results):
+        self.token = token
+        self.results = results
+        self.stop = threading.Event()
+        self.products: Dict[int, List[Dict[str, Any]]] = {}
+        self.customers: List[int] = []
+        self._bills: Dict[int, deque] = defaultdict(
+            lambda: deque(maxlen=EDITABLE_BILLS_PER_STORE)
+        )
+        self._bills_lock = threading.Lock()
+
+    def remember_bill(self, store_id: int, bill: Dict[str, Any]) -> None:
+        with self._bills_lock:
+            self._bills[store_id].append(bill)
+
+    def take_bill(self, store_id: int, rng: random.Random) -> Optional[Dict[str, Any]]:
+        """A bill to edit; taken out so two cashiers never edit the same bill."""
+        with self._bills_lock:
+            bills = self._bills[store_id]
+            if not bills:
+                return None
+            bills.rotate(-rng.randrange(len(bills)))
+            return bills.popleft()
+
+
+def login(args) -> str:
+    response = httpx.post(
+        f"{args.base_url}/login",
+        params={"store_id": args.stores[0]},
+        data={"username": args.username, "password": args.password},
+        timeout=args.timeout,
+        verify=not args.insecure,
+    )
+    token = response.cookies.get("access_token")
+    if response.status_code != 200 or not token:
+        raise SystemExit(f"Login failed ({response.status_code}): {response.text}")
+    return token
+
+
+def load_reference_data(args, shared: SharedState) -> None:
+    with httpx.Client(
+        base_url=args.base_url,
+        cookies={"access_token": shared.token},
+        timeout=args.timeout,
+        verify=not args.insecure,
+    ) as client:
+        for store_id in args.stores:
+            response = client.get("/products", params={"store_id": store_id})
+            response.raise_for_status()
+            products = [
+                p for p in response.json()["products"] if (p["stock"] or 0) > 0
+            ]
+            products.sort(key=lambda p: p["stock"], reverse=True)
+            # A small hot set means many cashiers touching the same product rows
+            shared.products[store_id] = products[: args.hot_products]
+            if not shared.products[store_id]:
+                raise SystemExit(f"Store {store_id} has no products in stock")
+
+        response = client.get("/parties")
+        response.raise_for_status()
+        shared.customers = [
+            p["id"] for p in response.json() if p["type"] not in ("store", "owner")
+        ]
+        needs_party = any(args.mix.get(op) for op in ("installment", "reserve"))
+        if needs_party and not shared.customers:
+            raise SystemExit("installment / reserve bills need at least one customer party")
+
+
+def build_report(args, results: Results, elapsed: float, db_stats) -> Dict[str, Any]:
+    operations = {}
+    total_ok = 0
+    total_errors = 0
+    all_latencies: List[float] = []
+    for operation in OPERATIONS:
+        latencies = sorted(results.latencies.get(operation, []))
+        errors = results.errors.get(operation, 0)
+        if not latencies and not errors:
+            continue
+        total_ok += len(latencies)
+        total_errors += errors
+        all_latencies.extend(latencies)
+        operations[operation] = {
+            "ok": len(latencies),
+            "errors": errors,
+            "rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": _ms(percentile(latencies, 0.50)),
+            "p95_ms": _ms(percentile(latencies, 0.95)),
+            "p99_ms": _ms(percentile(latencies, 0.99)),
+            "max_ms": _ms(latencies[-1] if latencies else None),
+        }
+        if operation in results.error_samples:
+            operations[operation]["first_error"] = results.error_samples[operation]
+
+    all_latencies.sort()
+    return {
+        "label": args.label,
+        "base_url": args.base_url,
+        "stores": args.stores,
+        "cashiers": args.cashiers,
+        "duration_s": round(elapsed, 1),
+        "mix": args.mix,
+        "hot_products": args.hot_products,
+        "requests_ok": total_ok,
+        "requests_failed": total_errors,
+        "throughput_rps": round(total_ok / elapsed, 2),
+        "p50_ms": _ms(percentile(all_latencies, 0.50)),
+        "p95_ms": _ms(percentile(all_latencies, 0.95)),
+        "p99_ms": _ms(percentile(all_latencies, 0.99)),
+        "deadlock_errors": results.deadlock_errors,
+        "lock_timeout_errors": results.lock_errors,
+        "database": db_stats,
+        "operations": operations,
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print()
+    print(
+        f"{report['cashiers']} cashiers on store(s) {report['stores']} "
+        f"for {report['duration_s']}s"
+    )
+    print(
+        f"throughput {report['throughput_rps']} req/s, "
+        f"{report['requests_ok']} ok, {report['requests_failed']} failed, "
+        f"p50 {report['p50_ms']} ms, p95 {report['p95_ms']} ms, p99 {report['p99_ms']} ms"
+    )
+    print()
+    print(f"{'operation':<12}{'ok':>8}{'errors':>8}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, op in report["operations"].items():
+        print(
+            f"{name:<12}{op['ok']:>8}{op['errors']:>8}{op['rps']:>9}"
+            f"{_fmt(op['p50_ms'])}{_fmt(op['p95_ms'])}{_fmt(op['p99_ms'])}{_fmt(op['max_ms'])}"
+        )
+    print()
+    print(
+        f"deadlock errors returned: {report['deadlock_errors']}, "
+        f"lock timeouts returned: {report['lock_timeout_errors']}"
+    )
+    db = report["database"]
+    if db:
+        print(
+            f"postgres: {db['deadlocks']} deadlocks, {db['lock_waits']} lock waits "
+            f"(max {db['max_concurrent_waiters']} concurrent, "
+            f"p95 {db['p95_lock_wait_ms']} ms, longest {db['longest_lock_wait_ms']} ms, "
+            f"waiters present in {db['share_of_samples_with_waiters']} of samples)"
+        )
+        if db["lock_wait_events"]:
+            print(f"lock types waited on: {db['lock_wait_events']}")
+    for name, op in report["operations"].items():
+        if "first_error" in op:
+            print(f"first {name} error: {op['first_error']}")
+
+
+def _fmt(value: Optional[float]) -> str:
+    return f"{'-' if value is None else value:>9}"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Concurrent cashier load test for the POS write path."
+    )
+    parser.add_argument("--base-url", default=getenv("LOAD_TEST_URL") or "http://localhost:8000")
+    parser.add_argument("--username", default=getenv("LOAD_TEST_USERNAME") or "george")
+    parser.add_argument("--password", default=getenv("LOAD_TEST_PASSWORD") or "verystrongpassword")
+    parser.add_argument(
+        "--stores",
+        type=lambda s: [int(x) for x in s.split(",") if x.strip()],
+        default=[1],
+        help="comma separated store ids; cashiers are spread over them",
+    )
+    parser.add_argument("--cashiers", type=int, default=16, help="concurrent simulated cashiers")
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before measuring")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--lines", type=float, default=3, help="average products per bill")
+    parser.add_argument("--hot-products", type=int, default=200, help="only use each store's N most stocked products")
+    parser.add_argument("--think-ms", type=float, default=0, help="average pause between a cashier's requests")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--insecure", action="store_true", help="skip TLS verification")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-db-stats", action="store_true", help="do not connect to Postgres for deadlock / lock stats")
+    parser.add_argument("--sample-ms", type=float, default=100, help="lock sampler interval")
+    parser.add_argument("--label", default="", help="free text stored in the JSON report")
+    parser.add_argument("--json", help="write the report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.base_url = args.base_url.rstrip("/")
+
+    results = Results()
+    shared = SharedState(login(args), results)
+    load_reference_data(args, shared)
+
+    cashiers = [Cashier(i, shared, args) for i in range(args.cashiers)]
+    print(f"Warming up {len(cashiers)} cashiers for {args.warmup}s...", flush=True)
+    for cashier in cashiers:
+        cashier.start()
+    time.sleep(args.warmup)
+
+    monitor = None if args.no_db_stats else LockMonitor(args.sample_ms / 1000)
+    if monitor:
+        monitor.start()
+    print(f"Measuring for {args.duration}s...", flush=True)
+    results.recording = True
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    results.recording = False
+    elapsed = time.perf_counter() - started
+
+    shared.stop.set()
+    for cashier in cashiers:
+        cashier.join(timeout=args.timeout)
+    db_stats = monitor.stop() if monitor else None
+
+    report = build_report(args, results, elapsed, db_stats)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,23 @@
 from typing import Optional
 import json
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Header, Response, Cookie
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import io
+from contextlib import nullcontext
 from typing import Literal, Any, Dict, List
 import asyncio
+import hmac
 import platform
+import anyio.to_thread
 from pydantic import BaseModel
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import execute_values
+from database import POOL_MAX_SIZE, Database, close_all_pools, pool_stats
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import UploadFile, File
 from datetime import datetime
 import logging
 from dotenv import load_dotenv
 from os import getenv
-from openpyxl import Workbook
 import subprocess
 import os
 from reset_db import reset_db
@@ -23,7 +25,7 @@ from auth import router as auth_router
 from settings import router as setting_router
 from parties import router as party_router
 from installment import router as installment_router
-from analytics import router as analytics_router
+from analytics import router as analytics_router, start_analytics_warmup
 from employee import router as employee_router
 from telegram import router as telegram_router
 from detailed_analytics import router as detailed_analytics_router
@@ -32,17 +34,59 @@ from batches import router as batches_router
 from payment_methods import router as payment_methods_router
 from payment_methods import get_default_payment_method
 from accounts import router as accounts_router
+from exports import router as exports_router
 from auth_middleware import get_current_user, get_store_info
 from telegram_utils import (
     send_telegram_notification_background,
     format_excessive_discount_message,
-    check_and_send_low_stock_notification,
+    send_low_stock_notification_background,
     format_store_transfer_message,
     get_store_telegram_chat_id,
 )
 from expiration_scheduler import start_expiration_scheduler
-from batches import consume_batches_fefo, add_to_batch, adjust_batches_for_stock_change
+from cash_checkpoints import start_cash_checkpoint_job
+from idempotency import (
+    claim_idempotency_key,
+    release_idempotency_key,
+    request_fingerprint,
+    save_idempotent_response,
+    start_idempotency_purge_job,
+)
+from etags import (
+    catalog_changed_since,
+    catalog_etag,
+    not_modified,
+    requested_catalog_version,
+    table_versions,
+    with_etag,
+)
+from pagination import (
+    NEXT_CURSOR_HEADER,
+    cursor_headers,
+    keyset_condition,
+    limit_clause,
+    next_cursor,
+    page_size,
+)
+from store_cache import start_store_cache_listener, stop_store_cache_listener
+from metrics import MetricsMiddleware, metrics_snapshot, render_prometheus
+from slow_query_log import (
+    clear_slow_queries,
+    list_slow_queries,
+    slow_query_log_status,
+)
+from batches import (
+    add_to_batches_bulk,
+    consume_batches_bulk,
+    adjust_batches_for_stock_change,
+)
 from telegram_commands import telegram_command_worker_loop
+from leader_election import (
+    current_leader,
+    leader_status,
+    start_leader_election,
+    stop_leader_election,
+)
 
 load_dotenv()
 
@@ -53,6 +97,17 @@ USER = getenv("USER")
 PASS = getenv("PASS")
 SECRET = getenv("SECRET") or ""
 ALGORITHM = getenv("ALGORITHM") or ""
+# Worker threads for sync (def) endpoints and dependencies. Blocking DB,
+# pg_dump and Telegram HTTP work runs there, never on the event loop. Most of
+# them hold a pooled connection, and some (a bill's store lookup or Telegram
+# chat id on a cache miss) take a second one while holding the first. By
+# default there are half as many threads as connections, so even with every
+# thread busy a nested checkout finds a free connection instead of waiting
+# until PoolTimeout.
+THREADPOOL_SIZE = int(getenv("THREADPOOL_SIZE") or max(1, POOL_MAX_SIZE // 2))
+# Bearer token a Prometheus scraper may send to GET /metrics instead of a
+# login session (unset: only logged-in users can read it)
+METRICS_TOKEN = getenv("METRICS_TOKEN") or ""
 
 # Create the FastAPI application
 app = FastAPI()
@@ -69,9 +124,7 @@ app.include_router(notifications_router)
 app.include_router(batches_router)
 app.include_router(payment_methods_router)
 app.include_router(accounts_router)
-
-
-telegram_command_worker_task: Optional[asyncio.Task] = None
+app.include_router(exports_router)
 
 
 def _install_windows_asyncio_exception_filter() -> None:
@@ -103,30 +156,32 @@ def _install_windows_asyncio_exception_filter() -> None:
     loop.set_exception_handler(_exception_handler)
 
 
+def _start_background_jobs() -> List[asyncio.Task]:
+    """Jobs that must run in exactly one worker process (see leader_election)"""
+    tasks = start_expiration_scheduler()
+    tasks.append(asyncio.create_task(telegram_command_worker_loop()))
+    tasks.append(start_cash_checkpoint_job())
+    tasks.append(start_idempotency_purge_job())
+    return tasks
+
+
 # Startup event to initialize the expiration scheduler
 @app.on_event("startup")
 async def startup_event():
     """Initialize background tasks on startup"""
-    global telegram_command_worker_task
     _install_windows_asyncio_exception_filter()
-    start_expiration_scheduler()
-    if telegram_command_worker_task is None or telegram_command_worker_task.done():
-        telegram_command_worker_task = asyncio.create_task(
-            telegram_command_worker_loop()
-        )
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    start_store_cache_listener()
+    start_leader_election(_start_background_jobs)
+    start_analytics_warmup()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Stop background tasks on shutdown"""
-    global telegram_command_worker_task
-    if telegram_command_worker_task is not None:
-        telegram_command_worker_task.cancel()
-        try:
-            await telegram_command_worker_task
-        except asyncio.CancelledError:
-            pass
-        telegram_command_worker_task = None
+    await stop_leader_election()
+    stop_store_cache_listener()
+    close_all_pools()
 
 
 origins = [
@@ -146,7 +201,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
+app.add_middleware(MetricsMiddleware)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -225,6 +282,20 @@ class Bill(BaseModel):
         return data
 
 
+class BulkBill(BaseModel):
+    "A queued bill with the query parameters of POST /bill"
+
+    bill: Bill
+    move_type: Literal[
+        "sell", "buy", "BNPL", "return", "reserve", "installment", "buy-return"
+    ]
+    party_id: Optional[int] = None
+    paid: Optional[float] = None
+    installments: Optional[int] = None
+    installment_interval: Optional[int] = None
+    idempotency_key: Optional[str] = None
+
+
 class dbProduct(BaseModel):
     "Define the dbProductFlow model"
 
@@ -260,37 +331,6 @@ class dbBill(BaseModel):
         return data
 
 
-class Database:
-    "Database context manager to handle the connection and cursor"
-
-    def __init__(self, host, database, user, password, real_dict_cursor=True):
-        self.host = host
-        self.database = database
-        self.user = user
-        self.password = password
-        self.real_dict_cursor = real_dict_cursor
-        self.conn = psycopg2.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password,
-        )
-        self.cursor = self.conn.cursor(
-            cursor_factory=RealDictCursor if self.real_dict_cursor else None
-        )
-
-    def __enter__(self):
-        return self.cursor
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is not None:
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-        self.cursor.close()
-        self.conn.close()
-
-
 def _get_party_store_id(cur, party_id: Optional[int]) -> Optional[int]:
     if not party_id:
         return None
@@ -703,6 +743,7 @@ def get_bar_code(current_user: dict = Depends(get_current_user)):
 def get_products(
     store_id: int,
     is_deleted: Optional[bool] = False,
+    if_none_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user),
 ):
     """
@@ -713,10 +754,18 @@ def get_products(
         store_id (int): The store ID to get products for
 
     Returns:
-        List[Dict]: A list of dictionaries containing the products
+        List[Dict]: A list of dictionaries containing the products, and the
+        catalog version to pass to GET /products/changes. 304 when the
+        If-None-Match catalog version is still current.
     """
     try:
         with Database(HOST, DATABASE, USER, PASS) as cur:
+            since = requested_catalog_version(if_none_match)
+            if since is not None and not catalog_changed_since(cur, since, store_id):
+                return not_modified(catalog_etag(since))
+
+            version = _catalog_version(cur)
+
             # Get products with inventory for the specific store
             cur.execute(
                 """SELECT
@@ -757,25 +806,115 @@ def get_products(
                 product["id"]: product for product in reserved_products
             }
 
-        return JSONResponse(
-            content={"products": products, "reserved_products": reserved_products}
+        return with_etag(
+            {
+                "products": products,
+                "reserved_products": reserved_products,
+                "version": version,
+            },
+            catalog_etag(version),
         )
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
+def _catalog_version(cur) -> int:
+    """
+    Version of the catalog as read from now on. Rows carry the id of the
+    transaction that last wrote them (stamp_catalog_version), and every
+    transaction below the snapshot's xmin has finished, so a row stamped
+    below it is already visible to this read and a later write is stamped
+    at or above it.
+    """
+    cur.execute(
+        "SELECT pg_snapshot_xmin(pg_current_snapshot())::TEXT::BIGINT AS version"
+    )
+    return cur.fetchone()["version"]
+
+
+@app.get("/products/changes")
+def get_product_changes(
+    store_id: int,
+    since: int = 0,
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Catalog changes of a store since a version, for terminals that keep a
+    local copy of GET /products.
+
+    Args:
+        store_id (int): The store ID to get changes for
+        since (int): The version returned by GET /products or by the previous
+            call (0 returns every product of the store)
+
+    Returns:
+        Dict: The new version, and each product whose data, stock, deletion or
+        reservations changed. A product with is_deleted true leaves the
+        catalog; reserved is its total reserved amount (0 when none). A
+        product may be sent again by the next call, applying it twice is
+        harmless.
+    """
+    try:
+        with Database(HOST, DATABASE, USER, PASS) as cur:
+            version = _catalog_version(cur)
+            cur.execute(
+                """
+                WITH changed AS (
+                    SELECT product_id
+                    FROM product_inventory
+                    WHERE store_id = %s AND version >= %s
+                    UNION
+                    SELECT id FROM products WHERE version >= %s
+                )
+                SELECT
+                    p.id, p.name, p.bar_code, p.wholesale_price,
+                    p.price, pi.stock, p.category, pi.is_deleted,
+                    COALESCE((
+                        SELECT SUM(rp.amount)
+                        FROM reserved_products rp
+                        WHERE rp.store_id = pi.store_id
+                        AND rp.product_id = pi.product_id
+                    ), 0) AS reserved
+                FROM changed c
+                JOIN products p ON p.id = c.product_id
+                JOIN product_inventory pi
+                    ON pi.product_id = c.product_id AND pi.store_id = %s
+                ORDER BY p.id
+                """,
+                (store_id, since, since, store_id),
+            )
+            products = cur.fetchall()
+
+        return JSONResponse(content={"products": products, "version": version})
+    except Exception as e:
+        print(f"Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
 @app.get("/admin/products")
-def get_products_as_admin(current_user: dict = Depends(get_current_user)):
+def get_products_as_admin(
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+):
     """
     Get all products from the database for all stores as admin
 
     Returns:
         List[Dict]: A dictionary containing products with their stocks across all stores
-                    and any reserved products
+                    and any reserved products. 304 when the If-None-Match
+                    catalog version and store names are still current.
     """
     try:
         with Database(HOST, DATABASE, USER, PASS) as cur:
+            # Stock is keyed by store name
+            stores_version = table_versions(cur, "store_data")
+            since = requested_catalog_version(if_none_match, stores_version)
+            if since is not None and not catalog_changed_since(cur, since):
+                return not_modified(catalog_etag(since, stores_version))
+
+            version = _catalog_version(cur)
+
             # Get products with inventory for all stores
             cur.execute(
                 """WITH all_stores AS (
@@ -841,8 +980,153 @@ def get_products_as_admin(current_user: dict = Depends(get_current_user)):
 
                 reserved_products[product_id][store_key] = amount
 
-        return JSONResponse(
-            content={"products": products, "reserved_products": reserved_products}
+        return with_etag(
+            {"products": products, "reserved_products": reserved_products},
+            catalog_etag(version, stores_version),
+        )
+    except Exception as e:
+        print(f"Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+ADMIN_MATRIX_SORTS = {
+    "name": "p.name",
+    "bar_code": "p.bar_code",
+    "category": "p.category",
+    "price": "p.price",
+    "wholesale_price": "p.wholesale_price",
+    "stock": "COALESCE(totals.stock, 0)",
+}
+
+
+@app.get("/admin/products/matrix")
+def get_admin_product_matrix(
+    limit: int = 100,
+    offset: int = 0,
+    sort: str = "name",
+    order: str = "asc",
+    search: Optional[str] = None,
+    category: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    One page of the multi-store product matrix, for the admin products page
+
+    Args:
+        limit (int): Products per page (at most 500)
+        offset (int): Products to skip
+        sort (str): name, bar_code, category, price, wholesale_price or stock
+            (total over all stores)
+        order (str): asc or desc
+        search (str): Part of the name, or the start of the bar code
+        category (str): Only products of this category
+
+    Returns:
+        Dict: The stores once, then the page of products, each with stock and
+        reserved arrays aligned to the stores, and the total number of
+        matching products. 304 when the If-None-Match catalog version and
+        store names are still current.
+    """
+    if sort not in ADMIN_MATRIX_SORTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"sort must be one of {', '.join(ADMIN_MATRIX_SORTS)}",
+        )
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    limit = max(1, min(limit, 500))
+    offset = max(0, offset)
+
+    params = {
+        "search": search or None,
+        "pattern": f"%{search}%" if search else None,
+        "prefix": f"{search}%" if search else None,
+        "category": category,
+        "limit": limit,
+        "offset": offset,
+    }
+    condition = """
+        (%(search)s::VARCHAR IS NULL OR p.name ILIKE %(pattern)s OR p.bar_code LIKE %(prefix)s)
+        AND (%(category)s::VARCHAR IS NULL OR p.category = %(category)s)
+    """
+    # Totals over all stores are only needed to sort by them
+    totals = (
+        """
+        LEFT JOIN (
+            SELECT product_id, SUM(stock) AS stock
+            FROM product_inventory
+            GROUP BY product_id
+        ) totals ON totals.product_id = p.id
+        """
+        if sort == "stock"
+        else ""
+    )
+    sort_key = ADMIN_MATRIX_SORTS[sort]
+    # Default NULL placement, so idx_products_name serves both directions
+    ordering = f"sort_key {order.upper()}, id {order.upper()}"
+
+    try:
+        with Database(HOST, DATABASE, USER, PASS) as cur:
+            stores_version = table_versions(cur, "store_data")
+            since = requested_catalog_version(if_none_match, stores_version)
+            if since is not None and not catalog_changed_since(cur, since):
+                return not_modified(catalog_etag(since, stores_version))
+
+            version = _catalog_version(cur)
+
+            cur.execute("SELECT id, name FROM store_data ORDER BY id")
+            stores = cur.fetchall()
+            params["store_ids"] = [store["id"] for store in stores]
+
+            # Only the page's products are looked up per store, through the
+            # (store_id, product_id) indexes
+            cur.execute(
+                f"""
+                WITH page AS (
+                    SELECT
+                        p.id, p.name, p.bar_code, p.wholesale_price, p.price, p.category,
+                        {sort_key} AS sort_key
+                    FROM products p
+                    {totals}
+                    WHERE {condition}
+                    ORDER BY {ordering}
+                    LIMIT %(limit)s OFFSET %(offset)s
+                )
+                SELECT
+                    p.id, p.name, p.bar_code, p.wholesale_price, p.price, p.category,
+                    ARRAY(
+                        SELECT COALESCE(pi.stock, 0)
+                        FROM unnest(%(store_ids)s::BIGINT[]) WITH ORDINALITY s(id, n)
+                        LEFT JOIN product_inventory pi
+                            ON pi.store_id = s.id AND pi.product_id = p.id
+                        ORDER BY s.n
+                    ) AS stock,
+                    ARRAY(
+                        SELECT COALESCE((
+                            SELECT SUM(rp.amount)
+                            FROM reserved_products rp
+                            WHERE rp.store_id = s.id AND rp.product_id = p.id
+                        ), 0)
+                        FROM unnest(%(store_ids)s::BIGINT[]) WITH ORDINALITY s(id, n)
+                        ORDER BY s.n
+                    ) AS reserved
+                FROM page p
+                ORDER BY {ordering}
+                """,
+                params,
+            )
+            products = cur.fetchall()
+
+            cur.execute(
+                f"SELECT COUNT(*) AS total FROM products p WHERE {condition}",
+                params,
+            )
+            total = cur.fetchone()["total"]
+
+        return with_etag(
+            {"stores": stores, "products": products, "total": total},
+            catalog_etag(version, stores_version),
         )
     except Exception as e:
         print(f"Error: {e}")
@@ -1064,21 +1348,31 @@ def restore_product(
 @app.get("/bills")
 def get_bills(
     store_id: int,
+    response: Response,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     party_id: Optional[int] = None,
     bill_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
 ):
     """
     Get all bills from the database
 
+    Args:
+        limit (int): Bills per page, newest first (at most 500). Without it,
+            every bill of the range is returned.
+        cursor (str): X-Next-Cursor of the previous page
+
     Returns:
         List[Dict]: A list of dictionaries containing the bills
 
     """
     extra_conditions: list[str] = []
     params: list[Any] = []
+    limit = page_size(limit)
+    keyset, keyset_params = keyset_condition(cursor, "bills.time", "bills.id")
 
     if bill_id is not None:
         extra_conditions.append("AND bills.id = %s")
@@ -1099,10 +1393,22 @@ def get_bills(
 
         params.append(store_id)
 
+    params.extend(keyset_params)
+
     try:
         with Database(HOST, DATABASE, USER, PASS) as cur:
             cur.execute(
-                f"""SELECT
+                f"""WITH page AS (
+                    SELECT bills.id, bills.store_id
+                    FROM bills
+                    WHERE 1 = 1
+                    {" ".join(extra_conditions)}
+                    AND bills.store_id = %s
+                    {keyset}
+                    ORDER BY bills.time DESC, bills.id DESC
+                    {limit_clause(limit)}
+                )
+                SELECT
                     bills.id,
                     bills.time,
                     bills.discount,
@@ -1122,26 +1428,30 @@ def get_bills(
                         )
                         ELSE NULL
                     END AS installment_details,
-                    json_agg(
-                        json_build_object(
-                            'id', products_flow.product_id,
-                            'name', products.name,
-                            'bar_code', products.bar_code,
-                            'amount', products_flow.amount,
-                            'wholesale_price', products_flow.wholesale_price,
-                            'price', products_flow.price
-                        )
-                    ) AS products
-                FROM bills
-                JOIN products_flow
+                    COALESCE(
+                        json_agg(
+                            json_build_object(
+                                'id', products_flow.product_id,
+                                'name', products.name,
+                                'bar_code', products.bar_code,
+                                'amount', products_flow.amount,
+                                'wholesale_price', products_flow.wholesale_price,
+                                'price', products_flow.price
+                            )
+                        ) FILTER (WHERE products_flow.product_id IS NOT NULL),
+                        '[]'::json
+                    ) AS products,
+                    bills.time AS cursor_time,
+                    bills.id AS cursor_id
+                FROM page
+                JOIN bills ON bills.id = page.id AND bills.store_id = page.store_id
+                LEFT JOIN products_flow
                     ON bills.id = products_flow.bill_id
                     AND bills.store_id = products_flow.store_id
-                JOIN products ON products_flow.product_id = products.id
+                LEFT JOIN products ON products_flow.product_id = products.id
                 LEFT JOIN assosiated_parties ON bills.party_id = assosiated_parties.id
-                LEFT JOIN (
+                LEFT JOIN LATERAL (
                     SELECT
-                        i.bill_id,
-                        i.store_id,
                         i.id AS installment_id,
                         i.paid::double precision AS paid,
                         i.installments_count,
@@ -1149,9 +1459,8 @@ def get_bills(
                         COALESCE(flow_data.flow, '[]'::jsonb) AS flow,
                         (i.paid::double precision + COALESCE(flow_data.total_flow_paid, 0)) AS total_paid
                     FROM installments i
-                    LEFT JOIN (
+                    LEFT JOIN LATERAL (
                         SELECT
-                            installment_id,
                             COALESCE(SUM(amount::double precision), 0) AS total_flow_paid,
                             jsonb_agg(
                                 jsonb_build_object(
@@ -1162,23 +1471,22 @@ def get_bills(
                                 ORDER BY time, id
                             ) AS flow
                         FROM installments_flow
-                        GROUP BY installment_id
-                    ) AS flow_data ON i.id = flow_data.installment_id
-                ) AS installments_data ON bills.id = installments_data.bill_id
-                    AND bills.store_id = installments_data.store_id
-                WHERE 1 = 1
-                {" ".join(extra_conditions)}
-                AND bills.store_id = %s
+                        WHERE installments_flow.installment_id = i.id
+                    ) AS flow_data ON TRUE
+                    WHERE i.bill_id = bills.id
+                    AND i.store_id = bills.store_id
+                ) AS installments_data ON TRUE
                 GROUP BY bills.id, bills.time, bills.discount,
                     bills.total, bills.type, bills.note, bills.payments, bills.party_id, assosiated_parties.name,
                     installments_data.installment_id, installments_data.paid,
                     installments_data.installments_count, installments_data.installment_interval,
                     installments_data.total_paid, installments_data.flow
-                ORDER BY bills.time DESC
+                ORDER BY bills.time DESC, bills.id DESC
                     """,
                 tuple(params),
             )
             bills = cur.fetchall()
+            response.headers.update(cursor_headers(next_cursor(bills, limit)))
             return bills
     except Exception as e:
         print(f"Error: {e}")
@@ -1597,16 +1905,19 @@ def update_bill(
                 for product_flow in bill.products
             ]
 
-            # Insert all product flow entries
-            cur.executemany(
+            # Insert all product flow entries in one statement, so the
+            # statement-level products_flow trigger runs once for the bill
+            execute_values(
+                cur,
                 """
                 INSERT INTO products_flow (
                     store_id, bill_id, product_id,
                     amount, wholesale_price, price, time
                 )
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                VALUES %s
                 """,
                 values,
+                page_size=max(len(values), 1),
             )
 
         if sync_pair and bill.type in ["sell", "buy"]:
@@ -1686,6 +1997,98 @@ def _resolve_bill_payments(cur, bill: "Bill", move_type: str, bill_abs_total: fl
     return json.dumps(lines, ensure_ascii=False)
 
 
+def _bill_products_info(cur, product_ids: List[int]) -> Dict[int, dict]:
+    """Names and barcodes of the given products, by id"""
+    if not product_ids:
+        return {}
+    cur.execute(
+        "SELECT id, name, bar_code FROM products WHERE id = ANY(%s)",
+        (list(set(product_ids)),),
+    )
+    return {row["id"]: row for row in cur.fetchall()}
+
+
+def _products_below_zero(
+    cur, store_id: int, lines: List[ProductFlow], product_info: Dict[int, dict]
+) -> List[dict]:
+    """
+    Sold products this bill took out of stock (positive before it, at or
+    below zero after it), in one query
+    """
+    quantity_sold: Dict[int, int] = {}
+    for line in lines:
+        quantity_sold[line.id] = quantity_sold.get(line.id, 0) + line.quantity
+    if not quantity_sold:
+        return []
+    cur.execute(
+        """
+        SELECT product_inventory.product_id, product_inventory.stock
+        FROM unnest(%s::BIGINT[], %s::INT[]) AS sold (product_id, quantity)
+        JOIN product_inventory ON product_inventory.product_id = sold.product_id
+        WHERE product_inventory.store_id = %s
+        AND product_inventory.stock <= 0
+        AND product_inventory.stock + sold.quantity > 0
+        ORDER BY product_inventory.product_id
+        """,
+        (list(quantity_sold), list(quantity_sold.values()), store_id),
+    )
+    return [
+        {
+            "name": product_info.get(row["product_id"], {}).get("name"),
+            "stock": row["stock"],
+            "product_id": row["product_id"],
+            "quantity_sold": quantity_sold[row["product_id"]],
+        }
+        for row in cur.fetchall()
+    ]
+
+
+def _bill_response(
+    bill_row: dict,
+    lines: List[dict],
+    product_info: Dict[int, dict],
+    installment_details: Optional[dict] = None,
+) -> dict:
+    """
+    The bill as GET /bills shows it, from the RETURNING rows of the bills
+    and products_flow inserts
+
+    Args:
+        bill_row (dict): RETURNING row of the bills insert (with party_name)
+        lines (List[dict]): RETURNING rows of the products_flow insert
+        product_info (Dict[int, dict]): Product names and barcodes by id
+        installment_details (Optional[dict]): The installment, if any
+
+    Returns:
+        Dict: The bill
+    """
+    products = []
+    for line in lines:
+        info = product_info.get(line["product_id"], {})
+        products.append(
+            {
+                "id": line["product_id"],
+                "name": info.get("name"),
+                "bar_code": info.get("bar_code"),
+                "amount": line["amount"],
+                "wholesale_price": line["wholesale_price"],
+                "price": line["price"],
+            }
+        )
+    return {
+        "id": bill_row["id"],
+        "time": bill_row["time"],
+        "discount": bill_row["discount"],
+        "total": bill_row["total"],
+        "type": bill_row["type"],
+        "note": bill_row["note"],
+        "payments": bill_row["payments"],
+        "party_name": bill_row["party_name"],
+        "installment_details": installment_details,
+        "products": products,
+    }
+
+
 def _add_bill_internal(
     bill: Bill,
     move_type: Literal[
@@ -1699,6 +2102,8 @@ def _add_bill_internal(
     current_user: Optional[dict] = None,
     background_tasks: Optional[BackgroundTasks] = None,
     forward_off_store: bool = True,
+    idempotency_key: Optional[str] = None,
+    cur=None,
 ):
     """
     Add a bill to the database
@@ -1714,6 +2119,9 @@ def _add_bill_internal(
         installment_interval (Optional[int]): The interval between installments
         current_user (dict): Current authenticated user (required)
         background_tasks (BackgroundTasks): FastAPI background tasks
+        idempotency_key (Optional[str]): Returns the stored response of an
+            earlier request with the same key instead of adding the bill again
+        cur: Run in the caller's transaction instead of a new one
 
     Returns:
         Dict: A message indicating the result of the operation
@@ -1742,7 +2150,25 @@ def _add_bill_internal(
     notification_data = {}
 
     try:
-        with Database(HOST, DATABASE, USER, PASS) as cur:
+        with nullcontext(cur) if cur else Database(HOST, DATABASE, USER, PASS) as cur:
+            if idempotency_key:
+                replay = claim_idempotency_key(
+                    cur,
+                    store_id,
+                    idempotency_key,
+                    "bill",
+                    request_fingerprint(
+                        bill, move_type, party_id, paid, installments, installment_interval
+                    ),
+                )
+                if replay is not None:
+                    return replay
+
+            # Names and barcodes for the response (and the discount alert)
+            product_info = _bill_products_info(
+                cur, [product_flow.id for product_flow in bill.products_flow]
+            )
+
             # Check for excessive discount in normal sell transactions only.
             # Alert only when discount itself pushes total below wholesale cost.
             if move_type == "sell":
@@ -1781,11 +2207,7 @@ def _add_bill_internal(
                     # Get product details for the message
                     product_details = []
                     for product_flow in bill.products_flow:
-                        cur.execute(
-                            "SELECT name FROM products WHERE id = %s",
-                            (product_flow.id,),
-                        )
-                        product_result = cur.fetchone()
+                        product_result = product_info.get(product_flow.id)
                         if product_result:
                             product_details.append(
                                 {
@@ -1817,7 +2239,12 @@ def _add_bill_internal(
                 """
                 INSERT INTO bills (store_id, time, discount, total, type, note, party_id, payments)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s::jsonb)
-                RETURNING id
+                RETURNING
+                    id, time, discount, total, type, note, payments,
+                    (
+                        SELECT name FROM assosiated_parties
+                        WHERE assosiated_parties.id = bills.party_id
+                    ) AS party_name
                 """,
                 (
                     store_id,
@@ -1830,10 +2257,10 @@ def _add_bill_internal(
                     payments_json,
                 ),
             )
-            result = cur.fetchone()
-            if not result:
+            bill_row = cur.fetchone()
+            if not bill_row:
                 raise HTTPException(status_code=400, detail="Insert into bills failed")
-            bill_id = result["id"]
+            bill_id = bill_row["id"]
 
             # Schedule Telegram notification as background task if needed
             if should_notify:
@@ -1845,7 +2272,8 @@ def _add_bill_internal(
                     send_telegram_notification_background, store_id, notification_str
                 )
 
-            # Create a list of tuples
+            # Lines take the bill's time, so a backdated bill lands in
+            # products_flow at its own place in the running totals
             values = [
                 (
                     store_id,
@@ -1857,86 +2285,81 @@ def _add_bill_internal(
                     else product_flow.quantity,
                     product_flow.wholesale_price,
                     product_flow.price,
-                    datetime.now().isoformat(),
+                    bill_row["time"],
                 )
                 for product_flow in bill.products_flow
             ]
 
-            cur.executemany(
+            # One statement for all lines: the products_flow trigger updates
+            # stock, running totals and prices for the whole bill at once
+            inserted_lines = execute_values(
+                cur,
                 """
                 INSERT INTO products_flow (
                     store_id, bill_id, product_id,
                     amount, wholesale_price, price, time
                 )
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                VALUES %s
+                RETURNING product_id, amount, wholesale_price, price
                 """,
                 values,
+                page_size=max(len(values), 1),
+                fetch=True,
             )
 
-            if cur.rowcount != len(values):
+            if len(inserted_lines) != len(values):
                 raise HTTPException(
                     status_code=400, detail="Insert into products_flow failed"
                 )
 
-            # Handle batch operations for products with expiration dates
-            for product_flow in bill.products_flow:
-                if move_type in ["buy", "return"]:
-                    # Adding products - create/update batches
+            # Batches for products with expiration dates, one bulk operation
+            # for the whole bill
+            consumed_batches = []
+            if move_type in ["buy", "return"]:
+                # Adding products - create/update batches. Lines without
+                # batches go untracked (no batch entry)
+                add_to_batches_bulk(
+                    cur,
+                    store_id,
+                    [
+                        (product_flow.id, batch.quantity, batch.expiration_date)
+                        for product_flow in bill.products_flow
+                        for batch in product_flow.batches or []
+                    ],
+                )
+
+            elif move_type in ["sell", "BNPL", "installment", "buy-return"]:
+                # Removing products - consume from batches: the batches the
+                # user picked, else FEFO (product_flow.batch_id is the legacy
+                # way of picking one)
+                consumption = []
+                for product_flow in bill.products_flow:
                     if product_flow.batches:
-                        # Use specified batches with expiration dates
-                        for batch in product_flow.batches:
-                            add_to_batch(
-                                cur,
-                                store_id,
-                                product_flow.id,
-                                batch.quantity,
-                                batch.expiration_date,
-                            )
-                    # If no batches specified, products go untracked (no batch entry)
-
-                elif move_type in ["sell", "BNPL", "installment", "buy-return"]:
-                    # Removing products - consume from batches
-                    if product_flow.batches and len(product_flow.batches) > 0:
-                        # User specified which batches to consume from
-                        for batch in product_flow.batches:
-                            if batch.batch_id:
-                                # Consume from specific batch by ID
-                                consume_batches_fefo(
-                                    cur,
-                                    store_id,
-                                    product_flow.id,
-                                    batch.quantity,
-                                    batch.batch_id,
-                                )
-                            else:
-                                # Consume by expiration date match (FEFO will handle)
-                                consume_batches_fefo(
-                                    cur, store_id, product_flow.id, batch.quantity, None
-                                )
+                        consumption.extend(
+                            (product_flow.id, batch.quantity, batch.batch_id)
+                            for batch in product_flow.batches
+                        )
                     else:
-                        # No specific batches - use FEFO automatically
-                        consume_batches_fefo(
-                            cur,
-                            store_id,
-                            product_flow.id,
-                            product_flow.quantity,
-                            product_flow.batch_id,  # Optional specific batch (legacy support)
+                        consumption.append(
+                            (product_flow.id, product_flow.quantity, product_flow.batch_id)
                         )
+                consumed_batches = consume_batches_bulk(cur, store_id, consumption)
 
-            # Check for low stock after sales transactions (as background task)
+            # Low stock after sales: the trigger has already updated the
+            # stock, so read it here and notify only when this bill took a
+            # product out of stock
             if move_type in ["sell", "BNPL", "installment", "buy-return"]:
-                sold_products = [
-                    {"id": pf.id, "quantity": pf.quantity} for pf in bill.products_flow
-                ]
-
-                # Schedule the stock check as a background task
-                background_tasks.add_task(
-                    check_and_send_low_stock_notification,
-                    store_id,
-                    sold_products,
-                    store_info.get("name") if store_info else None,
-                    current_user.get("username"),
+                products_below_zero = _products_below_zero(
+                    cur, store_id, bill.products_flow, product_info
                 )
+                if products_below_zero:
+                    background_tasks.add_task(
+                        send_low_stock_notification_background,
+                        store_id,
+                        products_below_zero,
+                        store_info.get("name") if store_info else None,
+                        current_user.get("username"),
+                    )
 
             if move_type == "reserve":
                 reservation_amounts: dict[int, int] = {}
@@ -1957,14 +2380,28 @@ def _add_bill_internal(
                     ],
                 )
 
+            installment_details = None
             if move_type == "installment":
                 cur.execute(
                     """
                     INSERT INTO installments (bill_id, store_id, paid, installments_count, installment_interval)
                     VALUES (%s, %s, %s, %s, %s)
+                    RETURNING
+                        id, paid::double precision AS paid,
+                        installments_count, installment_interval
                     """,
                     (bill_id, store_id, paid, installments, installment_interval),
                 )
+                installment_row = cur.fetchone()
+                # A new installment has no payments in installments_flow yet
+                installment_details = {
+                    "id": installment_row["id"],
+                    "paid": installment_row["paid"],
+                    "installments_count": installment_row["installments_count"],
+                    "installment_interval": installment_row["installment_interval"],
+                    "total_paid": installment_row["paid"] or 0,
+                    "flow": [],
+                }
 
             # Off-store payment forwarding: if a sell/return was paid via an
             # account that physically lives in another store, forward that
@@ -2019,89 +2456,35 @@ def _add_bill_internal(
                                 bill.time,
                             )
 
-            # get the inserted bill to return it
-            cur.execute(
-                """
-                SELECT
-                    bills.id,
-                    bills.time,
-                    bills.discount,
-                    bills.total,
-                    bills.type,
-                    bills.note,
-                    bills.payments,
-                    assosiated_parties.name AS party_name,
-                    CASE
-                        WHEN installments_data.installment_id IS NOT NULL THEN jsonb_build_object(
-                            'id', installments_data.installment_id,
-                            'paid', installments_data.paid,
-                            'installments_count', installments_data.installments_count,
-                            'installment_interval', installments_data.installment_interval,
-                            'total_paid', installments_data.total_paid,
-                            'flow', installments_data.flow
-                        )
-                        ELSE NULL
-                    END AS installment_details,
-                    json_agg(
-                        json_build_object(
-                            'id', products_flow.product_id,
-                            'name', products.name,
-                            'bar_code', products.bar_code,
-                            'amount', products_flow.amount,
-                            'wholesale_price', products_flow.wholesale_price,
-                            'price', products_flow.price
-                        )
-                    ) AS products
-                FROM bills
-                JOIN products_flow ON bills.id = products_flow.bill_id
-                JOIN products ON products_flow.product_id = products.id
-                LEFT JOIN assosiated_parties ON bills.party_id = assosiated_parties.id
-                LEFT JOIN (
-                    SELECT
-                        i.bill_id,
-                        i.store_id,
-                        i.id AS installment_id,
-                        i.paid::double precision AS paid,
-                        i.installments_count,
-                        i.installment_interval,
-                        COALESCE(flow_data.flow, '[]'::jsonb) AS flow,
-                        (i.paid::double precision + COALESCE(flow_data.total_flow_paid, 0)) AS total_paid
-                    FROM installments i
-                    LEFT JOIN (
-                        SELECT
-                            installment_id,
-                            COALESCE(SUM(amount::double precision), 0) AS total_flow_paid,
-                            jsonb_agg(
-                                jsonb_build_object(
-                                    'id', id,
-                                    'amount', amount::double precision,
-                                    'time', time::text
-                                )
-                                ORDER BY time, id
-                            ) AS flow
-                        FROM installments_flow
-                        GROUP BY installment_id
-                    ) AS flow_data ON i.id = flow_data.installment_id
-                ) AS installments_data ON bills.id = installments_data.bill_id
-                    AND bills.store_id = installments_data.store_id
-                WHERE bills.id = %s
-                GROUP BY bills.id, bills.time, bills.discount,
-                    bills.total, bills.type, bills.note, bills.payments, bills.party_id, assosiated_parties.name,
-                    installments_data.installment_id, installments_data.paid,
-                    installments_data.installments_count, installments_data.installment_interval,
-                    installments_data.total_paid, installments_data.flow
-                """,
-                (bill_id,),
+            # The response is built from what was just written, not re-read
+            bill_result = _bill_response(
+                bill_row, inserted_lines, product_info, installment_details
             )
+            bill_result["batches"] = consumed_batches
 
-            bill_result = cur.fetchone()
+            response = {"message": "Bill added successfully", "bill": bill_result}
+            if idempotency_key:
+                response = save_idempotent_response(
+                    cur, store_id, idempotency_key, response
+                )
 
-        return {"message": "Bill added successfully", "bill": bill_result}
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         print("Error: %s", e)
         raise HTTPException(status_code=400, detail=str(e)) from e
 
 
+def _check_direct_sell_party(cur, party_id: int) -> None:
+    """Sell bills to other stores go through /admin/move-products"""
+    if _get_party_store_id(cur, party_id) is not None:
+        raise HTTPException(
+            status_code=400,
+            detail="Store parties are not allowed for direct sell bill creation",
+        )
+
+
 @app.post("/bill")
 def add_bill(
     bill: Bill,
@@ -2115,16 +2498,11 @@ def add_bill(
     installment_interval: Optional[int] = None,
     current_user: dict = Depends(get_current_user),
     background_tasks: BackgroundTasks = BackgroundTasks(),
+    idempotency_key: Optional[str] = Header(None),
 ):
     if move_type == "sell" and party_id is not None:
         with Database(HOST, DATABASE, USER, PASS) as cur:
-            party_store_id = _get_party_store_id(cur, party_id)
-
-        if party_store_id is not None:
-            raise HTTPException(
-                status_code=400,
-                detail="Store parties are not allowed for direct sell bill creation",
-            )
+            _check_direct_sell_party(cur, party_id)
 
     return _add_bill_internal(
         bill=bill,
@@ -2136,9 +2514,102 @@ def add_bill(
         installment_interval=installment_interval,
         current_user=current_user,
         background_tasks=background_tasks,
+        idempotency_key=idempotency_key,
     )
 
 
+BULK_BILLS_MAX = 1000
+
+
+@app.post("/bills/bulk")
+def add_bills_bulk(
+    bills: List[BulkBill],
+    store_id: int,
+    chunk_size: int = 100,
+    current_user: dict = Depends(get_current_user),
+    background_tasks: BackgroundTasks = BackgroundTasks(),
+):
+    """
+    Add bills queued by an offline terminal, in order.
+
+    Every bill goes through the same path as POST /bill (payments, batches,
+    reservations, installments, idempotency keys), but a chunk of bills
+    shares one transaction and one commit. Each bill runs in a savepoint, so
+    a failing bill is rolled back alone and reported in its result while
+    the rest of the chunk is kept.
+
+    Args:
+        bills (List[BulkBill]): The bills with their POST /bill parameters
+        store_id (int): The store ID
+        chunk_size (int): Bills per transaction
+
+    Returns:
+        Dict: One result per bill, in order: status 200 with the bill, or
+            the error status and detail
+    """
+    if len(bills) > BULK_BILLS_MAX:
+        raise HTTPException(
+            status_code=413, detail=f"At most {BULK_BILLS_MAX} bills per request"
+        )
+    chunk_size = max(1, chunk_size)
+
+    results = []
+    try:
+        for start in range(0, len(bills), chunk_size):
+            with Database(HOST, DATABASE, USER, PASS) as cur:
+                for index, item in enumerate(
+                    bills[start : start + chunk_size], start=start
+                ):
+                    # Notifications only for bills that were kept
+                    bill_tasks = BackgroundTasks()
+                    cur.execute("SAVEPOINT bulk_bill")
+                    try:
+                        if item.move_type == "sell" and item.party_id is not None:
+                            _check_direct_sell_party(cur, item.party_id)
+                        response = _add_bill_internal(
+                            bill=item.bill,
+                            move_type=item.move_type,
+                            store_id=store_id,
+                            party_id=item.party_id,
+                            paid=item.paid,
+                            installments=item.installments,
+                            installment_interval=item.installment_interval,
+                            current_user=current_user,
+                            background_tasks=bill_tasks,
+                            idempotency_key=item.idempotency_key,
+                            cur=cur,
+                        )
+                    except HTTPException as e:
+                        cur.execute("ROLLBACK TO SAVEPOINT bulk_bill")
+                        results.append(
+                            {"index": index, "status": e.status_code, "detail": e.detail}
+                        )
+                        continue
+                    cur.execute("RELEASE SAVEPOINT bulk_bill")
+                    background_tasks.tasks.extend(bill_tasks.tasks)
+                    results.append(
+                        {"index": index, "status": 200, "bill": response["bill"]}
+                    )
+    except Exception as e:
+        # A failed commit loses the whole chunk: report what was committed
+        logging.error(f"Error: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": str(e),
+                "committed": [
+                    r["index"] for r in results[: start] if r["status"] == 200
+                ],
+            },
+        ) from e
+
+    failed = sum(1 for r in results if r["status"] != 200)
+    return {
+        "message": f"{len(results) - failed} bills added, {failed} failed",
+        "results": results,
+    }
+
+
 @app.post("/admin/move-products")
 def move_products(
     bill: Bill,
@@ -2149,6 +2620,7 @@ def move_products(
     destination_payment_method_id: Optional[int] = None,
     settle_from_debt: bool = False,
     current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None),
 ):
     """
     Move products from one store to another by
@@ -2162,6 +2634,11 @@ def move_products(
         destination_store_id (int): The destination store ID
         background_tasks (BackgroundTasks): Background tasks handler
         current_user (dict): Current authenticated user (required)
+        idempotency_key (Optional[str]): Key of the source store. The move
+            commits in several steps, so the key is claimed up front; a
+            retry while it runs gets 409. It is released if the move fails
+            before the source bill commits, and kept otherwise so that a
+            half-done move is never repeated
 
     Returns:
         Dict: A message indicating the result of the operation
@@ -2170,6 +2647,24 @@ def move_products(
         raise HTTPException(
             status_code=400, detail="لا يمكن نقل المنتجات لنفس المتجر"
         )
+    if idempotency_key:
+        with Database(HOST, DATABASE, USER, PASS) as cur:
+            replay = claim_idempotency_key(
+                cur,
+                source_store_id,
+                idempotency_key,
+                "move-products",
+                request_fingerprint(
+                    bill,
+                    destination_store_id,
+                    source_payment_method_id,
+                    destination_payment_method_id,
+                    settle_from_debt,
+                ),
+            )
+        if replay is not None:
+            return replay
+    bills_written = False
     try:
         with Database(HOST, DATABASE, USER, PASS) as cur:
             # Get store information for notifications
@@ -2478,6 +2973,9 @@ def move_products(
             current_user=current_user,
             forward_off_store=False,
         )
+        # The source bill is committed from here on: keep the key if a later
+        # step fails, so a retry cannot sell the products a second time
+        bills_written = True
 
         # Add buy bill to destination store (with source store as party)
         destination_bill_result = _add_bill_internal(
@@ -2571,11 +3069,21 @@ def move_products(
                     f"📥 <b>منتجات مستلمة</b>\n\n{transfer_message}",
                 )
 
-        return {"message": "Products moved successfully"}
+        response = {"message": "Products moved successfully"}
+        if idempotency_key:
+            with Database(HOST, DATABASE, USER, PASS) as cur:
+                response = save_idempotent_response(
+                    cur, source_store_id, idempotency_key, response
+                )
+        return response
     except HTTPException:
+        if idempotency_key and not bills_written:
+            release_idempotency_key(source_store_id, idempotency_key)
         raise
     except Exception as e:
         print(f"Error: {e}")
+        if idempotency_key and not bills_written:
+            release_idempotency_key(source_store_id, idempotency_key)
         raise HTTPException(status_code=400, detail=str(e)) from e
 
 
@@ -2723,38 +3231,85 @@ def get_cash_flow(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     party_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
 ) -> JSONResponse:
     """
     Get all cash flow records from the database
 
+    Args:
+        limit (int): Records per page, newest first (at most 500). Without
+            it, every record of the range is returned.
+        cursor (str): X-Next-Cursor of the previous page
+
     Returns:
         List[Dict]: A list of dictionaries containing the cash flow records
 
     """
 
+    limit = page_size(limit)
+    keyset, keyset_params = keyset_condition(cursor, "time", "id")
     extra_condition = ""
     params: tuple = (
+        store_id,
         start_date if start_date else "1970-01-01",
         end_date if end_date else datetime.now().isoformat(),
-        store_id,
     )
     if party_id:
         extra_condition = "AND party_id = %s"
-        params = (
-            start_date if start_date else "1970-01-01",
-            end_date if end_date else datetime.now().isoformat(),
-            store_id,
-            party_id,
-        )
+        params = params + (party_id,)
+    params = params + tuple(keyset_params) + (store_id, store_id, store_id)
 
     try:
         with Database(HOST, DATABASE, USER, PASS) as cur:
+            # The running total is not stored. The page is picked on the
+            # (store_id, time, id) index first; its oldest row's total before
+            # (latest daily checkpoint plus the rows after it) plus a running
+            # sum over the store's rows up to the newest row gives the totals.
+            # The store's rows are summed whatever the party filter, so totals
+            # stay store-wide.
             cur.execute(
-                f"""SELECT
-                    TO_CHAR(time, 'YYYY-MM-DD HH24:MI:SS') AS time,
+                f"""WITH page AS (
+                    SELECT id, time
+                    FROM cash_flow
+                    WHERE store_id = %s
+                    AND time >= %s
+                    AND time <= %s
+                    {extra_condition}
+                    {keyset}
+                    ORDER BY time DESC, id DESC
+                    {limit_clause(limit)}
+                ), oldest AS (
+                    SELECT id, time FROM page ORDER BY time, id LIMIT 1
+                ), newest AS (
+                    SELECT id, time FROM page ORDER BY time DESC, id DESC LIMIT 1
+                ), base AS MATERIALIZED (
+                    SELECT
+                        oldest.id,
+                        oldest.time,
+                        cash_flow_total_before(%s, oldest.time) + COALESCE((
+                            SELECT SUM(amount)
+                            FROM cash_flow c
+                            WHERE c.store_id = %s
+                            AND c.time = oldest.time
+                            AND c.id < oldest.id
+                        ), 0) AS total_before
+                    FROM oldest
+                ), flow AS (
+                    SELECT
+                        cash_flow.*,
+                        base.total_before
+                            + SUM(COALESCE(amount, 0)) OVER (ORDER BY cash_flow.time, cash_flow.id) AS total
+                    FROM cash_flow, base, newest
+                    WHERE cash_flow.store_id = %s
+                    AND (cash_flow.time, cash_flow.id) >= (base.time, base.id)
+                    AND (cash_flow.time, cash_flow.id) <= (newest.time, newest.id)
+                )
+                SELECT
+                    TO_CHAR(flow.time, 'YYYY-MM-DD HH24:MI:SS') AS time,
                     amount,
-                    cash_flow.type,
+                    flow.type,
                     description,
                     total,
                     assosiated_parties.name AS party_name,
@@ -2765,21 +3320,21 @@ def get_cash_flow(
                         )
                         FROM account_transactions at
                         JOIN payment_methods pm ON pm.id = at.payment_method_id
-                        WHERE at.cash_flow_id = cash_flow.id
-                          AND at.store_id = cash_flow.store_id
-                    ), '[]'::jsonb) AS accounts
-                FROM cash_flow
-                LEFT JOIN assosiated_parties ON cash_flow.party_id = assosiated_parties.id
-                WHERE time >= %s
-                AND time <= %s
-                AND store_id = %s
-                {extra_condition}
-                ORDER BY cash_flow.time DESC, cash_flow.id DESC
+                        WHERE at.cash_flow_id = flow.id
+                          AND at.store_id = flow.store_id
+                    ), '[]'::jsonb) AS accounts,
+                    flow.time AS cursor_time,
+                    flow.id AS cursor_id
+                FROM flow
+                JOIN page ON page.id = flow.id
+                LEFT JOIN assosiated_parties ON flow.party_id = assosiated_parties.id
+                ORDER BY flow.time DESC, flow.id DESC
                 """,
                 params,
             )
             cash_flow = cur.fetchall()
-            return JSONResponse(content=cash_flow, status_code=200)
+            headers = cursor_headers(next_cursor(cash_flow, limit))
+            return JSONResponse(content=cash_flow, status_code=200, headers=headers)
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=400, detail=str(e)) from e
@@ -2796,6 +3351,7 @@ def add_cash_flow(
     payment_method_id: Optional[int] = None,
     counterpart_payment_method_id: Optional[int] = None,
     current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None),
 ):
     """
     Add a cash flow record to the database
@@ -2810,6 +3366,25 @@ def add_cash_flow(
     """
     try:
         with Database(HOST, DATABASE, USER, PASS) as cur:
+            if idempotency_key:
+                replay = claim_idempotency_key(
+                    cur,
+                    store_id,
+                    idempotency_key,
+                    "cash-flow",
+                    request_fingerprint(
+                        amount,
+                        move_type,
+                        description,
+                        party_id,
+                        time,
+                        payment_method_id,
+                        counterpart_payment_method_id,
+                    ),
+                )
+                if replay is not None:
+                    return replay
+
             current_time = time or datetime.now().isoformat()
             signed_amount = amount if move_type == "in" else -amount
 
@@ -2855,7 +3430,14 @@ def add_cash_flow(
                     ),
                 )
 
-            return {"message": "Cash flow record added successfully"}
+            response = {"message": "Cash flow record added successfully"}
+            if idempotency_key:
+                response = save_idempotent_response(
+                    cur, store_id, idempotency_key, response
+                )
+            return response
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=400, detail=str(e)) from e
@@ -2900,7 +3482,7 @@ def store_transfer(
 
 
 # The latest DB schema version this backend expects (bump with each update_db_N).
-LATEST_DB_VERSION = 23
+LATEST_DB_VERSION = 38
 
 
 @app.get("/db-version")
@@ -2929,6 +3511,92 @@ def db_version(current_user: dict = Depends(get_current_user)):
     return {"current": current_version, "latest": LATEST_DB_VERSION}
 
 
+@app.get("/db-pool")
+def db_pool(current_user: dict = Depends(get_current_user)):
+    """
+    Connection pool stats for this worker: size, idle / in-use connections,
+    waiting requests, checkout counts and wait times.
+    """
+    return {"pools": pool_stats()}
+
+
+async def _metrics_reader(
+    authorization: Optional[str] = Header(None),
+    access_token: Optional[str] = Cookie(None),
+):
+    """A logged-in user, or a scraper sending `Authorization: Bearer METRICS_TOKEN`"""
+    if METRICS_TOKEN and hmac.compare_digest(
+        (authorization or "").encode(), f"Bearer {METRICS_TOKEN}".encode()
+    ):
+        return None
+    return await get_current_user(access_token)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics(current_user: Optional[dict] = Depends(_metrics_reader)):
+    """
+    Prometheus scrape endpoint: per-route latency histograms, statements per
+    request, DB time and pool gauges. No SQL text is exposed here. Needs a
+    login session or the METRICS_TOKEN bearer token.
+    """
+    return PlainTextResponse(
+        render_prometheus(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/admin/metrics")
+def admin_metrics(current_user: dict = Depends(get_current_user)):
+    """
+    Per-route latency (avg / p50 / p95 / p99), statements and DB time per
+    request and the slowest statement seen, slowest routes first.
+    """
+    return metrics_snapshot()
+
+
+@app.get("/admin/slow-queries")
+def admin_slow_queries(
+    limit: int = 50,
+    endpoint: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Worst statements recorded by the slow-query log (enable with SLOW_QUERY_MS),
+    grouped by statement with their latest EXPLAIN (ANALYZE, BUFFERS) plan.
+    """
+    try:
+        return {
+            "status": slow_query_log_status(),
+            "queries": list_slow_queries(limit, endpoint),
+        }
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+@app.delete("/admin/slow-queries")
+def admin_clear_slow_queries(current_user: dict = Depends(get_current_user)):
+    """Empty the slow-query log."""
+    try:
+        clear_slow_queries()
+        return {"message": "Slow query log cleared"}
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+@app.get("/admin/background-jobs")
+def admin_background_jobs(current_user: dict = Depends(get_current_user)):
+    """
+    Background job leadership: this worker's role and the worker that currently
+    holds the leader lock.
+    """
+    try:
+        return {"worker": leader_status(), "leader": current_leader()}
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
 @app.get("/current-shift")
 def current_shift(
     store_id: int,
@@ -3100,28 +3768,37 @@ def shift_total(
             # bills) plus each account's current balance. This surfaces money that
             # hit an account from non-bill sources (deposits, inter-store
             # repayments, transfers...) and lets the user compare the expected
-            # balance against the real one.
+            # balance against the real one. Balances come from account_balances.
             cur.execute(
                 """
-                SELECT
-                    pm.id,
-                    pm.name,
-                    COALESCE(SUM(at.amount) FILTER (WHERE at.time >= %s), 0) AS shift_total,
-                    COALESCE(SUM(at.amount), 0) AS balance
-                FROM payment_methods pm
-                LEFT JOIN account_transactions at
-                    ON at.payment_method_id = pm.id AND at.store_id = %s
-                WHERE pm.is_deleted = FALSE
-                   OR EXISTS (
-                        SELECT 1 FROM account_transactions at2
-                        WHERE at2.payment_method_id = pm.id AND at2.store_id = %s
-                   )
-                GROUP BY pm.id, pm.name, pm.is_default
-                HAVING COALESCE(SUM(at.amount), 0) <> 0
-                    OR COALESCE(SUM(at.amount) FILTER (WHERE at.time >= %s), 0) <> 0
-                ORDER BY pm.is_default DESC, pm.id ASC
+                SELECT *
+                FROM (
+                    SELECT
+                        pm.id,
+                        pm.name,
+                        pm.is_default,
+                        COALESCE((
+                            SELECT SUM(at.amount)
+                            FROM account_transactions at
+                            WHERE at.store_id = %s
+                              AND at.payment_method_id = pm.id
+                              AND at.time >= %s
+                        ), 0) AS shift_total,
+                        COALESCE(ab.balance, 0) AS balance
+                    FROM payment_methods pm
+                    LEFT JOIN (
+                        SELECT payment_method_id, SUM(balance) AS balance
+                        FROM account_balances
+                        WHERE store_id = %s
+                        GROUP BY payment_method_id
+                    ) ab ON ab.payment_method_id = pm.id
+                    WHERE pm.is_deleted = FALSE
+                       OR ab.payment_method_id IS NOT NULL
+                ) accounts
+                WHERE balance <> 0 OR shift_total <> 0
+                ORDER BY is_default DESC, id ASC
                 """,
-                (shift_start_time, store_id, store_id, shift_start_time),
+                (store_id, shift_start_time, store_id),
             )
             account_breakdown = [
                 {
@@ -3178,6 +3855,9 @@ def shift_total(
 
 
 def generate_xlsx(data):
+    # openpyxl is only needed for exports; importing it here keeps startup fast
+    from openpyxl import Workbook
+
     # Create an in-memory output file for the new workbook
     output = io.BytesIO()
 
@@ -3206,7 +3886,7 @@ def generate_xlsx(data):
 
 
 @app.get("/backup")
-async def backup(current_user: dict = Depends(get_current_user)):
+def backup(current_user: dict = Depends(get_current_user)):
     """
     Backs up everything in the database as a save point to restore later
     """
@@ -3234,7 +3914,7 @@ async def backup(current_user: dict = Depends(get_current_user)):
 
 
 @app.post("/restore")
-async def restore(
+def restore(
     file: UploadFile = File(...), current_user: dict = Depends(get_current_user)
 ):
     """
@@ -3244,7 +3924,7 @@ async def restore(
 
     try:
         reset_db()
-        fileBytes = await file.read()
+        fileBytes = file.file.read()
         restore_path = os.path.join(tempfile.gettempdir(), "openstore_restore.sql")
         with open(restore_path, "wb") as f:
             f.write(fileBytes)
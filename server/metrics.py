@@ -0,0 +1,393 @@
+"""
+Request and query latency metrics.
+
+MetricsMiddleware times every HTTP request per route template (e.g.
+`GET /party/{party_id}/bills`). A query observer on the shared DB layer counts
+the statements each request runs, their total time and the slowest one.
+
+Exposed as Prometheus text on GET /metrics and as JSON (with p50/p95/p99 over
+the most recent METRICS_SAMPLE_SIZE requests per route, default 1000) on
+GET /admin/metrics.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from os import getenv
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from database import add_query_observer, pool_stats
+
+load_dotenv()
+
+METRICS_SAMPLE_SIZE = int(getenv("METRICS_SAMPLE_SIZE") or 1000)
+
+# Histogram bucket upper bounds in seconds (Prometheus client defaults)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Statements longer than this are truncated in the JSON output
+MAX_STATEMENT_LENGTH = 500
+
+
+class QueryStats:
+    "Statements run while serving one request"
+
+    __slots__ = ("scope", "count", "total_time", "slowest_time", "slowest_query")
+
+    def __init__(self, scope=None):
+        self.scope = scope
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_query: Optional[str] = None
+
+    def record(self, query, duration: float) -> None:
+        self.count += 1
+        self.total_time += duration
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_query = query
+
+
+_current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar(
+    "current_query_stats", default=None
+)
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    """Query stats of the request being served, if any."""
+    return _current_query_stats.get()
+
+
+def current_endpoint() -> Optional[str]:
+    """'METHOD /route/{template}' of the request being served, if any."""
+    stats = _current_query_stats.get()
+    if stats is None or stats.scope is None:
+        return None
+    return f"{stats.scope['method']} {_route_template(stats.scope)}"
+
+
+def _statement_text(query) -> str:
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    text = " ".join(str(query).split())
+    if len(text) > MAX_STATEMENT_LENGTH:
+        text = text[:MAX_STATEMENT_LENGTH] + "..."
+    return text
+
+
+class Histogram:
+    "Cumulative-bucket histogram (Prometheus semantics)"
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total = 0
+        out = []
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            out.append((_format_number(bound), total))
+        out.append(("+Inf", self.count))
+        return out
+
+
+class RouteMetrics:
+    "Aggregated metrics of one method + route template"
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.db_time = 0.0
+        self.statuses: Dict[int, int] = {}
+        self.max_queries = 0
+        self.slowest_query_time = 0.0
+        self.slowest_query: Optional[str] = None
+        self.samples: Deque[float] = deque(maxlen=METRICS_SAMPLE_SIZE)
+
+    def observe(self, status: int, duration: float, stats: QueryStats) -> None:
+        self.latency.observe(duration)
+        self.samples.append(duration)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.queries.observe(stats.count)
+        self.db_time += stats.total_time
+        self.max_queries = max(self.max_queries, stats.count)
+        if stats.slowest_time > self.slowest_query_time:
+            self.slowest_query_time = stats.slowest_time
+            self.slowest_query = _statement_text(stats.slowest_query)
+
+
+_lock = threading.Lock()
+_routes: Dict[Tuple[str, str], RouteMetrics] = {}
+# Statements run outside any request (schedulers, Telegram worker, ...)
+_background_queries = {"count": 0, "total_time": 0.0}
+_started_at = time.time()
+
+
+def _observe_query(cursor, query, params, duration: float, many: bool) -> None:
+    stats = _current_query_stats.get()
+    if stats is not None:
+        stats.record(query, duration)
+    else:
+        with _lock:
+            _background_queries["count"] += 1
+            _background_queries["total_time"] += duration
+
+
+add_query_observer(_observe_query)
+
+
+def _record_request(
+    method: str, route: str, status: int, duration: float, stats: QueryStats
+) -> None:
+    with _lock:
+        metrics = _routes.get((method, route))
+        if metrics is None:
+            metrics = _routes[(method, route)] = RouteMetrics()
+        metrics.observe(status, duration, stats)
+
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return path
+    # Unmatched paths (404s, static files) are folded into one series so
+    # arbitrary URLs cannot blow up the number of series.
+    return "<unmatched>"
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware buffering). Latency is
+    measured until the last response body chunk is sent, so background tasks
+    that run after the response are not counted against the endpoint.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(scope)
+        token = _current_query_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+        recorded = False
+
+        def record() -> None:
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            _record_request(
+                scope["method"],
+                _route_template(scope),
+                status,
+                time.perf_counter() - started,
+                stats,
+            )
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                record()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record()
+            _current_query_stats.reset(token)
+
+
+def _percentile(sorted_samples: List[float], pct: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(pct / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def _format_number(value: float) -> str:
+    if float(value).is_integer():
+        return f"{value:.1f}" if isinstance(value, float) else str(value)
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def metrics_snapshot() -> Dict[str, Any]:
+    """JSON-friendly view of all route metrics, slowest p95 first."""
+    with _lock:
+        items = [
+            (
+                method,
+                route,
+                m.latency.count,
+                m.latency.sum,
+                dict(m.statuses),
+                sorted(m.samples),
+                m.queries.sum,
+                m.db_time,
+                m.max_queries,
+                m.slowest_query_time,
+                m.slowest_query,
+            )
+            for (method, route), m in _routes.items()
+        ]
+        background = dict(_background_queries)
+
+    routes = []
+    for (
+        method,
+        route,
+        count,
+        total,
+        statuses,
+        samples,
+        queries,
+        db_time,
+        max_queries,
+        slowest_time,
+        slowest_query,
+    ) in items:
+        routes.append(
+            {
+                "method": method,
+                "route": route,
+                "requests": count,
+                "errors": sum(n for code, n in statuses.items() if code >= 500),
+                "statuses": {str(code): n for code, n in sorted(statuses.items())},
+                "latency_ms": {
+                    "avg": round(total / count * 1000, 3) if count else 0.0,
+                    "p50": round(_percentile(samples, 50) * 1000, 3),
+                    "p95": round(_percentile(samples, 95) * 1000, 3),
+                    "p99": round(_percentile(samples, 99) * 1000, 3),
+                    "max": round(samples[-1] * 1000, 3) if samples else 0.0,
+                },
+                "queries_per_request": {
+                    "avg": round(queries / count, 2) if count else 0.0,
+                    "max": max_queries,
+                },
+                "db_time_ms_per_request": (
+                    round(db_time / count * 1000, 3) if count else 0.0
+                ),
+                "slowest_query": {
+                    "ms": round(slowest_time * 1000, 3),
+                    "statement": slowest_query,
+                },
+            }
+        )
+    routes.sort(key=lambda r: r["latency_ms"]["p95"], reverse=True)
+
+    return {
+        "uptime_seconds": round(time.time() - _started_at, 1),
+        "sample_size": METRICS_SAMPLE_SIZE,
+        "routes": routes,
+        "background_queries": {
+            "count": background["count"],
+            "total_time_ms": round(background["total_time"] * 1000, 3),
+        },
+        "pools": pool_stats(),
+    }
+
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+
+    with _lock:
+        routes = sorted(_routes.items())
+        background = dict(_background_queries)
+
+        lines.append("# HELP http_request_duration_seconds Request latency per route.")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for (method, route), m in routes:
+            labels = f'method="{method}",route="{_escape_label(route)}"'
+            for le, count in m.latency.cumulative():
+                lines.append(
+                    f'http_request_duration_seconds_bucket{{{labels},le="{le}"}} {count}'
+                )
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {m.latency.sum}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {m.latency.count}")
+
+        lines.append("# HELP http_requests_total Requests per route and status code.")
+        lines.append("# TYPE http_requests_total counter")
+        for (method, route), m in routes:
+            labels = f'method="{method}",route="{_escape_label(route)}"'
+            for code, count in sorted(m.statuses.items()):
+                lines.append(f'http_requests_total{{{labels},status="{code}"}} {count}')
+
+        lines.append("# HELP db_queries_per_request Statements executed per request.")
+        lines.append("# TYPE db_queries_per_request histogram")
+        for (method, route), m in routes:
+            labels = f'method="{method}",route="{_escape_label(route)}"'
+            for le, count in m.queries.cumulative():
+                lines.append(f'db_queries_per_request_bucket{{{labels},le="{le}"}} {count}')
+            lines.append(f"db_queries_per_request_sum{{{labels}}} {m.queries.sum}")
+            lines.append(f"db_queries_per_request_count{{{labels}}} {m.queries.count}")
+
+        lines.append("# HELP db_query_seconds_total Time spent in the database per route.")
+        lines.append("# TYPE db_query_seconds_total counter")
+        for (method, route), m in routes:
+            labels = f'method="{method}",route="{_escape_label(route)}"'
+            lines.append(f"db_query_seconds_total{{{labels}}} {m.db_time}")
+
+        lines.append("# HELP db_slowest_query_seconds Slowest single statement seen per route.")
+        lines.append("# TYPE db_slowest_query_seconds gauge")
+        for (method, route), m in routes:
+            labels = f'method="{method}",route="{_escape_label(route)}"'
+            lines.append(f"db_slowest_query_seconds{{{labels}}} {m.slowest_query_time}")
+
+    lines.append("# HELP db_background_queries_total Statements run outside requests.")
+    lines.append("# TYPE db_background_queries_total counter")
+    lines.append(f"db_background_queries_total {background['count']}")
+    lines.append("# HELP db_background_query_seconds_total Time of statements run outside requests.")
+    lines.append("# TYPE db_background_query_seconds_total counter")
+    lines.append(f"db_background_query_seconds_total {background['total_time']}")
+
+    pool_gauges = (
+        ("size", "gauge", "Open connections."),
+        ("idle", "gauge", "Idle connections."),
+        ("in_use", "gauge", "Checked-out connections."),
+        ("waiting", "gauge", "Threads waiting for a connection."),
+        ("checkouts", "counter", "Connection checkouts."),
+        ("timeouts", "counter", "Checkouts that timed out."),
+        ("wait_time_total", "counter", "Seconds spent waiting for a connection."),
+    )
+    pools = pool_stats()
+    for key, kind, help_text in pool_gauges:
+        name = f"db_pool_{key}" if kind == "gauge" else f"db_pool_{key}_total"
+        if key == "wait_time_total":
+            name = "db_pool_wait_seconds_total"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for pool in pools:
+            labels = f'database="{_escape_label(str(pool["database"]))}"'
+            lines.append(f"{name}{{{labels}}} {pool[key]}")
+
+    return "\n".join(lines) + "\n"
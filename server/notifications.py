@@ -8,12 +8,19 @@ from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from datetime import datetime
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 from os import getenv
 
 from auth_middleware import get_current_user
+from database import Database, connect
+from pagination import (
+    cursor_headers,
+    keyset_condition,
+    limit_clause,
+    next_cursor,
+    page_size,
+)
 
 load_dotenv()
 
@@ -42,42 +49,12 @@ class NotificationUpdate(BaseModel):
     content: Optional[str] = None
 
 
-class Database:
-    """Database context manager to handle the connection and cursor"""
-
-    def __init__(self, host, database, user, password, real_dict_cursor=True):
-        self.host = host
-        self.database = database
-        self.user = user
-        self.password = password
-        self.real_dict_cursor = real_dict_cursor
-        self.conn = psycopg2.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password,
-        )
-        self.cursor = self.conn.cursor(
-            cursor_factory=RealDictCursor if self.real_dict_cursor else None
-        )
-
-    def __enter__(self):
-        return self.cursor
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is not None:
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-        self.cursor.close()
-        self.conn.close()
-
-
 @router.get("/notifications")
 def get_notifications(
     store_id: int,
     include_read: bool = True,
     limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
 ):
     """
@@ -86,16 +63,19 @@ def get_notifications(
     Args:
         store_id: The store ID to get notifications for
         include_read: Whether to include read notifications (default: True)
-        limit: Optional limit on number of notifications to return
+        limit: Optional page size, newest first (at most 500)
+        cursor: next_cursor of the previous page
 
     Returns:
-        Dict containing notifications list and unread count
+        Dict containing notifications list, unread count and next_cursor
+        (None on the last page)
     """
+    limit = page_size(limit)
+    keyset, keyset_params = keyset_condition(cursor, "created_at", "id")
     try:
         with Database(HOST, DATABASE, USER, PASS) as cur:
             # Build query based on filters
             read_filter = "" if include_read else "AND is_read = FALSE"
-            limit_clause = f"LIMIT {limit}" if limit else ""
 
             cur.execute(
                 f"""
@@ -109,17 +89,21 @@ def get_notifications(
                     is_read,
                     read_at,
                     created_at,
-                    updated_at
+                    updated_at,
+                    created_at AS cursor_time,
+                    id AS cursor_id
                 FROM notifications
                 WHERE store_id = %s
                 AND deleted_at IS NULL
                 {read_filter}
-                ORDER BY created_at DESC
-                {limit_clause}
+                {keyset}
+                ORDER BY created_at DESC, id DESC
+                {limit_clause(limit)}
                 """,
-                (store_id,),
+                (store_id, *keyset_params),
             )
             notifications = cur.fetchall()
+            cursor = next_cursor(notifications, limit)
 
             # Convert datetime objects to ISO format strings
             for notif in notifications:
@@ -145,7 +129,12 @@ def get_notifications(
             unread_count = unread_result["unread_count"] if unread_result else 0
 
             return JSONResponse(
-                content={"notifications": notifications, "unread_count": unread_count}
+                content={
+                    "notifications": notifications,
+                    "unread_count": unread_count,
+                    "next_cursor": cursor,
+                },
+                headers=cursor_headers(cursor),
             )
 
     except Exception as e:
@@ -436,7 +425,7 @@ def upsert_expiration_notification(
 {chr(10).join(batch_details)}"""
 
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+        conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         # Check if notification exists
@@ -492,7 +481,7 @@ def remove_expiration_notification(store_id: int, product_id: int):
         product_id: The product ID (reference_id)
     """
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+        conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
         cur = conn.cursor()
 
         cur.execute(
@@ -531,7 +520,7 @@ def create_low_stock_notification(
         return
 
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+        conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         for product in products_below_zero:
@@ -609,7 +598,7 @@ def create_due_installments_notification(
         return
 
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+        conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         for installment in due_installments:
@@ -0,0 +1,78 @@
+"""
+Keyset (cursor) pagination for the history lists: bills, cash flow, party
+bills, collections and notifications.
+
+A page is asked for with ?limit=N (at most MAX_PAGE_SIZE) and continued with
+?cursor=<next_cursor of the previous page>. Rows come newest first, ordered by
+(time, id), and the cursor is the (time, id) of the last row of a page, so the
+next page starts strictly after it: rows added meanwhile never shift a page
+the way OFFSET would, and each page is a range read of the (store_id, time)
+index instead of a scan from 1970.
+
+Lists keep their JSON body and send the cursor in the X-Next-Cursor header.
+It is absent on the last page. Without limit, the endpoints return the whole
+range as before.
+"""
+
+import base64
+import binascii
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+
+MAX_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def page_size(limit: Optional[int]) -> Optional[int]:
+    """The requested page size, capped; None for the whole range"""
+    if limit is None:
+        return None
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def encode_cursor(time: datetime, row_id: int) -> str:
+    raw = f"{time.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        time, row_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(time), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+
+def keyset_condition(cursor: Optional[str], time_column: str, id_column: str) -> Tuple[str, list]:
+    """
+    SQL condition for the rows after the cursor, newest first, and its
+    params. Empty when there is no cursor.
+    """
+    if not cursor:
+        return "", []
+    return f"AND ({time_column}, {id_column}) < (%s, %s)", list(decode_cursor(cursor))
+
+
+def limit_clause(limit: Optional[int]) -> str:
+    return f"LIMIT {limit}" if limit else ""
+
+
+def next_cursor(rows: list, limit: Optional[int]) -> Optional[str]:
+    """
+    Cursor after a page whose rows carry cursor_time and cursor_id, which
+    are removed from the rows. None when the page was not full.
+    """
+    cursor = None
+    if limit and len(rows) >= limit:
+        cursor = encode_cursor(rows[-1]["cursor_time"], rows[-1]["cursor_id"])
+    for row in rows:
+        row.pop("cursor_time", None)
+        row.pop("cursor_id", None)
+    return cursor
+
+
+def cursor_headers(cursor: Optional[str]) -> dict:
+    return {NEXT_CURSOR_HEADER: cursor} if cursor else {}
@@ -1,7 +1,6 @@
-from fastapi import HTTPException, Depends
+from fastapi import HTTPException, Depends, Header, Response
 from fastapi.responses import JSONResponse
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from database import Database
 from pydantic import BaseModel
 from datetime import datetime
 import logging
@@ -11,6 +10,14 @@ from fastapi import APIRouter
 from typing import Optional
 import json
 from auth_middleware import get_current_user
+from etags import etag_matches, not_modified, tables_etag, with_etag
+from pagination import (
+    cursor_headers,
+    keyset_condition,
+    limit_clause,
+    next_cursor,
+    page_size,
+)
 
 load_dotenv()
 
@@ -37,35 +44,6 @@ logging.basicConfig(
 )
 
 
-class Database:
-    "Database context manager to handle the connection and cursor"
-
-    def __init__(self, host, database, user, password, real_dict_cursor=True):
-        self.host = host
-        self.database = database
-        self.user = user
-        self.password = password
-        self.real_dict_cursor = real_dict_cursor
-
-    def __enter__(self):
-        self.conn = psycopg2.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password,
-        )
-        return self.conn.cursor(
-            cursor_factory=RealDictCursor if self.real_dict_cursor else None
-        )
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is not None:
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-        self.conn.close()
-
-
 class Party(BaseModel):
     name: str
     phone: str
@@ -76,7 +54,7 @@ class Party(BaseModel):
 
 
 @router.get("/party/barcode")
-async def get_party_bar_code(current_user: dict = Depends(get_current_user)) -> str:
+def get_party_bar_code(current_user: dict = Depends(get_current_user)) -> str:
     """
     Get the next available client barcode.
     Format: CL + 10 digit zero-padded number (e.g., CL0000000001)
@@ -102,7 +80,7 @@ async def get_party_bar_code(current_user: dict = Depends(get_current_user)) ->
 
 
 @router.get("/party/by-barcode/{barcode}")
-async def get_party_by_barcode(
+def get_party_by_barcode(
     barcode: str,
     current_user: dict = Depends(get_current_user),
 ) -> JSONResponse:
@@ -128,16 +106,22 @@ async def get_party_by_barcode(
 
 
 @router.get("/parties")
-async def get_parties(current_user: dict = Depends(get_current_user)) -> JSONResponse:
+def get_parties(
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+) -> JSONResponse:
     with Database(HOST, DATABASE, USER, PASS) as cur:
+        etag = tables_etag(cur, "assosiated_parties")
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
         cur.execute("""
         SELECT id, name, phone, address, type, extra_info, bar_code FROM assosiated_parties
         """)
-        return JSONResponse(content=cur.fetchall())
+        return with_etag(cur.fetchall(), etag)
 
 
 @router.post("/party")
-async def add_party(
+def add_party(
     party: Party, current_user: dict = Depends(get_current_user)
 ) -> JSONResponse:
     with Database(HOST, DATABASE, USER, PASS) as cur:
@@ -166,7 +150,7 @@ async def add_party(
 
 
 @router.delete("/party")
-async def delete_party(
+def delete_party(
     party_id: int, current_user: dict = Depends(get_current_user)
 ) -> JSONResponse:
     with Database(HOST, DATABASE, USER, PASS) as cur:
@@ -182,7 +166,7 @@ async def delete_party(
 
 
 @router.put("/party")
-async def edit_party(
+def edit_party(
     party_id: int,
     party: Party,
     current_user: dict = Depends(get_current_user),
@@ -208,56 +192,81 @@ async def edit_party(
 
 
 @router.get("/party/{party_id}/bills")
-async def get_party_bills(
+def get_party_bills(
     party_id: int,
+    response: Response,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
 ) -> JSONResponse:
     """
     Get all bills from the database for a specific party
 
+    Args:
+        limit (int): Bills per page, newest first (at most 500). Without it,
+            every bill of the range is returned.
+        cursor (str): X-Next-Cursor of the previous page
+
     Returns:
         List[Dict]: A list of dictionaries containing the bills
 
     """
+    limit = page_size(limit)
+    keyset, keyset_params = keyset_condition(cursor, "bills.time", "bills.id")
     try:
         with Database(HOST, DATABASE, USER, PASS) as cur:
             cur.execute(
-                """
+                f"""
+                WITH page AS (
+                    SELECT bills.id, bills.store_id
+                    FROM bills
+                    WHERE bills.time >= %s
+                    AND bills.time <= %s
+                    AND bills.party_id = %s
+                    {keyset}
+                    ORDER BY bills.time DESC, bills.id DESC
+                    {limit_clause(limit)}
+                )
                 SELECT
                     bills.id,
                     bills.time,
                     bills.discount,
                     bills.total,
                     bills.type,
-                    json_agg(
-                        json_build_object(
-                            'id', products_flow.product_id,
-                            'name', products.name,
-                            'bar_code', products.bar_code,
-                            'amount', products_flow.amount,
-                            'wholesale_price', products_flow.wholesale_price,
-                            'price', products_flow.price
-                        )
-                    ) AS products
-                FROM bills
-                JOIN products_flow ON bills.id = products_flow.bill_id
-                JOIN products ON products_flow.product_id = products.id
-                WHERE bills.time >= %s
-                AND bills.time <= %s
-                AND bills.party_id = %s
+                    COALESCE(
+                        json_agg(
+                            json_build_object(
+                                'id', products_flow.product_id,
+                                'name', products.name,
+                                'bar_code', products.bar_code,
+                                'amount', products_flow.amount,
+                                'wholesale_price', products_flow.wholesale_price,
+                                'price', products_flow.price
+                            )
+                        ) FILTER (WHERE products_flow.product_id IS NOT NULL),
+                        '[]'::json
+                    ) AS products,
+                    bills.time AS cursor_time,
+                    bills.id AS cursor_id
+                FROM page
+                JOIN bills ON bills.id = page.id AND bills.store_id = page.store_id
+                LEFT JOIN products_flow ON bills.id = products_flow.bill_id
+                LEFT JOIN products ON products_flow.product_id = products.id
                 GROUP BY bills.id, bills.time, bills.discount,
                     bills.total, bills.type
-                ORDER BY bills.time DESC
+                ORDER BY bills.time DESC, bills.id DESC
                 """,
                 (
                     start_date if start_date else "1970-01-01",
                     end_date if end_date else datetime.now().isoformat(),
                     party_id,
+                    *keyset_params,
                 ),
             )
             bills = cur.fetchall()
+            response.headers.update(cursor_headers(next_cursor(bills, limit)))
             return bills
     except Exception as e:
         print(f"Error: {e}")
@@ -270,11 +279,19 @@ def get_parties_open_bills(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     party_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
 ) -> JSONResponse:
     """
     Get all bills details of parties that have open bills, grouped by collection_id
+
+    With limit (at most 500), one page of collections, ordered by their
+    newest bill in the range, newest first; cursor is the X-Next-Cursor of
+    the previous page. Without it, every collection, by party name.
     """
+    limit = page_size(limit)
+    keyset, keyset_params = keyset_condition(cursor, "b.time", "b.id")
     try:
         with Database(HOST, DATABASE, USER, PASS) as cur:
             # Build the query conditions
@@ -289,21 +306,44 @@ def get_parties_open_bills(
                 extra_condition = "AND ap.id = %s"
                 params.append(party_id)
 
-            # First, find collection_ids that have at least one bill in the date range
+            # First, find collection_ids that have at least one bill in the
+            # date range, keyed by their newest bill there: walking the
+            # store's bills newest first, a bill stands for its collection
+            # when no newer bill of the collection is in the range
             collections_with_bills_in_range_query = f"""
-                SELECT DISTINCT bc.collection_id
-                FROM bills_collections bc
-                JOIN bills b ON bc.bill_id = b.id AND bc.store_id = b.store_id
+                SELECT bc.collection_id, b.time AS cursor_time, b.id AS cursor_id
+                FROM bills b
+                JOIN bills_collections bc ON bc.bill_id = b.id AND bc.store_id = b.store_id
                 JOIN assosiated_parties ap ON bc.party_id = ap.id
                 WHERE b.time >= %s
                 AND b.time <= %s
-                AND bc.store_id = %s
+                AND b.store_id = %s
                 AND b.id > 0
                 {extra_condition}
+                {keyset}
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM bills_collections newer_bc
+                    JOIN bills newer
+                        ON newer.id = newer_bc.bill_id
+                        AND newer.store_id = newer_bc.store_id
+                    WHERE newer_bc.collection_id = bc.collection_id
+                    AND newer_bc.store_id = bc.store_id
+                    AND newer.id > 0
+                    AND newer.time <= %s
+                    AND (newer.time, newer.id) > (b.time, b.id)
+                )
+                ORDER BY b.time DESC, b.id DESC
+                {limit_clause(limit)}
             """
 
-            cur.execute(collections_with_bills_in_range_query, params)
-            collection_ids_in_range = [row["collection_id"] for row in cur.fetchall()]
+            cur.execute(
+                collections_with_bills_in_range_query,
+                params + keyset_params + [params[1]],
+            )
+            collections_in_range = cur.fetchall()
+            headers = cursor_headers(next_cursor(collections_in_range, limit))
+            collection_ids_in_range = [row["collection_id"] for row in collections_in_range]
 
             if not collection_ids_in_range:
                 return JSONResponse(content=[], status_code=200)
@@ -386,14 +426,18 @@ def get_parties_open_bills(
                 }
                 result.append(collection_record)
 
-            return JSONResponse(content=result, status_code=200)
+            if limit:
+                position = {str(cid): i for i, cid in enumerate(collection_ids_in_range)}
+                result.sort(key=lambda collection: position[collection["collection_id"]])
+
+            return JSONResponse(content=result, status_code=200, headers=headers)
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=400, detail=str(e)) from e
 
 
 @router.get("/parties/long-missed")
-async def get_long_missed_parties(
+def get_long_missed_parties(
     current_user: dict = Depends(get_current_user),
 ) -> JSONResponse:
     """
@@ -437,7 +481,7 @@ async def get_long_missed_parties(
 
 
 @router.get("/party/details")
-async def get_party_details(party_id: int) -> JSONResponse:
+def get_party_details(party_id: int) -> JSONResponse:
     """
     Get the details of a specific party, total bills, total amount, etc.
     """
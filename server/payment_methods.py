@@ -13,12 +13,12 @@ import logging
 from os import getenv
 from typing import Optional
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from database import Database
 from dotenv import load_dotenv
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException
 
 from auth_middleware import get_current_user
+from etags import etag_matches, not_modified, tables_etag, with_etag
 
 load_dotenv()
 
@@ -36,35 +36,6 @@ logging.basicConfig(
 )
 
 
-class Database:
-    "Database context manager to handle the connection and cursor"
-
-    def __init__(self, host, database, user, password, real_dict_cursor=True):
-        self.host = host
-        self.database = database
-        self.user = user
-        self.password = password
-        self.real_dict_cursor = real_dict_cursor
-
-    def __enter__(self):
-        self.conn = psycopg2.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password,
-        )
-        return self.conn.cursor(
-            cursor_factory=RealDictCursor if self.real_dict_cursor else None
-        )
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is not None:
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-        self.conn.close()
-
-
 def get_default_payment_method(cur):
     """Return the current default (or first available) active payment method."""
     cur.execute(
@@ -79,10 +50,16 @@ def get_default_payment_method(cur):
 
 
 @router.get("/payment-methods")
-def get_payment_methods(current_user: dict = Depends(get_current_user)):
+def get_payment_methods(
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+):
     """List all active payment methods, default first."""
     try:
         with Database(HOST, DATABASE, USER, PASS) as cur:
+            etag = tables_etag(cur, "payment_methods")
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
             cur.execute(
                 """
                 SELECT id, name, is_default, home_store_id
@@ -91,7 +68,7 @@ def get_payment_methods(current_user: dict = Depends(get_current_user)):
                 ORDER BY is_default DESC, id ASC
                 """
             )
-            return cur.fetchall()
+            return with_etag(cur.fetchall(), etag)
     except Exception as e:
         logging.error(f"Error getting payment methods: {e}")
         raise HTTPException(status_code=400, detail=str(e)) from e
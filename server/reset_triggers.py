@@ -1,10 +1,13 @@
-from init import connect_to_database, create_all_triggers
+from init import TABLE_VERSIONED_TABLES, connect_to_database, create_all_triggers
 
 
 def drop_all_triggers(cur):
     # Drop triggers from tables
     cur.execute("DROP TRIGGER IF EXISTS trigger_add_product_to_all_stores ON products;")
     cur.execute("DROP TRIGGER IF EXISTS trigger_update_stock_insert ON products_flow;")
+    cur.execute(
+        "DROP TRIGGER IF EXISTS trigger_products_flow_after_insert ON products_flow;"
+    )
     cur.execute(
         "DROP TRIGGER IF EXISTS trigger_insert_cash_flow_after_insert ON bills;"
     )
@@ -15,6 +18,9 @@ def drop_all_triggers(cur):
     cur.execute(
         "DROP TRIGGER IF EXISTS trigger_sync_store_to_associated_party ON store_data;"
     )
+    cur.execute(
+        "DROP TRIGGER IF EXISTS trigger_notify_store_data_change ON store_data;"
+    )
     cur.execute(
         "DROP TRIGGER IF EXISTS trigger_insert_cash_flow_after_insert_salary ON salaries;"
     )
@@ -33,13 +39,47 @@ def drop_all_triggers(cur):
     cur.execute(
         "DROP TRIGGER IF EXISTS trigger_bubble_fix_total_after_update ON cash_flow;"
     )
+    cur.execute(
+        "DROP TRIGGER IF EXISTS trigger_cash_flow_checkpoints_insert_delete ON cash_flow;"
+    )
+    cur.execute(
+        "DROP TRIGGER IF EXISTS trigger_cash_flow_checkpoints_update ON cash_flow;"
+    )
+    cur.execute(
+        "DROP TRIGGER IF EXISTS trigger_account_balances_insert ON account_transactions;"
+    )
+    cur.execute(
+        "DROP TRIGGER IF EXISTS trigger_account_balances_delete ON account_transactions;"
+    )
+    cur.execute(
+        "DROP TRIGGER IF EXISTS trigger_account_balances_update ON account_transactions;"
+    )
+    cur.execute(
+        "DROP TRIGGER IF EXISTS trigger_products_version_insert ON products;"
+    )
+    cur.execute(
+        "DROP TRIGGER IF EXISTS trigger_products_version_update ON products;"
+    )
+    cur.execute(
+        "DROP TRIGGER IF EXISTS trigger_product_inventory_version_insert ON product_inventory;"
+    )
+    cur.execute(
+        "DROP TRIGGER IF EXISTS trigger_product_inventory_version_update ON product_inventory;"
+    )
+    cur.execute(
+        "DROP TRIGGER IF EXISTS trigger_reserved_products_version ON reserved_products;"
+    )
+    for table in TABLE_VERSIONED_TABLES:
+        cur.execute(f"DROP TRIGGER IF EXISTS trigger_{table}_table_version ON {table};")
 
     # Drop corresponding functions
     cur.execute("DROP FUNCTION IF EXISTS add_product_to_all_stores() CASCADE;")
     cur.execute("DROP FUNCTION IF EXISTS update_stock_after_insert() CASCADE;")
+    cur.execute("DROP FUNCTION IF EXISTS products_flow_after_insert() CASCADE;")
     cur.execute("DROP FUNCTION IF EXISTS insert_cash_flow_after_insert() CASCADE;")
     cur.execute("DROP FUNCTION IF EXISTS add_bill_to_collections() CASCADE;")
     cur.execute("DROP FUNCTION IF EXISTS sync_store_to_associated_party() CASCADE;")
+    cur.execute("DROP FUNCTION IF EXISTS notify_store_data_change() CASCADE;")
     cur.execute(
         "DROP FUNCTION IF EXISTS insert_cash_flow_after_insert_salary() CASCADE;"
     )
@@ -55,6 +95,12 @@ def drop_all_triggers(cur):
     cur.execute("DROP FUNCTION IF EXISTS update_cash_flow_after_update() CASCADE;")
     cur.execute("DROP FUNCTION IF EXISTS add_negative_one_bill() CASCADE;")
     cur.execute("DROP FUNCTION IF EXISTS bubble_fix_total_after_delete() CASCADE;")
+    cur.execute("DROP FUNCTION IF EXISTS cash_flow_checkpoints_after_change() CASCADE;")
+    cur.execute("DROP FUNCTION IF EXISTS account_balances_after_change() CASCADE;")
+    cur.execute("DROP FUNCTION IF EXISTS add_to_account_balance(BIGINT, BIGINT, FLOAT) CASCADE;")
+    cur.execute("DROP FUNCTION IF EXISTS stamp_catalog_version() CASCADE;")
+    cur.execute("DROP FUNCTION IF EXISTS stamp_reserved_product_version() CASCADE;")
+    cur.execute("DROP FUNCTION IF EXISTS bump_table_version() CASCADE;")
     cur.execute(
         "DROP FUNCTION IF EXISTS delete_cash_flow_after_delete_installment_flow() CASCADE;"
     )
@@ -1,7 +1,6 @@
-from fastapi import HTTPException, Depends
+from fastapi import HTTPException, Depends, Header
 from fastapi.responses import JSONResponse
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from database import Database
 import logging
 from dotenv import load_dotenv
 from os import getenv
@@ -9,6 +8,8 @@ from fastapi import APIRouter
 from typing import Any, Optional
 import json
 from auth_middleware import get_current_user
+from store_cache import invalidate_store_cache
+from etags import etag_matches, not_modified, tables_etag, with_etag
 
 load_dotenv()
 
@@ -25,45 +26,22 @@ ALGORITHM = getenv("ALGORITHM") or ""
 router = APIRouter()
 
 
-class Database:
-    "Database context manager to handle the connection and cursor"
-
-    def __init__(self, host, database, user, password, real_dict_cursor=True):
-        self.host = host
-        self.database = database
-        self.user = user
-        self.password = password
-        self.real_dict_cursor = real_dict_cursor
-
-    def __enter__(self):
-        self.conn = psycopg2.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password,
-        )
-        return self.conn.cursor(
-            cursor_factory=RealDictCursor if self.real_dict_cursor else None
-        )
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is not None:
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-        self.conn.close()
-
-
 @router.get("/scopes")
-def get_scopes(current_user: dict = Depends(get_current_user)) -> JSONResponse:
+def get_scopes(
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+) -> JSONResponse:
     query = """
     SELECT * FROM scopes
     """
     try:
         with Database(HOST, DATABASE, USER, PASS) as cur:
+            etag = tables_etag(cur, "scopes")
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
             cur.execute(query)
             scopes = cur.fetchall()
-            return JSONResponse(content=scopes)
+            return with_etag(scopes, etag)
     except Exception as e:
         logging.error(f"Error: {e}")
         raise HTTPException(status_code=400, detail=str(e)) from e
@@ -152,13 +130,18 @@ def get_pages(current_user: dict = Depends(get_current_user)) -> JSONResponse:
 
 @router.get("/store-data")
 def get_store_data(
-    store_id: int, current_user: dict = Depends(get_current_user)
+    store_id: int,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
 ) -> JSONResponse:
     try:
         with Database(HOST, DATABASE, USER, PASS) as cur:
+            etag = tables_etag(cur, "store_data")
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
             cur.execute("SELECT * FROM store_data WHERE id = %s", (store_id,))
             store = cur.fetchone()
-            return JSONResponse(content=store)
+            return with_etag(store, etag)
     except Exception as e:
         logging.error(f"Error: {e}")
         raise HTTPException(status_code=400, detail=str(e)) from e
@@ -215,7 +198,8 @@ def update_store_data(
                 (store_id, name, address, phone, json.dumps(merged_extra_info)),
             )
             store = cur.fetchone()
-            return JSONResponse(content=store)
+        invalidate_store_cache(store_id)
+        return JSONResponse(content=store)
     except Exception as e:
         logging.error(f"Error: {e}")
         raise HTTPException(status_code=400, detail=str(e)) from e
@@ -0,0 +1,248 @@
+"""
+Opt-in slow-query log.
+
+When SLOW_QUERY_MS is set (> 0), every statement run through the shared pool
+that takes longer than that many milliseconds is written to the slow_queries
+table together with its parameters and the endpoint (or background thread)
+that ran it. A sample of slow read-only statements
+(SLOW_QUERY_EXPLAIN_SAMPLE, default 0.1) is re-run under
+EXPLAIN (ANALYZE, BUFFERS) on a separate connection, and the plan is stored
+with the entry.
+
+Logging happens on a background writer thread, so the request that ran the
+slow statement never waits for it. The table is trimmed to the newest
+SLOW_QUERY_LOG_MAX_ROWS entries (default 10000).
+"""
+
+import logging
+import queue
+import random
+import re
+import threading
+from os import getenv
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from database import Database, add_query_observer, connect
+from metrics import current_endpoint
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+SLOW_QUERY_MS = float(getenv("SLOW_QUERY_MS") or 0)
+SLOW_QUERY_EXPLAIN_SAMPLE = float(getenv("SLOW_QUERY_EXPLAIN_SAMPLE") or 0.1)
+SLOW_QUERY_LOG_MAX_ROWS = int(getenv("SLOW_QUERY_LOG_MAX_ROWS") or 10000)
+
+# EXPLAIN ANALYZE runs the statement again; never let it hold a connection long
+EXPLAIN_STATEMENT_TIMEOUT_MS = 30000
+MAX_PARAMS_LENGTH = 2000
+QUEUE_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+# Only plain reads are re-run under EXPLAIN ANALYZE: it executes the statement,
+# so anything that writes (or locks rows) would have side effects.
+_READ_ONLY = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+_WRITES = re.compile(
+    r"\b(insert|update|delete|merge|for\s+update|for\s+share|nextval|setval)\b",
+    re.IGNORECASE,
+)
+
+_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=QUEUE_SIZE)
+_writer_thread: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+_dropped = 0
+
+
+def _text(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return str(value)
+
+
+def _is_explainable(statement: str) -> bool:
+    return bool(_READ_ONLY.match(statement)) and not _WRITES.search(statement)
+
+
+def _observe_query(cursor, query, params, duration: float, many: bool) -> None:
+    global _dropped
+
+    if duration * 1000 < SLOW_QUERY_MS:
+        return
+    if threading.current_thread() is _writer_thread:
+        return
+
+    statement = _text(query)
+    explain_sql = None
+    if (
+        not many
+        and _is_explainable(statement)
+        and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE
+    ):
+        try:
+            explain_sql = _text(cursor.mogrify(query, params))
+        except Exception:
+            explain_sql = None
+
+    if many:
+        params_text = f"<executemany: {len(params) if hasattr(params, '__len__') else '?'} rows>"
+    else:
+        params_text = None if params is None else repr(params)
+    if params_text and len(params_text) > MAX_PARAMS_LENGTH:
+        params_text = params_text[:MAX_PARAMS_LENGTH] + "..."
+
+    entry = {
+        "duration_ms": duration * 1000,
+        "endpoint": current_endpoint() or f"<{threading.current_thread().name}>",
+        "statement": statement,
+        "params": params_text,
+        "explain_sql": explain_sql,
+    }
+
+    _ensure_writer()
+    try:
+        _queue.put_nowait(entry)
+    except queue.Full:
+        _dropped += 1
+
+
+def _explain(sql: str) -> Optional[str]:
+    conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SET LOCAL statement_timeout = %s", (EXPLAIN_STATEMENT_TIMEOUT_MS,)
+            )
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql)
+            plan = "\n".join(row[0] for row in cur.fetchall())
+        return plan
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def _write(entry: Dict[str, Any]) -> None:
+    plan = _explain(entry["explain_sql"]) if entry["explain_sql"] else None
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        cur.execute(
+            """
+            INSERT INTO slow_queries (duration_ms, endpoint, statement, params, plan)
+            VALUES (%s, %s, %s, %s, %s)
+            """,
+            (
+                entry["duration_ms"],
+                entry["endpoint"],
+                entry["statement"],
+                entry["params"],
+                plan,
+            ),
+        )
+
+
+def _trim() -> None:
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        cur.execute(
+            """
+            DELETE FROM slow_queries
+            WHERE id <= (
+                SELECT id FROM slow_queries
+                ORDER BY id DESC
+                OFFSET %s LIMIT 1
+            )
+            """,
+            (SLOW_QUERY_LOG_MAX_ROWS,),
+        )
+
+
+def _writer_loop() -> None:
+    written = 0
+    while True:
+        entry = _queue.get()
+        try:
+            _write(entry)
+            written += 1
+            if written % 100 == 0:
+                _trim()
+        except Exception as e:
+            logger.error(f"Could not record slow query: {e}")
+
+
+def _ensure_writer() -> None:
+    global _writer_thread
+
+    if _writer_thread is not None:
+        return
+    with _writer_lock:
+        if _writer_thread is None:
+            thread = threading.Thread(
+                target=_writer_loop, name="slow-query-log", daemon=True
+            )
+            _writer_thread = thread
+            thread.start()
+
+
+def is_enabled() -> bool:
+    return SLOW_QUERY_MS > 0
+
+
+def list_slow_queries(
+    limit: int = 50, endpoint: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Worst offenders grouped by statement text: how often each was slow, its
+    max / avg duration, the endpoints that ran it and the latest captured plan.
+    """
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        cur.execute(
+            """
+            SELECT
+                statement,
+                COUNT(*) AS occurrences,
+                MAX(duration_ms) AS max_ms,
+                AVG(duration_ms) AS avg_ms,
+                MAX(time) AS last_seen,
+                ARRAY_AGG(DISTINCT endpoint) AS endpoints,
+                (ARRAY_AGG(params ORDER BY duration_ms DESC))[1] AS slowest_params,
+                (ARRAY_AGG(plan ORDER BY time DESC) FILTER (WHERE plan IS NOT NULL))[1] AS plan
+            FROM slow_queries
+            WHERE (%s IS NULL OR endpoint = %s)
+            GROUP BY statement
+            ORDER BY MAX(duration_ms) DESC
+            LIMIT %s
+            """,
+            (endpoint, endpoint, limit),
+        )
+        rows = cur.fetchall()
+
+    for row in rows:
+        row["max_ms"] = round(row["max_ms"], 3)
+        row["avg_ms"] = round(float(row["avg_ms"]), 3)
+        row["last_seen"] = row["last_seen"].isoformat() if row["last_seen"] else None
+    return rows
+
+
+def clear_slow_queries() -> None:
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        cur.execute("DELETE FROM slow_queries")
+
+
+def slow_query_log_status() -> Dict[str, Any]:
+    return {
+        "enabled": is_enabled(),
+        "threshold_ms": SLOW_QUERY_MS,
+        "explain_sample": SLOW_QUERY_EXPLAIN_SAMPLE,
+        "max_rows": SLOW_QUERY_LOG_MAX_ROWS,
+        "queued": _queue.qsize(),
+        "dropped": _dropped,
+    }
+
+
+if is_enabled():
+    add_query_observer(_observe_query)
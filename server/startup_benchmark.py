@@ -0,0 +1,137 @@
+"""
+Backend startup benchmark: time from launching uvicorn to the first
+successful GET /test response, which is what the Electron splash screen waits
+for.
+
+Each run starts a fresh `uvicorn main:app` process on a free port, polls
+/test until it answers, and stops the server. Because every process is new,
+the OS file cache is the only thing warm between runs. The report gives
+min / median / max over the runs. Unless --no-imports is given, it also lists
+the slowest top-level imports of main.py (python -X importtime) to show where
+startup time goes.
+
+    python startup_benchmark.py
+    python startup_benchmark.py --runs 10 --json startup.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_response(timeout: float) -> Optional[float]:
+    port = free_port()
+    env = dict(os.environ)
+    # The preload would compete with the measurement for the CPU
+    env.setdefault("ANALYTICS_WARMUP_DELAY", "-1")
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+        ],
+        cwd=SERVER_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise SystemExit(f"uvicorn exited with code {server.returncode}")
+            try:
+                response = httpx.get(f"http://127.0.0.1:{port}/test", timeout=1)
+                if response.status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+        return None
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def slowest_imports(count: int) -> List[Dict[str, float]]:
+    """Top-level imports of main.py, by cumulative import time."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=SERVER_DIR,
+        capture_output=True,
+        text=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2]
+        # Direct imports of main are indented by exactly three spaces
+        depth = len(name) - len(name.lstrip(" "))
+        if depth == 3 or name.strip() == "main":
+            imports.append({"module": name.strip(), "ms": int(parts[1]) / 1000})
+    imports.sort(key=lambda item: item["ms"], reverse=True)
+    return imports[:count]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120, help="give up on a run after this many seconds")
+    parser.add_argument("--no-imports", action="store_true", help="skip the import time breakdown")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    timings = []
+    for run in range(1, args.runs + 1):
+        elapsed = time_to_first_response(args.timeout)
+        if elapsed is None:
+            raise SystemExit(f"run {run}: no /test response within {args.timeout}s")
+        timings.append(elapsed)
+        print(f"run {run}: first /test response after {elapsed * 1000:.0f} ms", flush=True)
+
+    report = {
+        "runs": len(timings),
+        "min_ms": round(min(timings) * 1000, 1),
+        "median_ms": round(statistics.median(timings) * 1000, 1),
+        "max_ms": round(max(timings) * 1000, 1),
+    }
+    print(
+        f"\ntime to first /test: min {report['min_ms']} ms, "
+        f"median {report['median_ms']} ms, max {report['max_ms']} ms"
+    )
+
+    if not args.no_imports:
+        report["slowest_imports"] = slowest_imports(15)
+        print("\nslowest imports of main.py (cumulative):")
+        for item in report["slowest_imports"]:
+            print(f"  {item['ms']:>9.1f} ms  {item['module']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
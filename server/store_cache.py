@@ -0,0 +1,239 @@
+"""
+In-process cache of store_data rows (name, address, phone, extra_info).
+
+Store metadata and the settings kept in extra_info (Telegram token / chat ids,
+expiration scheduler settings, ...) are read on hot paths such as every bill
+insert, every Telegram message and every scheduler tick, but change rarely.
+
+Entries are dropped:
+
+- explicitly, by the endpoints that write store_data (invalidate_store_cache),
+  so the writing process sees its own change immediately;
+- across processes, by the store_data trigger which NOTIFYs
+  `store_data_changed` with the store id; every worker LISTENs on that channel
+  from a background thread (start_store_cache_listener);
+- after STORE_CACHE_TTL seconds (default 300) as a safety net.
+
+A read racing an invalidation must not put the old row back: every
+invalidation bumps a generation counter, and a row read from the database is
+only cached if its store's generation did not change during the read.
+
+Other per-process caches (the logged-in users in auth_middleware) share the
+listener thread and its connection: add_notify_handler registers their
+channel.
+"""
+
+import copy
+import logging
+import select
+import threading
+import time
+from os import getenv
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import psycopg2
+from dotenv import load_dotenv
+
+from database import Database
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+STORE_CACHE_TTL = float(getenv("STORE_CACHE_TTL") or 300)
+NOTIFY_CHANNEL = "store_data_changed"
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_stores: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+_settings_store_id: Optional[Tuple[float, int]] = None
+# Bumped by invalidate_store_cache: per store, on clearing every store, and
+# on any invalidation (the settings store may change with any of them)
+_store_generations: Dict[int, int] = {}
+_clear_generation = 0
+_generation = 0
+
+# NOTIFY channel -> handler, called with the payload, or with None after the
+# listener (re)connects, when anything may have changed unheard
+_notify_handlers: Dict[str, Callable[[Optional[str]], None]] = {}
+
+_listener_thread: Optional[threading.Thread] = None
+_listener_stop = threading.Event()
+
+
+def get_store(store_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Return the store_data row for `store_id` (id, name, address, phone,
+    extra_info), or None if the store does not exist. The result is a copy and
+    may be modified freely.
+    """
+    now = time.monotonic()
+    with _lock:
+        entry = _stores.get(store_id)
+        if entry is not None and entry[0] > now:
+            return copy.deepcopy(entry[1])
+        generation = (_clear_generation, _store_generations.get(store_id, 0))
+
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        cur.execute(
+            """
+            SELECT id, name, address, phone, extra_info
+            FROM store_data
+            WHERE id = %s
+            """,
+            (store_id,),
+        )
+        row = cur.fetchone()
+
+    if not row:
+        return None
+
+    store = dict(row)
+    with _lock:
+        if generation == (_clear_generation, _store_generations.get(store_id, 0)):
+            _stores[store_id] = (time.monotonic() + STORE_CACHE_TTL, store)
+    return copy.deepcopy(store)
+
+
+def get_store_extra_info(store_id: int) -> Dict[str, Any]:
+    """extra_info of a store, or {} if the store does not exist."""
+    store = get_store(store_id)
+    return (store["extra_info"] or {}) if store else {}
+
+
+def get_settings_store_id() -> Optional[int]:
+    """
+    Store holding the global settings (Telegram bot token, updates offset):
+    store 0 when it exists, otherwise the first store.
+    """
+    global _settings_store_id
+
+    now = time.monotonic()
+    with _lock:
+        if _settings_store_id is not None and _settings_store_id[0] > now:
+            return _settings_store_id[1]
+        generation = _generation
+
+    with Database(HOST, DATABASE, USER, PASS) as cur:
+        cur.execute(
+            """
+            SELECT id
+            FROM store_data
+            ORDER BY CASE WHEN id = 0 THEN 0 ELSE 1 END, id
+            LIMIT 1
+            """
+        )
+        row = cur.fetchone()
+
+    if not row:
+        return None
+
+    with _lock:
+        if generation == _generation:
+            _settings_store_id = (time.monotonic() + STORE_CACHE_TTL, row["id"])
+    return row["id"]
+
+
+def invalidate_store_cache(store_id: Optional[int] = None) -> None:
+    """Drop a cached store (or everything) after store_data changes."""
+    global _settings_store_id, _clear_generation, _generation
+
+    with _lock:
+        _generation += 1
+        if store_id is None:
+            _stores.clear()
+            _clear_generation += 1
+        else:
+            _stores.pop(store_id, None)
+            _store_generations[store_id] = _store_generations.get(store_id, 0) + 1
+        # Inserts / deletes may change which store holds the global settings
+        _settings_store_id = None
+
+
+def _handle_notification(payload: Optional[str]) -> None:
+    try:
+        invalidate_store_cache(int(payload))
+    except (TypeError, ValueError):
+        invalidate_store_cache()
+
+
+_notify_handlers[NOTIFY_CHANNEL] = _handle_notification
+
+
+def add_notify_handler(channel: str, handler: Callable[[Optional[str]], None]) -> None:
+    """
+    Also LISTEN on `channel` and pass its payloads to `handler` (None: drop
+    everything). Register before start_store_cache_listener.
+    """
+    _notify_handlers[channel] = handler
+
+
+def _invalidate_all() -> None:
+    for handler in list(_notify_handlers.values()):
+        handler(None)
+
+
+def _listen_loop() -> None:
+    backoff = 1.0
+    while not _listener_stop.is_set():
+        conn = None
+        try:
+            # LISTEN needs its own long-lived autocommit session, so this
+            # connection deliberately bypasses the shared pool.
+            conn = psycopg2.connect(
+                host=HOST, database=DATABASE, user=USER, password=PASS
+            )
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                for channel in _notify_handlers:
+                    cur.execute(f"LISTEN {channel}")
+            # Anything may have changed while we were not listening
+            _invalidate_all()
+            backoff = 1.0
+
+            while not _listener_stop.is_set():
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    handler = _notify_handlers.get(notify.channel)
+                    if handler is not None:
+                        handler(notify.payload)
+        except Exception as e:
+            logger.error(f"Store cache listener error: {e}")
+            _invalidate_all()
+            _listener_stop.wait(backoff)
+            backoff = min(backoff * 2, 60.0)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
+def start_store_cache_listener() -> None:
+    """Start the LISTEN thread that keeps this process's caches coherent."""
+    global _listener_thread
+
+    if _listener_thread is not None and _listener_thread.is_alive():
+        return
+    _listener_stop.clear()
+    _listener_thread = threading.Thread(
+        target=_listen_loop, name="store-cache-listener", daemon=True
+    )
+    _listener_thread.start()
+
+
+def stop_store_cache_listener() -> None:
+    global _listener_thread
+
+    _listener_stop.set()
+    if _listener_thread is not None:
+        _listener_thread.join(timeout=10)
+        _listener_thread = None
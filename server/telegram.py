@@ -39,7 +39,7 @@ class TelegramStoreChatIdRequest(BaseModel):
 
 
 @router.get("/telegram/status")
-async def get_telegram_status_endpoint(current_user: dict = Depends(get_current_user)):
+def get_telegram_status_endpoint(current_user: dict = Depends(get_current_user)):
     """Get current Telegram bot connection status"""
     try:
         status = get_telegram_status()
@@ -50,7 +50,7 @@ async def get_telegram_status_endpoint(current_user: dict = Depends(get_current_
 
 
 @router.post("/telegram/configure")
-async def configure_telegram(
+def configure_telegram(
     request: TelegramConfigRequest, current_user: dict = Depends(get_current_user)
 ):
     """Validate and configure a Telegram bot token"""
@@ -59,11 +59,15 @@ async def configure_telegram(
         result = validate_bot_token(request.bot_token)
 
         if result.get("success"):
-            # Token is valid - update the module-level token
+            # Token is valid - persist it. Saving invalidates the store cache
+            # here and (via NOTIFY) in every other worker.
             import telegram_utils
 
-            telegram_utils.TELEGRAM_BOT_TOKEN = request.bot_token
-            save_telegram_bot_token(request.bot_token)
+            saved = save_telegram_bot_token(request.bot_token)
+            if not saved or telegram_utils.TELEGRAM_BOT_TOKEN:
+                # Keep it active in this process when it could not be saved
+                # or an env token would otherwise shadow the saved one
+                telegram_utils.TELEGRAM_BOT_TOKEN = request.bot_token
 
             return {
                 "success": True,
@@ -85,7 +89,7 @@ async def configure_telegram(
 
 
 @router.post("/telegram/test-message")
-async def send_test_message(
+def send_test_message(
     request: TelegramTestMessageRequest,
     current_user: dict = Depends(get_current_user),
 ):
@@ -116,7 +120,7 @@ async def send_test_message(
 
 
 @router.post("/telegram/store-chat-id")
-async def set_store_chat_id(
+def set_store_chat_id(
     request: TelegramStoreChatIdRequest,
     current_user: dict = Depends(get_current_user),
 ):
@@ -136,7 +140,7 @@ async def set_store_chat_id(
 
 
 @router.get("/telegram/store-chat-id/{store_id}")
-async def get_store_chat_id_endpoint(
+def get_store_chat_id_endpoint(
     store_id: int, current_user: dict = Depends(get_current_user)
 ):
     """Get Telegram chat ID for a specific store"""
@@ -149,7 +153,7 @@ async def get_store_chat_id_endpoint(
 
 
 @router.get("/telegram/updates")
-async def get_updates_endpoint(current_user: dict = Depends(get_current_user)):
+def get_updates_endpoint(current_user: dict = Depends(get_current_user)):
     """Fetch recent messages to the bot for auto-detecting chat IDs"""
     try:
         status = get_telegram_status()
@@ -166,7 +170,7 @@ async def get_updates_endpoint(current_user: dict = Depends(get_current_user)):
 
 
 @router.get("/telegram/service-health")
-async def get_service_health(current_user: dict = Depends(get_current_user)):
+def get_service_health(current_user: dict = Depends(get_current_user)):
     """Get Telegram bot health status for debugging"""
     try:
         status = get_telegram_status()
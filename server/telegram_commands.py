@@ -6,9 +6,10 @@ import re
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional, Tuple
 
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from database import connect
+from store_cache import get_store
 from telegram_utils import (
     HOST,
     DATABASE,
@@ -84,7 +85,7 @@ def get_telegram_command_worker_health() -> Dict[str, Any]:
 
 
 def _db_connect():
-    return psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+    return connect(host=HOST, database=DATABASE, user=USER, password=PASS)
 
 
 def _normalize_text(text: str) -> str:
@@ -205,12 +206,7 @@ def _is_chat_authorized_for_store(chat_id: str, store_id: int) -> bool:
 
 def _get_store_name(store_id: int) -> str:
     try:
-        conn = _db_connect()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT name FROM store_data WHERE id = %s", (store_id,))
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        row = get_store(store_id)
         if row and row.get("name"):
             return str(row["name"])
         return f"متجر {store_id}"
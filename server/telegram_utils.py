@@ -4,11 +4,13 @@ from os import getenv
 import requests
 import json
 import html
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 import time
 
+from database import connect
+from store_cache import get_settings_store_id, get_store_extra_info, invalidate_store_cache
+
 # Load environment variables
 load_dotenv()
 
@@ -42,7 +44,7 @@ def _get_preferred_store_id_for_settings(cur) -> Optional[int]:
 def save_telegram_bot_token(token: str) -> bool:
     """Persist Telegram bot token in store_data.extra_info so it survives restarts."""
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+        conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         store_id = _get_preferred_store_id_for_settings(cur)
@@ -65,6 +67,7 @@ def save_telegram_bot_token(token: str) -> bool:
         conn.commit()
         cur.close()
         conn.close()
+        invalidate_store_cache(store_id)
         return True
     except Exception as e:
         logger.error(f"Error saving Telegram bot token: {e}")
@@ -72,33 +75,21 @@ def save_telegram_bot_token(token: str) -> bool:
 
 
 def load_telegram_bot_token() -> str:
-    """Load Telegram bot token from DB into memory when not already set."""
-    global TELEGRAM_BOT_TOKEN
-
+    """
+    Bot token from the environment, or else the one saved in the settings
+    store's extra_info (served from the store cache, so no DB round trip).
+    """
     if TELEGRAM_BOT_TOKEN:
         return TELEGRAM_BOT_TOKEN
 
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-
-        store_id = _get_preferred_store_id_for_settings(cur)
+        store_id = get_settings_store_id()
         if store_id is None:
-            cur.close()
-            conn.close()
             return ""
 
-        cur.execute("SELECT extra_info FROM store_data WHERE id = %s", (store_id,))
-        result = cur.fetchone()
-
-        cur.close()
-        conn.close()
-
-        if result and result.get("extra_info"):
-            token = result["extra_info"].get("telegram_bot_token")
-            if token:
-                TELEGRAM_BOT_TOKEN = token
-                return TELEGRAM_BOT_TOKEN
+        token = get_store_extra_info(store_id).get("telegram_bot_token")
+        if token:
+            return token
     except Exception as e:
         logger.error(f"Error loading Telegram bot token: {e}")
 
@@ -108,19 +99,7 @@ def load_telegram_bot_token() -> str:
 def get_store_telegram_chat_id(store_id: int):
     """Get Telegram chat ID for a specific store"""
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-
-        cur.execute("SELECT extra_info FROM store_data WHERE id = %s", (store_id,))
-        result = cur.fetchone()
-
-        cur.close()
-        conn.close()
-
-        if result and result["extra_info"]:
-            extra_info = result["extra_info"]
-            return extra_info.get("telegram_chat_id")
-        return None
+        return get_store_extra_info(store_id).get("telegram_chat_id")
     except Exception as e:
         logger.error(f"Error getting store Telegram chat ID: {e}")
         return None
@@ -129,7 +108,7 @@ def get_store_telegram_chat_id(store_id: int):
 def save_store_telegram_chat_id(store_id: int, chat_id: str):
     """Save Telegram chat ID for a specific store"""
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+        conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         cur.execute("SELECT extra_info FROM store_data WHERE id = %s", (store_id,))
@@ -146,6 +125,7 @@ def save_store_telegram_chat_id(store_id: int, chat_id: str):
         conn.commit()
         cur.close()
         conn.close()
+        invalidate_store_cache(store_id)
 
         return True
     except Exception as e:
@@ -529,80 +509,6 @@ def format_low_stock_message(
     return message
 
 
-def check_stock_levels_after_sale(store_id: int, sold_products: List[Dict[str, Any]]):
-    """
-    Check stock levels after a sale and return products that are below or equal to 0
-
-    Args:
-        store_id: Store ID
-        sold_products: List of products that were sold with their quantities
-
-    Returns:
-        List of products with stock <= 0
-    """
-    try:
-        # Wait 1 second for database triggers to complete
-        time.sleep(1)
-
-        if not sold_products:
-            logger.info("No products sold, skipping stock check")
-            return []
-
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-
-        products_below_zero = []
-
-        for sold_product in sold_products:
-            product_id = sold_product["id"]
-            quantity_sold = sold_product["quantity"]
-
-            # Get current stock after the sale
-            cur.execute(
-                """
-                SELECT p.name, pi.stock
-                FROM products p
-                JOIN product_inventory pi ON p.id = pi.product_id
-                WHERE p.id = %s AND pi.store_id = %s
-                """,
-                (product_id, store_id),
-            )
-
-            result = cur.fetchone()
-            if result:
-                current_stock = result["stock"]
-
-                # Check if the product stock is <= 0
-                if current_stock <= 0:
-                    logger.warning(
-                        f"Product '{result['name']}' stock is low/negative: {current_stock}"
-                    )
-                    products_below_zero.append(
-                        {
-                            "name": result["name"],
-                            "stock": current_stock,
-                            "product_id": product_id,
-                            "quantity_sold": quantity_sold,
-                        }
-                    )
-            else:
-                logger.warning(
-                    f"Product ID {product_id} not found in inventory for store {store_id}"
-                )
-
-        if products_below_zero:
-            logger.info(f"Found {len(products_below_zero)} products with stock <= 0")
-
-        cur.close()
-        conn.close()
-
-        return products_below_zero
-
-    except Exception as e:
-        logger.error(f"Error checking stock levels: {e}")
-        return []
-
-
 def send_low_stock_notification_background(
     store_id: int,
     products_below_zero: List[Dict[str, Any]],
@@ -643,31 +549,6 @@ def send_low_stock_notification_background(
         )
 
 
-def check_and_send_low_stock_notification(
-    store_id: int,
-    sold_products: List[Dict[str, Any]],
-    store_name: str = None,
-    user_name: str = None,
-):
-    """
-    Background task wrapper that checks stock levels and sends notification if needed
-    """
-    try:
-        # Check stock levels (includes 1-second wait)
-        products_below_zero = check_stock_levels_after_sale(store_id, sold_products)
-
-        # Send notification if any products are below zero
-        if products_below_zero:
-            send_low_stock_notification_background(
-                store_id, products_below_zero, store_name, user_name
-            )
-        else:
-            logging.info("All products have positive stock")
-
-    except Exception as e:
-        logging.error(f"Error in background stock check task: {e}")
-
-
 def format_store_transfer_message(
     source_store_name: str,
     destination_store_name: str,
@@ -732,7 +613,7 @@ def check_due_installments(store_id: int):
         List of due installments with full details
     """
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+        conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         # Query to get installments with their flow and calculate due dates
@@ -1000,7 +881,7 @@ def check_products_depleted_during_shift(store_id: int, shift_start_time: str):
         List of products that were depleted during this shift
     """
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+        conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         # Get products that were sold/affected during this shift
@@ -1175,7 +1056,7 @@ def get_daily_inventory_summary(store_id: int) -> Dict[str, float]:
         Dictionary containing inventory values and counts
     """
     try:
-        conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+        conn = connect(host=HOST, database=DATABASE, user=USER, password=PASS)
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         # Get inventory summary with current stock values
@@ -0,0 +1,94 @@
+"""
+A user changed in another worker reaches this worker's user cache through the
+users_changed notification, and a lookup racing that invalidation is not
+cached.
+"""
+
+import asyncio
+
+import jwt
+import pytest
+
+import auth_middleware
+import store_cache
+
+SECRET = "test-secret"
+ALGORITHM = "HS256"
+
+
+def _database(on_read):
+    class _Cursor:
+        def execute(self, query, params=None):
+            pass
+
+        def fetchone(self):
+            return {
+                "id": 1,
+                "username": "george",
+                "email": None,
+                "phone": None,
+                "scope_id": on_read(),
+            }
+
+    class _Database:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __enter__(self):
+            return _Cursor()
+
+        def __exit__(self, *exc):
+            return False
+
+    return _Database
+
+
+def _current_user():
+    token = jwt.encode({"sub": "george"}, SECRET, algorithm=ALGORITHM)
+    return asyncio.run(auth_middleware.get_current_user(token))
+
+
+def _notify(payload):
+    store_cache._notify_handlers[auth_middleware.USERS_NOTIFY_CHANNEL](payload)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(auth_middleware, "SECRET", SECRET)
+    monkeypatch.setattr(auth_middleware, "ALGORITHM", ALGORITHM)
+    monkeypatch.setattr(auth_middleware, "AUTH_USER_CACHE_TTL", 60.0)
+    auth_middleware.invalidate_user_cache()
+    yield
+    auth_middleware.invalidate_user_cache()
+
+
+def test_users_notification_drops_the_cached_user(monkeypatch):
+    scopes = iter([1, 2])
+    monkeypatch.setattr(auth_middleware, "Database", _database(lambda: next(scopes)))
+
+    assert _current_user()["scope_id"] == 1
+    assert _current_user()["scope_id"] == 1
+    _notify("someone else")
+    assert _current_user()["scope_id"] == 1
+    _notify("george")
+    assert _current_user()["scope_id"] == 2
+
+
+def test_lookup_racing_a_notification_is_not_cached(monkeypatch):
+    scopes = iter([1, 2])
+    reads = []
+
+    def on_read():
+        reads.append(1)
+        scope_id = next(scopes)
+        if scope_id == 1:
+            # The user changes in another worker while this lookup is in flight
+            _notify("george")
+        return scope_id
+
+    monkeypatch.setattr(auth_middleware, "Database", _database(on_read))
+
+    assert _current_user()["scope_id"] == 1
+    assert _current_user()["scope_id"] == 2
+    assert _current_user()["scope_id"] == 2
+    assert len(reads) == 2
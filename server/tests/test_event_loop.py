@@ -0,0 +1,104 @@
+"""
+A slow analytics call must not hold up other requests on the same worker.
+
+GET /detailed-analytics is stubbed to block in its DB call for
+ANALYTICS_BLOCK seconds. Concurrent GET /products calls on the same app (no
+database, a stubbed cursor) must all finish before that block ends. If the
+analytics endpoint ran its blocking work on the event loop, none of them
+could.
+"""
+
+import asyncio
+import threading
+import time
+
+import httpx
+
+import detailed_analytics
+import main
+from auth_middleware import get_current_user
+
+ANALYTICS_BLOCK = 3.0
+CONCURRENT_PRODUCTS = 20
+MAX_PRODUCTS_LATENCY = 1.0
+
+
+class _SlowDatabase:
+    """Database whose checkout blocks the calling thread, then fails"""
+
+    started = threading.Event()
+    blocked_until = 0.0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        _SlowDatabase.blocked_until = time.monotonic() + ANALYTICS_BLOCK
+        _SlowDatabase.started.set()
+        time.sleep(ANALYTICS_BLOCK)
+        raise RuntimeError("stubbed slow analytics query")
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Cursor:
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return []
+
+    def fetchone(self):
+        return {"version": 1}
+
+
+class _FastDatabase:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return _Cursor()
+
+    def __exit__(self, *exc):
+        return False
+
+
+async def _timed_get(client, path, params):
+    started = time.monotonic()
+    response = await client.get(path, params=params)
+    return response, time.monotonic() - started
+
+
+async def _products_during_slow_analytics():
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        analytics = asyncio.create_task(
+            client.get("/detailed-analytics", params={"store_id": 1})
+        )
+        assert await asyncio.to_thread(_SlowDatabase.started.wait, 30)
+
+        results = await asyncio.gather(
+            *(
+                _timed_get(client, "/products", {"store_id": 1})
+                for _ in range(CONCURRENT_PRODUCTS)
+            )
+        )
+        finished = time.monotonic()
+        await analytics
+        return results, finished
+
+
+def test_slow_analytics_does_not_block_products(monkeypatch):
+    monkeypatch.setattr(detailed_analytics, "Database", _SlowDatabase)
+    monkeypatch.setattr(main, "Database", _FastDatabase)
+    monkeypatch.setitem(
+        main.app.dependency_overrides, get_current_user, lambda: {"id": 1}
+    )
+    _SlowDatabase.started.clear()
+
+    results, finished = asyncio.run(_products_during_slow_analytics())
+
+    assert [response.status_code for response, _ in results] == [200] * CONCURRENT_PRODUCTS
+    assert max(latency for _, latency in results) < MAX_PRODUCTS_LATENCY
+    assert finished < _SlowDatabase.blocked_until
@@ -0,0 +1,35 @@
+"""
+GET /metrics needs a login session or the METRICS_TOKEN bearer token.
+"""
+
+import asyncio
+
+import httpx
+
+import main
+
+
+def _get_metrics(headers=None):
+    async def get():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/metrics", headers=headers)
+
+    return asyncio.run(get())
+
+
+def test_metrics_needs_a_login_or_the_token(monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "scrape-me")
+
+    assert _get_metrics().status_code == 401
+    assert _get_metrics({"Authorization": "Bearer wrong"}).status_code == 401
+
+    response = _get_metrics({"Authorization": "Bearer scrape-me"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+
+def test_metrics_without_a_token_setting_needs_a_login(monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "")
+
+    assert _get_metrics({"Authorization": "Bearer "}).status_code == 401
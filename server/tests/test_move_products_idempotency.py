@@ -0,0 +1,140 @@
+"""
+A move that fails before its source bill commits gives the Idempotency-Key
+back, so a retry runs again. Once the source bill is written the key is kept
+and a retry is refused instead of selling the products twice.
+"""
+
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+
+import main
+
+KEY = "move-1"
+
+
+class _Cursor:
+    def execute(self, query, params=None):
+        pass
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+
+class _Database:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return _Cursor()
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    """In-memory idempotency_keys: (store_id, key) -> stored response"""
+    stored = {}
+
+    def claim(cur, store_id, key, endpoint, fingerprint):
+        if (store_id, key) not in stored:
+            stored[(store_id, key)] = None
+            return None
+        if stored[(store_id, key)] is None:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this idempotency key is in progress",
+            )
+        return stored[(store_id, key)]
+
+    def save(cur, store_id, key, response):
+        stored[(store_id, key)] = response
+        return response
+
+    def release(store_id, key):
+        if stored.get((store_id, key), "done") is None:
+            del stored[(store_id, key)]
+
+    monkeypatch.setattr(main, "Database", _Database)
+    monkeypatch.setattr(main, "claim_idempotency_key", claim)
+    monkeypatch.setattr(main, "save_idempotent_response", save)
+    monkeypatch.setattr(main, "release_idempotency_key", release)
+    monkeypatch.setattr(main, "_insert_bill_pair", lambda *args: None)
+    monkeypatch.setattr(main, "get_store_telegram_chat_id", lambda store_id: None)
+    return stored
+
+
+def _bills(monkeypatch, results):
+    """_add_bill_internal answering each call with the next result"""
+    calls = []
+
+    def add_bill(bill, move_type, store_id, *args, **kwargs):
+        calls.append(move_type)
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(main, "_add_bill_internal", add_bill)
+    return calls
+
+
+def _move():
+    bill = main.Bill(
+        time="2026-01-01T10:00:00",
+        discount=0,
+        total=10,
+        products_flow=[
+            main.ProductFlow(id=1, quantity=1, price=10, wholesale_price=8)
+        ],
+    )
+    return main.move_products(
+        bill,
+        source_store_id=1,
+        destination_store_id=2,
+        background_tasks=BackgroundTasks(),
+        current_user={"username": "george"},
+        idempotency_key=KEY,
+    )
+
+
+def test_retry_after_a_failed_source_bill_runs_again(monkeypatch, keys):
+    calls = _bills(
+        monkeypatch,
+        [
+            HTTPException(status_code=400, detail="Insufficient stock"),
+            {"bill": {"id": 10}},
+            {"bill": {"id": 20}},
+        ],
+    )
+
+    with pytest.raises(HTTPException) as failed:
+        _move()
+    assert failed.value.status_code == 400
+    assert keys == {}
+
+    assert _move() == {"message": "Products moved successfully"}
+    assert calls == ["sell", "sell", "buy"]
+    assert _move() == {"message": "Products moved successfully"}
+    assert calls == ["sell", "sell", "buy"]
+
+
+def test_retry_after_the_source_bill_is_refused(monkeypatch, keys):
+    calls = _bills(
+        monkeypatch,
+        [
+            {"bill": {"id": 10}},
+            HTTPException(status_code=400, detail="Insert into bills failed"),
+        ],
+    )
+
+    with pytest.raises(HTTPException):
+        _move()
+
+    with pytest.raises(HTTPException) as retried:
+        _move()
+    assert retried.value.status_code == 409
+    assert calls == ["sell", "buy"]
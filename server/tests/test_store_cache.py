@@ -0,0 +1,76 @@
+"""
+A store_data read that races invalidate_store_cache must not cache the row it
+read before the invalidation.
+"""
+
+import pytest
+
+import store_cache
+
+
+class _Cursor:
+    def __init__(self, on_read):
+        self.on_read = on_read
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchone(self):
+        name = self.on_read()
+        return {"id": 1, "name": name, "address": None, "phone": None, "extra_info": {}}
+
+
+def _database(on_read):
+    class _Database:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __enter__(self):
+            return _Cursor(on_read)
+
+        def __exit__(self, *exc):
+            return False
+
+    return _Database
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    store_cache.invalidate_store_cache()
+    yield
+    store_cache.invalidate_store_cache()
+
+
+def test_read_racing_an_invalidation_is_not_cached(monkeypatch):
+    names = iter(["old", "new"])
+    reads = []
+
+    def on_read():
+        reads.append(1)
+        name = next(names)
+        if name == "old":
+            # The row changes (and is invalidated) while this read is in flight
+            store_cache.invalidate_store_cache(1)
+        return name
+
+    monkeypatch.setattr(store_cache, "Database", _database(on_read))
+
+    assert store_cache.get_store(1)["name"] == "old"
+    assert store_cache.get_store(1)["name"] == "new"
+    assert store_cache.get_store(1)["name"] == "new"
+    assert len(reads) == 2
+
+
+def test_invalidating_another_store_keeps_the_read(monkeypatch):
+    reads = []
+
+    def on_read():
+        reads.append(1)
+        store_cache.invalidate_store_cache(2)
+        return "store 1"
+
+    monkeypatch.setattr(store_cache, "Database", _database(on_read))
+
+    store_cache.get_store(1)
+    store_cache.get_store(1)
+    assert len(reads) == 1
@@ -0,0 +1,104 @@
+"""
+Database migration: store_data change notifications.
+
+Store metadata and settings (store_data.extra_info) are cached in every API
+worker. This adds an AFTER INSERT / UPDATE / DELETE trigger on store_data that
+sends NOTIFY store_data_changed with the store id, so all workers drop their
+cached copy as soon as the change commits, whichever process made it.
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "24"
+
+
+def create_notify_trigger():
+    logging.info("Creating store_data change notification trigger...")
+    cursor.execute(
+        """
+        CREATE OR REPLACE FUNCTION notify_store_data_change()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM pg_notify(
+                'store_data_changed',
+                COALESCE(NEW.id, OLD.id)::text
+            );
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    cursor.execute(
+        "DROP TRIGGER IF EXISTS trigger_notify_store_data_change ON store_data"
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER trigger_notify_store_data_change
+        AFTER INSERT OR UPDATE OR DELETE ON store_data
+        FOR EACH ROW
+        EXECUTE FUNCTION notify_store_data_change();
+        """
+    )
+
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_24 (store_data notifications)...")
+    try:
+        create_notify_trigger()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_24 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,98 @@
+"""
+Database migration: slow-query log table.
+
+Adds slow_queries. When SLOW_QUERY_MS is set, the API server writes every
+statement slower than that threshold here, with its parameters, the endpoint
+that ran it and, for a sample of read-only statements, an
+EXPLAIN (ANALYZE, BUFFERS) plan. GET /admin/slow-queries reads it.
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "25"
+
+
+def create_slow_queries_table():
+    logging.info("Creating slow_queries table...")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS slow_queries (
+            id BIGSERIAL PRIMARY KEY,
+            time TIMESTAMP NOT NULL DEFAULT NOW(),
+            duration_ms FLOAT NOT NULL,
+            endpoint VARCHAR,
+            statement TEXT NOT NULL,
+            params TEXT,
+            plan TEXT
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_slow_queries_duration
+        ON slow_queries (duration_ms DESC)
+        """
+    )
+
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_25 (slow query log)...")
+    try:
+        create_slow_queries_table()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_25 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
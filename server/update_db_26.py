@@ -0,0 +1,197 @@
+"""
+Database migration: statement-level products_flow trigger.
+
+Replaces the three FOR EACH ROW triggers on products_flow with one
+FOR EACH STATEMENT trigger that reads the inserted rows from a transition
+table (REFERENCING NEW TABLE):
+
+- update_stock_after_insert (stock upsert per line)
+- update_products_flow_total_after_insert (locked lookup plus UPDATE per line)
+- update_product_price_after_insert (bills subselect per line)
+
+Stock, running totals and buy prices are now updated in one set-based pass per
+INSERT. The API inserts all lines of a bill in a single statement.
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "26"
+
+
+def drop_row_triggers():
+    logging.info("Dropping row-level products_flow triggers...")
+    cursor.execute(
+        "DROP TRIGGER IF EXISTS trigger_update_stock_insert ON products_flow"
+    )
+    cursor.execute(
+        "DROP TRIGGER IF EXISTS trigger_update_products_flow_total_after_insert ON products_flow"
+    )
+    cursor.execute(
+        "DROP TRIGGER IF EXISTS trigger_update_product_price_after_insert ON products_flow"
+    )
+    cursor.execute("DROP FUNCTION IF EXISTS update_stock_after_insert()")
+    cursor.execute("DROP FUNCTION IF EXISTS update_products_flow_total_after_insert()")
+    cursor.execute("DROP FUNCTION IF EXISTS update_product_price_after_insert()")
+
+
+def create_statement_trigger():
+    logging.info("Creating statement-level products_flow trigger...")
+    cursor.execute(
+        """
+        CREATE OR REPLACE FUNCTION products_flow_after_insert()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            new_ids BIGINT[];
+        BEGIN
+            -- Stock first. The upsert locks the touched inventory rows in a fixed
+            -- order, so concurrent bills on the same products queue here instead
+            -- of deadlocking, and the statements below (new snapshot) see the
+            -- rows those bills committed.
+            INSERT INTO product_inventory (store_id, product_id, stock)
+            SELECT store_id, product_id, SUM(amount)
+            FROM new_products_flow
+            GROUP BY store_id, product_id
+            ORDER BY store_id, product_id
+            ON CONFLICT (store_id, product_id)
+            DO UPDATE SET stock = product_inventory.stock + EXCLUDED.stock;
+
+            -- Running total: the total of the latest earlier row that is not part
+            -- of this statement, plus the new amounts up to and including the row
+            SELECT array_agg(id) INTO new_ids FROM new_products_flow;
+
+            UPDATE products_flow pf
+            SET total = t.total
+            FROM (
+                SELECT
+                    n.id,
+                    n.store_id,
+                    COALESCE(prev.total, 0) + SUM(COALESCE(n.amount, 0)) OVER (
+                        PARTITION BY n.store_id, n.product_id, prev.id
+                        ORDER BY n.time, n.id
+                    ) AS total
+                FROM new_products_flow n
+                LEFT JOIN LATERAL (
+                    SELECT p.id, p.total
+                    FROM products_flow p
+                    WHERE p.store_id = n.store_id
+                    AND p.product_id = n.product_id
+                    AND (p.time < n.time OR (p.time = n.time AND p.id < n.id))
+                    AND p.id <> ALL(new_ids)
+                    ORDER BY p.time DESC, p.id DESC
+                    LIMIT 1
+                ) prev ON TRUE
+            ) t
+            -- ANY() keeps this an index lookup; the transition table has no
+            -- statistics and would otherwise invite a hash join over the table
+            WHERE pf.id = ANY(new_ids)
+            AND pf.id = t.id
+            AND pf.store_id = t.store_id;
+
+            -- Buy bills set the product prices (last line per product wins).
+            -- NO KEY UPDATE, the lock the UPDATE takes itself, so foreign key
+            -- checks of concurrent bills on these products do not wait.
+            PERFORM 1
+            FROM products
+            WHERE id IN (
+                SELECT n.product_id
+                FROM new_products_flow n
+                JOIN bills b ON b.id = n.bill_id AND b.store_id = n.store_id
+                WHERE b.type = 'buy'
+            )
+            ORDER BY id
+            FOR NO KEY UPDATE;
+
+            UPDATE products p
+            SET
+                wholesale_price = l.wholesale_price,
+                price = l.price
+            FROM (
+                SELECT DISTINCT ON (n.product_id) n.product_id, n.wholesale_price, n.price
+                FROM new_products_flow n
+                JOIN bills b ON b.id = n.bill_id AND b.store_id = n.store_id
+                WHERE b.type = 'buy'
+                ORDER BY n.product_id, n.id DESC
+            ) l
+            WHERE p.id = l.product_id;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    cursor.execute(
+        "DROP TRIGGER IF EXISTS trigger_products_flow_after_insert ON products_flow"
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER trigger_products_flow_after_insert
+        AFTER INSERT ON products_flow
+        REFERENCING NEW TABLE AS new_products_flow
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION products_flow_after_insert();
+        """
+    )
+
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_26 (statement-level products_flow trigger)...")
+    try:
+        drop_row_triggers()
+        create_statement_trigger()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_26 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,104 @@
+"""
+Database migration: cash_flow running totals are derived on read.
+
+update_total_after_insert locked the newest cash_flow row of the store
+(SELECT ... FOR UPDATE) and then wrote the running total into the new row, so
+every sale, cash movement, salary and installment payment of a store queued
+on that one row. The bubble-fix triggers rewrote the total of every later row
+when an amount changed or a row was deleted.
+
+This migration removes the three triggers and the cash_flow.total column.
+Inserting a cash_flow row no longer touches any other row, so terminals of the
+same store commit in parallel. GET /cash-flow computes the running total with
+a window function: the sum of everything before the requested range plus a
+running sum inside it.
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "27"
+
+
+def drop_total_triggers():
+    logging.info("Dropping cash_flow running-total triggers...")
+    cursor.execute(
+        "DROP TRIGGER IF EXISTS trigger_update_total_after_insert ON cash_flow"
+    )
+    cursor.execute(
+        "DROP TRIGGER IF EXISTS trigger_bubble_fix_total_after_update ON cash_flow"
+    )
+    cursor.execute(
+        "DROP TRIGGER IF EXISTS trigger_bubble_fix_total_after_delete ON cash_flow"
+    )
+    cursor.execute("DROP FUNCTION IF EXISTS update_total_after_insert()")
+    cursor.execute("DROP FUNCTION IF EXISTS bubble_fix_total_after_update()")
+    cursor.execute("DROP FUNCTION IF EXISTS bubble_fix_total_after_delete()")
+
+
+def drop_total_column():
+    logging.info("Dropping cash_flow.total...")
+    cursor.execute("ALTER TABLE cash_flow DROP COLUMN IF EXISTS total")
+
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_27 (cash_flow totals derived on read)...")
+    try:
+        drop_total_triggers()
+        drop_total_column()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_27 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,241 @@
+"""
+Database migration: daily cash_flow checkpoints.
+
+Since update_db_27 running totals are derived on read. This migration adds
+cash_flow_checkpoints with the closing cash total of each store and day, so a
+read starts from the latest checkpoint instead of summing the store's whole
+history:
+
+- seal_cash_flow_checkpoints(store_id) seals days once they are two days old,
+  so inserts dated today or yesterday never write a checkpoint. The leader
+  worker runs it every CASH_CHECKPOINT_INTERVAL seconds.
+- cash_flow_total_before(store_id, time) gives the store total before a time
+  (used by GET /cash-flow).
+- cash_flow_checkpoints_after_change moves the checkpoints after a backdated
+  insert, edit or delete by the difference, O(checkpoints) instead of the
+  old bubble fix over every later row.
+
+Existing history is sealed at the end. fix_cash_flow.py rebuilds or checks
+the checkpoints later on.
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "28"
+
+
+def create_checkpoints_table():
+    logging.info("Creating cash_flow_checkpoints table...")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cash_flow_checkpoints (
+            store_id BIGINT REFERENCES store_data(id),
+            day DATE,
+            total FLOAT NOT NULL,
+            PRIMARY KEY (store_id, day)
+        )
+        """
+    )
+
+
+def create_functions():
+    logging.info("Creating checkpoint functions...")
+    cursor.execute(
+        """
+        -- Seal every day up to two days ago that has movement and no checkpoint
+        -- yet. Today and yesterday stay open, so the insert path never writes a
+        -- checkpoint. Returns the number of days sealed.
+        CREATE OR REPLACE FUNCTION seal_cash_flow_checkpoints(p_store_id BIGINT)
+        RETURNS INTEGER AS $$
+        DECLARE
+            last_day DATE;
+            last_total FLOAT;
+            sealed INTEGER;
+        BEGIN
+            -- Waits for backdated writers of this store (they hold the lock
+            -- shared), so no committed row is missed or counted twice
+            PERFORM pg_advisory_xact_lock(hashtext('cash_flow_checkpoints'), p_store_id::INT);
+
+            SELECT day, total INTO last_day, last_total
+            FROM cash_flow_checkpoints
+            WHERE store_id = p_store_id
+            ORDER BY day DESC
+            LIMIT 1;
+
+            INSERT INTO cash_flow_checkpoints (store_id, day, total)
+            SELECT
+                p_store_id,
+                d.day,
+                COALESCE(last_total, 0) + SUM(d.amount) OVER (ORDER BY d.day)
+            FROM (
+                SELECT time::DATE AS day, SUM(COALESCE(amount, 0)) AS amount
+                FROM cash_flow
+                WHERE store_id = p_store_id
+                AND time >= COALESCE((last_day + 1)::TIMESTAMP, '-infinity')
+                AND time < (CURRENT_DATE - 1)::TIMESTAMP
+                GROUP BY 1
+            ) d;
+
+            GET DIAGNOSTICS sealed = ROW_COUNT;
+            RETURN sealed;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        -- Store cash total of everything before p_time: the latest checkpoint
+        -- before that day plus the rows after it
+        CREATE OR REPLACE FUNCTION cash_flow_total_before(p_store_id BIGINT, p_time TIMESTAMP)
+        RETURNS FLOAT AS $$
+        DECLARE
+            checkpoint_day DATE;
+            checkpoint_total FLOAT;
+            rest FLOAT;
+        BEGIN
+            SELECT day, total INTO checkpoint_day, checkpoint_total
+            FROM cash_flow_checkpoints
+            WHERE store_id = p_store_id
+            AND day < p_time::DATE
+            ORDER BY day DESC
+            LIMIT 1;
+
+            SELECT SUM(amount) INTO rest
+            FROM cash_flow
+            WHERE store_id = p_store_id
+            AND time >= COALESCE((checkpoint_day + 1)::TIMESTAMP, '-infinity')
+            AND time < p_time;
+
+            RETURN COALESCE(checkpoint_total, 0) + COALESCE(rest, 0);
+        END;
+        $$ LANGUAGE plpgsql STABLE;
+
+        -- A backdated insert, edit or delete moves the checkpoints from its day
+        -- on by the difference: O(checkpoints), not O(rows). Rows dated today
+        -- skip all of this.
+        CREATE OR REPLACE FUNCTION cash_flow_checkpoints_after_change()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' AND OLD.time < CURRENT_DATE THEN
+                PERFORM pg_advisory_xact_lock_shared(hashtext('cash_flow_checkpoints'), OLD.store_id::INT);
+                UPDATE cash_flow_checkpoints
+                SET total = total - COALESCE(OLD.amount, 0)
+                WHERE store_id = OLD.store_id
+                AND day >= OLD.time::DATE;
+            END IF;
+
+            IF TG_OP <> 'DELETE' AND NEW.time < CURRENT_DATE THEN
+                PERFORM pg_advisory_xact_lock_shared(hashtext('cash_flow_checkpoints'), NEW.store_id::INT);
+                UPDATE cash_flow_checkpoints
+                SET total = total + COALESCE(NEW.amount, 0)
+                WHERE store_id = NEW.store_id
+                AND day >= NEW.time::DATE;
+            END IF;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+
+def create_triggers():
+    logging.info("Creating cash_flow checkpoint triggers...")
+    cursor.execute(
+        "DROP TRIGGER IF EXISTS trigger_cash_flow_checkpoints_insert_delete ON cash_flow"
+    )
+    cursor.execute(
+        "DROP TRIGGER IF EXISTS trigger_cash_flow_checkpoints_update ON cash_flow"
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER trigger_cash_flow_checkpoints_insert_delete
+        AFTER INSERT OR DELETE ON cash_flow
+        FOR EACH ROW
+        EXECUTE FUNCTION cash_flow_checkpoints_after_change();
+
+        CREATE TRIGGER trigger_cash_flow_checkpoints_update
+        AFTER UPDATE ON cash_flow
+        FOR EACH ROW
+        WHEN (
+            NEW.amount IS DISTINCT FROM OLD.amount
+            OR NEW.time IS DISTINCT FROM OLD.time
+        )
+        EXECUTE FUNCTION cash_flow_checkpoints_after_change();
+        """
+    )
+
+
+def seal_existing_history():
+    logging.info("Sealing checkpoints for existing cash_flow history...")
+    cursor.execute("SELECT id FROM store_data ORDER BY id")
+    for store in cursor.fetchall():
+        cursor.execute(
+            "SELECT seal_cash_flow_checkpoints(%s) AS sealed", (store["id"],)
+        )
+        logging.info(
+            "Store %s: %s day(s) sealed", store["id"], cursor.fetchone()["sealed"]
+        )
+
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_28 (cash_flow checkpoints)...")
+    try:
+        create_checkpoints_table()
+        create_functions()
+        create_triggers()
+        seal_existing_history()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_28 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
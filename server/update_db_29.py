@@ -0,0 +1,245 @@
+"""
+Database migration: exact products_flow running totals.
+
+products_flow.total is the product's stock after each line in (time, id)
+order. Lines take the bill time, and bills can be backdated, so a line can
+land before rows already in the ledger. products_flow_after_insert left the
+later rows of that product unchanged (and, when a bill's lines of one product
+straddled existing rows, the later lines too).
+The FIFO profit start point ("latest row where the stock was zero") read
+those stale totals.
+
+- products_flow_after_insert now also shifts the later rows of a product
+  when a bill is backdated, and adds every earlier new line of the product. In-order bills only pay one index probe per
+  product.
+- idx_products_flow_zero_stock (partial, total = 0) makes the FIFO start
+  point an index lookup.
+- Existing totals are recomputed once.
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "29"
+
+
+def replace_trigger_function():
+    logging.info("Replacing products_flow_after_insert()...")
+    # The trigger itself (update_db_26) is unchanged
+    cursor.execute(
+        """
+        CREATE OR REPLACE FUNCTION products_flow_after_insert()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            new_ids BIGINT[];
+            late RECORD;
+        BEGIN
+            -- Stock first. The upsert locks the touched inventory rows in a fixed
+            -- order, so concurrent bills on the same products queue here instead
+            -- of deadlocking, and the statements below (new snapshot) see the
+            -- rows those bills committed.
+            INSERT INTO product_inventory (store_id, product_id, stock)
+            SELECT store_id, product_id, SUM(amount)
+            FROM new_products_flow
+            GROUP BY store_id, product_id
+            ORDER BY store_id, product_id
+            ON CONFLICT (store_id, product_id)
+            DO UPDATE SET stock = product_inventory.stock + EXCLUDED.stock;
+
+            -- Running total: the total of the latest earlier row that is not part
+            -- of this statement (as it was before this statement), plus every new
+            -- amount of the product up to and including the row
+            SELECT array_agg(id) INTO new_ids FROM new_products_flow;
+
+            UPDATE products_flow pf
+            SET total = t.total
+            FROM (
+                SELECT
+                    n.id,
+                    n.store_id,
+                    COALESCE(prev.total, 0) + SUM(COALESCE(n.amount, 0)) OVER (
+                        PARTITION BY n.store_id, n.product_id
+                        ORDER BY n.time, n.id
+                    ) AS total
+                FROM new_products_flow n
+                LEFT JOIN LATERAL (
+                    SELECT p.id, p.total
+                    FROM products_flow p
+                    WHERE p.store_id = n.store_id
+                    AND p.product_id = n.product_id
+                    AND (p.time < n.time OR (p.time = n.time AND p.id < n.id))
+                    AND p.id <> ALL(new_ids)
+                    ORDER BY p.time DESC, p.id DESC
+                    LIMIT 1
+                ) prev ON TRUE
+            ) t
+            -- ANY() keeps this an index lookup; the transition table has no
+            -- statistics and would otherwise invite a hash join over the table
+            WHERE pf.id = ANY(new_ids)
+            AND pf.id = t.id
+            AND pf.store_id = t.store_id;
+
+            -- Backdated lines (a bill time earlier than rows already in the
+            -- ledger) shift the totals of the later rows of that product, so every
+            -- stored total stays exact. The EXISTS probe is one index range scan
+            -- per product, and in-order bills stop there.
+            FOR late IN
+                SELECT g.store_id, g.product_id, g.first_time
+                FROM (
+                    SELECT store_id, product_id, MIN(time) AS first_time
+                    FROM new_products_flow
+                    GROUP BY store_id, product_id
+                ) g
+                WHERE EXISTS (
+                    SELECT 1
+                    FROM products_flow p
+                    WHERE p.store_id = g.store_id
+                    AND p.product_id = g.product_id
+                    AND p.time > g.first_time
+                    AND p.id <> ALL(new_ids)
+                )
+            LOOP
+                UPDATE products_flow p
+                SET total = p.total + COALESCE((
+                    SELECT SUM(COALESCE(n.amount, 0))
+                    FROM new_products_flow n
+                    WHERE n.store_id = p.store_id
+                    AND n.product_id = p.product_id
+                    AND (n.time < p.time OR (n.time = p.time AND n.id < p.id))
+                ), 0)
+                WHERE p.store_id = late.store_id
+                AND p.product_id = late.product_id
+                AND p.time >= late.first_time
+                AND p.id <> ALL(new_ids);
+            END LOOP;
+
+            -- Buy bills set the product prices (last line per product wins).
+            -- NO KEY UPDATE, the lock the UPDATE takes itself, so foreign key
+            -- checks of concurrent bills on these products do not wait.
+            PERFORM 1
+            FROM products
+            WHERE id IN (
+                SELECT n.product_id
+                FROM new_products_flow n
+                JOIN bills b ON b.id = n.bill_id AND b.store_id = n.store_id
+                WHERE b.type = 'buy'
+            )
+            ORDER BY id
+            FOR NO KEY UPDATE;
+
+            UPDATE products p
+            SET
+                wholesale_price = l.wholesale_price,
+                price = l.price
+            FROM (
+                SELECT DISTINCT ON (n.product_id) n.product_id, n.wholesale_price, n.price
+                FROM new_products_flow n
+                JOIN bills b ON b.id = n.bill_id AND b.store_id = n.store_id
+                WHERE b.type = 'buy'
+                ORDER BY n.product_id, n.id DESC
+            ) l
+            WHERE p.id = l.product_id;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+
+def recompute_totals():
+    logging.info("Recomputing products_flow running totals...")
+    cursor.execute(
+        """
+        UPDATE products_flow pf
+        SET total = s.running
+        FROM (
+            SELECT
+                id,
+                store_id,
+                SUM(COALESCE(amount, 0)) OVER (
+                    PARTITION BY store_id, product_id ORDER BY time, id
+                ) AS running
+            FROM products_flow
+        ) s
+        WHERE pf.id = s.id
+        AND pf.store_id = s.store_id
+        AND pf.total IS DISTINCT FROM s.running
+        """
+    )
+    logging.info("%s rows corrected", cursor.rowcount)
+
+
+def create_zero_stock_index():
+    logging.info("Creating idx_products_flow_zero_stock...")
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_products_flow_zero_stock
+        ON products_flow (store_id, product_id, time)
+        WHERE total = 0
+        """
+    )
+
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_29 (products_flow running totals)...")
+    try:
+        replace_trigger_function()
+        recompute_totals()
+        create_zero_stock_index()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_29 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
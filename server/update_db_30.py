@@ -0,0 +1,97 @@
+"""
+Database migration: idempotency keys.
+
+Adds idempotency_keys, the stored responses of POST /bill, POST /cash-flow
+and POST /admin/move-products by store and Idempotency-Key header, so a
+retried request returns the first response instead of writing twice (see
+idempotency.py).
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "30"
+
+
+def create_idempotency_keys_table():
+    logging.info("Creating idempotency_keys table...")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            store_id BIGINT REFERENCES store_data(id),
+            key VARCHAR,
+            endpoint VARCHAR NOT NULL,
+            request_hash VARCHAR NOT NULL,
+            response JSONB,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (store_id, key)
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created
+        ON idempotency_keys (created_at)
+        """
+    )
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_30 (idempotency keys)...")
+    try:
+        create_idempotency_keys_table()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_30 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
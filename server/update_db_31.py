@@ -0,0 +1,196 @@
+"""
+Database migration: maintained account balances.
+
+Adds account_balances, the balance of each store and payment method kept up
+to date by statement triggers on account_transactions, so GET /accounts and
+/shift-total no longer sum the whole ledger (see account_balances.py). Each
+account is split into slot rows and a writer adds to a slot no other open
+transaction holds, so concurrent sales never queue on one row.
+
+Existing balances are rebuilt from the ledger at the end.
+fix_account_balances.py rebuilds or checks them later on.
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "31"
+
+
+def create_account_balances_table():
+    logging.info("Creating account_balances table...")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS account_balances (
+            store_id BIGINT NOT NULL,
+            payment_method_id BIGINT NOT NULL REFERENCES payment_methods(id),
+            slot SMALLINT NOT NULL,
+            balance FLOAT NOT NULL DEFAULT 0,
+            PRIMARY KEY (store_id, payment_method_id, slot)
+        )
+        """
+    )
+
+
+def create_trigger_function():
+    logging.info("Creating account balance functions...")
+    cursor.execute(
+        """
+        -- Adds an amount to the first slot of the account that no other open
+        -- transaction holds (slot advisory lock), so writers never wait on each
+        -- other's balance rows. Rebuilds take the store lock exclusively, writers
+        -- take it shared.
+        CREATE OR REPLACE FUNCTION add_to_account_balance(
+            p_store_id BIGINT, p_method_id BIGINT, p_amount FLOAT
+        )
+        RETURNS VOID AS $$
+        DECLARE
+            s INTEGER := 0;
+        BEGIN
+            PERFORM pg_advisory_xact_lock_shared(hashtext('account_balances'), p_store_id::INT);
+
+            WHILE NOT pg_try_advisory_xact_lock(
+                hashtext('account_balance_slots'),
+                hashtext(p_store_id || '/' || p_method_id || '/' || s)
+            ) LOOP
+                s := s + 1;
+            END LOOP;
+
+            INSERT INTO account_balances (store_id, payment_method_id, slot, balance)
+            VALUES (p_store_id, p_method_id, s, p_amount)
+            ON CONFLICT (store_id, payment_method_id, slot)
+            DO UPDATE SET balance = account_balances.balance + EXCLUDED.balance;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        -- One balance update per account touched by the statement
+        CREATE OR REPLACE FUNCTION account_balances_after_change()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP <> 'DELETE' THEN
+                PERFORM add_to_account_balance(store_id, payment_method_id, SUM(amount))
+                FROM new_rows
+                GROUP BY store_id, payment_method_id;
+            END IF;
+
+            IF TG_OP <> 'INSERT' THEN
+                PERFORM add_to_account_balance(store_id, payment_method_id, -SUM(amount))
+                FROM old_rows
+                GROUP BY store_id, payment_method_id;
+            END IF;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+
+def create_triggers():
+    logging.info("Creating account_balances triggers...")
+    for name in ("insert", "delete", "update"):
+        cursor.execute(
+            f"DROP TRIGGER IF EXISTS trigger_account_balances_{name} ON account_transactions"
+        )
+    cursor.execute(
+        """
+        CREATE TRIGGER trigger_account_balances_insert
+        AFTER INSERT ON account_transactions
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION account_balances_after_change();
+
+        CREATE TRIGGER trigger_account_balances_delete
+        AFTER DELETE ON account_transactions
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION account_balances_after_change();
+
+        CREATE TRIGGER trigger_account_balances_update
+        AFTER UPDATE ON account_transactions
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION account_balances_after_change();
+        """
+    )
+
+
+def rebuild_balances():
+    logging.info("Rebuilding account balances from the ledger...")
+    # Blocks ledger writers until commit, so no row is counted twice or missed
+    cursor.execute("LOCK TABLE account_transactions IN SHARE MODE")
+    cursor.execute("TRUNCATE account_balances")
+    cursor.execute(
+        """
+        INSERT INTO account_balances (store_id, payment_method_id, slot, balance)
+        SELECT store_id, payment_method_id, 0, SUM(amount)
+        FROM account_transactions
+        GROUP BY store_id, payment_method_id
+        """
+    )
+    logging.info("%s account balance(s) written", cursor.rowcount)
+
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_31 (account balances)...")
+    try:
+        create_account_balances_table()
+        create_trigger_function()
+        create_triggers()
+        rebuild_balances()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_31 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,188 @@
+"""
+Database migration: catalog versions for GET /products/changes.
+
+Adds a version column to products and product_inventory, stamped with the id
+of the transaction that last wrote the row (stamp_catalog_version). A
+reservation made or released stamps its inventory row. Terminals keep a
+local catalog and only fetch the rows changed since their last version.
+
+Existing rows keep version 0; terminals start from a full GET /products.
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "32"
+
+
+def add_version_columns():
+    logging.info("Adding version columns...")
+    cursor.execute(
+        """
+        ALTER TABLE products
+        ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0
+        """
+    )
+    cursor.execute(
+        """
+        ALTER TABLE product_inventory
+        ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0
+        """
+    )
+
+
+def create_trigger_functions():
+    logging.info("Creating catalog version functions...")
+    cursor.execute(
+        """
+        CREATE OR REPLACE FUNCTION stamp_catalog_version()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.version := pg_current_xact_id()::TEXT::BIGINT;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION stamp_reserved_product_version()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                UPDATE product_inventory
+                SET version = pg_current_xact_id()::TEXT::BIGINT
+                WHERE store_id = OLD.store_id AND product_id = OLD.product_id;
+            END IF;
+
+            IF TG_OP <> 'DELETE' THEN
+                UPDATE product_inventory
+                SET version = pg_current_xact_id()::TEXT::BIGINT
+                WHERE store_id = NEW.store_id AND product_id = NEW.product_id;
+            END IF;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+
+def create_triggers():
+    logging.info("Creating catalog version triggers...")
+    for trigger, table in (
+        ("trigger_products_version_insert", "products"),
+        ("trigger_products_version_update", "products"),
+        ("trigger_product_inventory_version_insert", "product_inventory"),
+        ("trigger_product_inventory_version_update", "product_inventory"),
+        ("trigger_reserved_products_version", "reserved_products"),
+    ):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {table}")
+    cursor.execute(
+        """
+        CREATE TRIGGER trigger_products_version_insert
+        BEFORE INSERT ON products
+        FOR EACH ROW
+        EXECUTE FUNCTION stamp_catalog_version();
+
+        CREATE TRIGGER trigger_products_version_update
+        BEFORE UPDATE ON products
+        FOR EACH ROW
+        WHEN (OLD.* IS DISTINCT FROM NEW.*)
+        EXECUTE FUNCTION stamp_catalog_version();
+
+        CREATE TRIGGER trigger_product_inventory_version_insert
+        BEFORE INSERT ON product_inventory
+        FOR EACH ROW
+        EXECUTE FUNCTION stamp_catalog_version();
+
+        CREATE TRIGGER trigger_product_inventory_version_update
+        BEFORE UPDATE ON product_inventory
+        FOR EACH ROW
+        WHEN (OLD.* IS DISTINCT FROM NEW.*)
+        EXECUTE FUNCTION stamp_catalog_version();
+
+        CREATE TRIGGER trigger_reserved_products_version
+        AFTER INSERT OR UPDATE OR DELETE ON reserved_products
+        FOR EACH ROW
+        EXECUTE FUNCTION stamp_reserved_product_version();
+        """
+    )
+
+
+def create_indexes():
+    logging.info("Creating catalog version indexes...")
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_products_version
+        ON products (version);
+
+        CREATE INDEX IF NOT EXISTS idx_product_inventory_version
+        ON product_inventory (store_id, version);
+
+        CREATE INDEX IF NOT EXISTS idx_reserved_products_product
+        ON reserved_products (store_id, product_id);
+        """
+    )
+
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_32 (catalog versions)...")
+    try:
+        add_version_columns()
+        create_trigger_functions()
+        create_triggers()
+        create_indexes()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_32 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
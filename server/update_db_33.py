@@ -0,0 +1,125 @@
+"""
+Database migration: table change counters for ETags.
+
+Adds table_versions, a change counter per table bumped by a statement
+trigger (bump_table_version) on assosiated_parties, payment_methods, scopes
+and store_data. GET /parties, /payment-methods, /scopes and /store-data
+build their ETag from it and answer If-None-Match with 304 (see etags.py).
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "33"
+
+
+TABLES = ("assosiated_parties", "payment_methods", "scopes", "store_data")
+
+
+def create_table_versions_table():
+    logging.info("Creating table_versions...")
+    cursor.execute("CREATE SEQUENCE IF NOT EXISTS table_versions_seq")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name VARCHAR PRIMARY KEY,
+            version BIGINT NOT NULL
+        )
+        """
+    )
+
+
+def create_trigger_function():
+    logging.info("Creating bump_table_version()...")
+    cursor.execute(
+        """
+        CREATE OR REPLACE FUNCTION bump_table_version()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO table_versions (table_name, version)
+            VALUES (TG_TABLE_NAME, nextval('table_versions_seq'))
+            ON CONFLICT (table_name)
+            DO UPDATE SET version = EXCLUDED.version;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+
+def create_triggers():
+    logging.info("Creating table version triggers...")
+    for table in TABLES:
+        cursor.execute(f"DROP TRIGGER IF EXISTS trigger_{table}_table_version ON {table}")
+        cursor.execute(
+            f"""
+            CREATE TRIGGER trigger_{table}_table_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION bump_table_version()
+            """
+        )
+
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_33 (table versions)...")
+    try:
+        create_table_versions_table()
+        create_trigger_function()
+        create_triggers()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_33 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,91 @@
+"""
+Database migration: bills_collections indexes.
+
+Adds idx_bills_collections_bill on (store_id, bill_id) and
+idx_bills_collections_collection on (collection_id), so a page of
+GET /parties/bills walks the store's bills newest first and looks up their
+collections instead of joining every collection of the range.
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "35"
+
+
+def create_bills_collections_indexes():
+    logging.info("Creating bills_collections indexes...")
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_bills_collections_bill
+        ON bills_collections (store_id, bill_id)
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_bills_collections_collection
+        ON bills_collections (collection_id)
+        """
+    )
+
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_35 (bills_collections indexes)...")
+    try:
+        create_bills_collections_indexes()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_35 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,105 @@
+"""
+Database migration: users change notifications.
+
+Logged-in users are cached in every API worker (auth_middleware). This adds an
+AFTER INSERT / UPDATE / DELETE trigger on users that sends NOTIFY
+users_changed with the username (old and new on a rename), so all workers
+drop their cached copy as soon as the change commits, whichever process made
+it.
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "37"
+
+
+def create_notify_trigger():
+    logging.info("Creating users change notification trigger...")
+    cursor.execute(
+        """
+        CREATE OR REPLACE FUNCTION notify_users_change()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                PERFORM pg_notify('users_changed', COALESCE(OLD.username, ''));
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                PERFORM pg_notify('users_changed', COALESCE(NEW.username, ''));
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    cursor.execute("DROP TRIGGER IF EXISTS trigger_notify_users_change ON users")
+    cursor.execute(
+        """
+        CREATE TRIGGER trigger_notify_users_change
+        AFTER INSERT OR UPDATE OR DELETE ON users
+        FOR EACH ROW
+        EXECUTE FUNCTION notify_users_change();
+        """
+    )
+
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_37 (users notifications)...")
+    try:
+        create_notify_trigger()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_37 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
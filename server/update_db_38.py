@@ -0,0 +1,264 @@
+"""
+Database migration: running totals set as products_flow rows are written.
+
+products_flow_after_insert (update_db_26 / 29) wrote every new line twice:
+the INSERT, then an UPDATE setting its running total. Updating a row the
+transaction has just inserted re-runs its foreign key checks, and for a
+one-line sale that second pass cost more than the old row triggers did.
+
+- products_flow_before_insert (BEFORE INSERT, FOR EACH ROW) sets the total as
+  the row is written.
+- products_flow_after_insert still upserts the stock first (ordered locks).
+  It then walks the new rows in (time, id) order, shifts the later rows of a
+  backdated product, and rewrites a new total only when a concurrent bill or
+  an out-of-order line made it wrong. The buy price update only runs for
+  buy bills.
+
+Idempotent and safe to re-run.
+"""
+
+import logging
+from os import getenv
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = getenv("HOST")
+DATABASE = getenv("DATABASE")
+USER = getenv("USER")
+PASS = getenv("PASS")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+conn = psycopg2.connect(host=HOST, database=DATABASE, user=USER, password=PASS)
+cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+DB_VERSION = "38"
+
+
+def create_before_insert_trigger():
+    logging.info("Creating products_flow_before_insert()...")
+    cursor.execute(
+        """
+        -- The running total as the row is written: the latest earlier row of the
+        -- product (rows of this statement already written included) plus its
+        -- amount. In the usual case (no concurrent bill on the product, lines in
+        -- (time, id) order) it is final, and products_flow_after_insert does not
+        -- rewrite the row.
+        CREATE OR REPLACE FUNCTION products_flow_before_insert()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.total := COALESCE(NEW.amount, 0) + COALESCE((
+                SELECT p.total
+                FROM products_flow p
+                WHERE p.store_id = NEW.store_id
+                AND p.product_id = NEW.product_id
+                AND (p.time < NEW.time OR (p.time = NEW.time AND p.id < NEW.id))
+                ORDER BY p.time DESC, p.id DESC
+                LIMIT 1
+            ), 0);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    cursor.execute(
+        "DROP TRIGGER IF EXISTS trigger_products_flow_before_insert ON products_flow"
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER trigger_products_flow_before_insert
+        BEFORE INSERT ON products_flow
+        FOR EACH ROW
+        EXECUTE FUNCTION products_flow_before_insert();
+        """
+    )
+
+
+def replace_after_insert_function():
+    logging.info("Replacing products_flow_after_insert()...")
+    # The statement trigger itself (update_db_26) is unchanged
+    cursor.execute(
+        """
+        CREATE OR REPLACE FUNCTION products_flow_after_insert()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            fresh RECORD;
+            expected INTEGER;
+            has_buy BOOLEAN := FALSE;
+        BEGIN
+            -- Stock first. The upsert locks the touched inventory rows in a fixed
+            -- order, so concurrent bills on the same products queue here instead
+            -- of deadlocking, and the statements below (new snapshot) see the
+            -- rows those bills committed.
+            INSERT INTO product_inventory (store_id, product_id, stock)
+            SELECT store_id, product_id, SUM(amount)
+            FROM new_products_flow
+            GROUP BY store_id, product_id
+            ORDER BY store_id, product_id
+            ON CONFLICT (store_id, product_id)
+            DO UPDATE SET stock = product_inventory.stock + EXCLUDED.stock;
+
+            -- Running totals, each new row in (time, id) order per product
+            FOR fresh IN
+                SELECT
+                    n.id,
+                    n.store_id,
+                    n.product_id,
+                    n.time,
+                    n.amount,
+                    n.total,
+                    b.type = 'buy' AS buy,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY n.store_id, n.product_id
+                        ORDER BY n.time, n.id
+                    ) = 1 AS first_of_product
+                FROM new_products_flow n
+                LEFT JOIN bills b ON b.id = n.bill_id AND b.store_id = n.store_id
+                ORDER BY n.store_id, n.product_id, n.time, n.id
+            LOOP
+                has_buy := has_buy OR COALESCE(fresh.buy, FALSE);
+
+                -- Backdated lines (a bill time earlier than rows already in the
+                -- ledger) shift the totals of the product's later rows, so every
+                -- stored total stays exact. The EXISTS probe is one index range
+                -- scan per product, and in-order bills stop there.
+                IF fresh.first_of_product AND EXISTS (
+                    SELECT 1
+                    FROM products_flow p
+                    WHERE p.store_id = fresh.store_id
+                    AND p.product_id = fresh.product_id
+                    AND p.time >= fresh.time
+                    AND (p.time > fresh.time OR p.id > fresh.id)
+                    AND NOT EXISTS (
+                        SELECT 1
+                        FROM new_products_flow n
+                        WHERE n.id = p.id
+                        AND n.store_id = p.store_id
+                    )
+                ) THEN
+                    UPDATE products_flow p
+                    SET total = p.total + COALESCE((
+                        SELECT SUM(COALESCE(n.amount, 0))
+                        FROM new_products_flow n
+                        WHERE n.store_id = p.store_id
+                        AND n.product_id = p.product_id
+                        AND (n.time < p.time OR (n.time = p.time AND n.id < p.id))
+                    ), 0)
+                    WHERE p.store_id = fresh.store_id
+                    AND p.product_id = fresh.product_id
+                    AND p.time >= fresh.time
+                    AND (p.time > fresh.time OR p.id > fresh.id)
+                    AND NOT EXISTS (
+                        SELECT 1
+                        FROM new_products_flow n
+                        WHERE n.id = p.id
+                        AND n.store_id = p.store_id
+                    );
+                END IF;
+
+                -- The rows before this one are exact now (older rows shifted,
+                -- earlier new rows checked), so its total is the latest earlier
+                -- row's plus its amount. It is only rewritten when the total
+                -- products_flow_before_insert gave it is off: a concurrent bill
+                -- committed an earlier row before the lock above, or a later line
+                -- of this statement has an earlier time.
+                expected := COALESCE(fresh.amount, 0) + COALESCE((
+                    SELECT p.total
+                    FROM products_flow p
+                    WHERE p.store_id = fresh.store_id
+                    AND p.product_id = fresh.product_id
+                    AND (p.time < fresh.time OR (p.time = fresh.time AND p.id < fresh.id))
+                    ORDER BY p.time DESC, p.id DESC
+                    LIMIT 1
+                ), 0);
+                IF expected IS DISTINCT FROM fresh.total THEN
+                    UPDATE products_flow
+                    SET total = expected
+                    WHERE id = fresh.id
+                    AND store_id = fresh.store_id;
+                END IF;
+            END LOOP;
+
+            -- Buy bills set the product prices (last line per product wins).
+            -- NO KEY UPDATE, the lock the UPDATE takes itself, so foreign key
+            -- checks of concurrent bills on these products do not wait.
+            IF has_buy THEN
+                PERFORM 1
+                FROM products
+                WHERE id IN (
+                    SELECT n.product_id
+                    FROM new_products_flow n
+                    JOIN bills b ON b.id = n.bill_id AND b.store_id = n.store_id
+                    WHERE b.type = 'buy'
+                )
+                ORDER BY id
+                FOR NO KEY UPDATE;
+
+                UPDATE products p
+                SET
+                    wholesale_price = l.wholesale_price,
+                    price = l.price
+                FROM (
+                    SELECT DISTINCT ON (n.product_id) n.product_id, n.wholesale_price, n.price
+                    FROM new_products_flow n
+                    JOIN bills b ON b.id = n.bill_id AND b.store_id = n.store_id
+                    WHERE b.type = 'buy'
+                    ORDER BY n.product_id, n.id DESC
+                ) l
+                WHERE p.id = l.product_id;
+            END IF;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+
+def set_db_version():
+    logging.info("Recording database version %s...", DB_VERSION)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO db_meta (key, value)
+        VALUES ('version', %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """,
+        (DB_VERSION,),
+    )
+
+
+def run_migration():
+    logging.info("Starting migration update_db_38 (products_flow totals on insert)...")
+    try:
+        create_before_insert_trigger()
+        replace_after_insert_function()
+        set_db_version()
+        conn.commit()
+        logging.info("Migration update_db_38 completed successfully!")
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migration()
@@ -22,3 +22,35 @@ def to_float(value: Union[Decimal, float, int]) -> float:
     if isinstance(value, Decimal):
         return float(value)
     return float(value) if value is not None else 0.0
+
+
+def find_fifo_start_time(cur, product_id: int, store_id: int, before: datetime) -> datetime:
+    """
+    Where FIFO costing of a product has to start for a period beginning at
+    `before`: the latest line before it that left the stock at zero
+    (idx_products_flow_zero_stock), else the product's first line.
+    """
+    cur.execute(
+        """
+        SELECT pf.time
+        FROM products_flow pf
+        WHERE pf.store_id = %s AND pf.product_id = %s
+        AND pf.time < %s AND pf.total = 0 AND pf.bill_id > 0
+        ORDER BY pf.time DESC
+        LIMIT 1
+        """,
+        (store_id, product_id, before),
+    )
+    row = cur.fetchone()
+    if row:
+        return row["time"]
+    cur.execute(
+        """
+        SELECT MIN(pf.time) AS min_time
+        FROM products_flow pf
+        WHERE pf.store_id = %s AND pf.product_id = %s AND pf.bill_id > 0
+        """,
+        (store_id, product_id),
+    )
+    row = cur.fetchone()
+    return row["min_time"] if row and row["min_time"] else before